@@ -5,9 +5,13 @@ import os
 from PIL import Image
 from my_pages import (
     File_Upload, Interaction_Analysis, Residue_Depth, Energy_Heatmap,
-    Structure_View, Mutations
+    Structure_View, Mutations, Analysis_Database, Interaction_Network,
+    Ensemble_Analysis
 )
 from utility import load_text
+from lib.timing import Timeline, span
+from lib import profiling
+from lib.metrics import serve
 sys.path.append(os.path.dirname(__file__))
 
 STATE: dict
@@ -143,6 +147,117 @@ def sidebar_title() -> None:
     st.image(logo, use_column_width=True)
 
 
+def session_timeline() -> Timeline:
+    """
+    Load the timing spans of this session, and record the spans of this run
+    in them
+    :return:
+        The timeline of the session
+    """
+    if 'timeline' not in STATE.keys():
+        STATE['timeline'] = Timeline()
+    timeline: Timeline = STATE['timeline']
+    timeline.activate()
+    return timeline
+
+
+def performance_panel(container, timeline: Timeline) -> None:
+    """
+    Show how long each stage of this session took
+    :param container:
+        The sidebar container to draw the panel in
+    :param timeline:
+        The timeline of the session
+    :return:
+    """
+    with container.expander('Performance'):
+        breakdown = timeline.breakdown()
+        if breakdown.empty:
+            st.info('Nothing has been timed yet')
+            return
+        st.caption('Seconds of wall and CPU time, peak memory in MB')
+        st.dataframe(breakdown)
+        recent = timeline.frame().tail(10)
+        st.dataframe(
+            recent[['name', 'parent', 'status', 'wall', 'cpu']].round(3)
+        )
+        st.button(label='Clear Timings', on_click=timeline.clear)
+
+
+def profile_request() -> None:
+    """
+    Arm the profiler from the "profile" query parameter, which names the
+    stage to profile, or "page" for the page render. A profile is captured
+    on every run while the parameter is set, in the mode given by the
+    "profile_mode" parameter
+    :return:
+    """
+    params = st.experimental_get_query_params()
+    target = params.get('profile', [None])[0]
+    mode = params.get('profile_mode', ['sampling'])[0]
+    request = STATE.get('profile')
+    if target in profiling.STAGES and mode in profiling.MODES and (
+        request is None or not request.repeat or
+        (request.target, request.mode) != (target, mode)
+    ):
+        STATE['profile'] = profiling.ProfileRequest(target, mode, True)
+    profiling.activate(STATE.get('profile'))
+
+
+def arm_profiler() -> None:
+    """
+    Callback function to profile the next run of the selected stage
+    :return:
+    """
+    STATE['profile'] = profiling.ProfileRequest(
+        target=st.session_state['profile_target'],
+        mode=st.session_state['profile_mode']
+    )
+
+
+def profiler_panel(container) -> None:
+    """
+    Offer to profile a page render or pipeline stage, and the results of the
+    last profile as downloads
+    :param container:
+        The sidebar container to draw the panel in
+    :return:
+    """
+    request = STATE.get('profile')
+    with container.expander('Profiler'):
+        st.selectbox(
+            label='Stage',
+            options=profiling.STAGES,
+            key='profile_target'
+        )
+        st.radio(
+            label='Mode',
+            options=profiling.MODES,
+            key='profile_mode'
+        )
+        st.button(label='Profile Next Run', on_click=arm_profiler)
+        if request is not None and request.armed:
+            st.info(f'Waiting for the next run of {request.target}')
+        if request is None or request.capture is None:
+            return
+        capture = request.capture
+        st.caption(
+            f'{capture.name}: {capture.wall:.3f} s, {capture.mode} profile'
+        )
+        st.dataframe(capture.summary())
+        st.download_button(
+            label='Download Collapsed Stacks',
+            data=capture.collapsed(),
+            file_name=capture.file_name('collapsed.txt')
+        )
+        if capture.profile() is not None:
+            st.download_button(
+                label='Download cProfile Statistics',
+                data=capture.profile(),
+                file_name=capture.file_name('prof')
+            )
+
+
 def home() -> None:
     """
     Creates the Homepage Screen
@@ -170,6 +285,9 @@ PAGES = {
     'Energy Heatmap': Energy_Heatmap.main,
     'Structure View': Structure_View.main,
     'Mutations': Mutations.main,
+    'Analysis Database': Analysis_Database.main,
+    'Interaction Network': Interaction_Network.main,
+    'Ensemble Analysis': Ensemble_Analysis.main,
 }
 
 STATUS = {
@@ -207,6 +325,7 @@ def main() -> None:
         layout='wide'
     )
     ensure_state()
+    serve()
     global STATE
     STATE = st.session_state['Home']
     with st.sidebar:
@@ -217,7 +336,14 @@ def main() -> None:
         )
         for key, value in STATUS.items():
             file_status(name=key, **value)
-    PAGES[selected]()
+        performance = st.container()
+        profiler = st.container()
+    timeline = session_timeline()
+    profile_request()
+    with span(f'page:{selected}'):
+        PAGES[selected]()
+    performance_panel(performance, timeline)
+    profiler_panel(profiler)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+import sys
+import json
+import argparse
+from typing import Any, Dict, Tuple
+
+
+def load(file_name: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """
+    Read a benchmark report and index its entries by stage and size
+    :param file_name:
+        The report written by benchmarks.run
+    :return:
+    """
+    with open(file_name, 'r') as file:
+        report = json.load(file)
+    return {(x['stage'], x['size']): x for x in report['results']}
+
+
+def compare(base: str, head: str, tolerance: float = 0.1) -> int:
+    """
+    Print the change in the best time of every stage between two reports
+    :param base:
+        The report of the earlier commit
+    :param head:
+        The report of the later commit
+    :param tolerance:
+        The relative slow-down that is reported as a regression
+    :return:
+        The number of regressions and mismatches
+    """
+    before = load(base)
+    after = load(head)
+    problems = 0
+    print(f'{"stage":<20} {"size":>6} {"base":>10} {"head":>10} {"ratio":>7}')
+    for key in sorted(after.keys(), key=lambda x: (x[1], x[0])):
+        entry = after[key]
+        if entry['status'] != 'ok' or key not in before.keys() or \
+                before[key]['status'] != 'ok':
+            continue
+        ratio = entry['best'] / max(before[key]['best'], 1e-9)
+        note = ''
+        if ratio > 1 + tolerance:
+            note = '  slower'
+            problems += 1
+        if entry.get('match') is False:
+            note += '  mismatch'
+            problems += 1
+        print(
+            f'{key[0]:<20} {key[1]:>6} {before[key]["best"]:>10.4f} '
+            f'{entry["best"]:>10.4f} {ratio:>7.2f}{note}'
+        )
+    return problems
+
+
+def main() -> None:
+    """
+    Compare two benchmark reports from the command line
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare the timings of two benchmark reports'
+    )
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    sys.exit(1 if compare(args.base, args.head, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import pandas as pd
+from io import StringIO
+from typing import Dict, Hashable, List, Tuple
+from Bio.PDB.PDBParser import PDBParser
+from Bio.PDB.ResidueDepth import ResidueDepth
+
+ROWS = [
+    'fa_atr', 'fa_rep', 'fa_sol', 'fa_intra_rep', 'fa_intra_sol_xover4',
+    'lk_ball_wtd', 'fa_elec', 'pro_close', 'hbond_sr_bb', 'hbond_lr_bb',
+    'hbond_bb_sc', 'hbond_sc', 'dslf_fa13', 'omega', 'fa_dun', 'p_aa_pp',
+    'yhh_planarity', 'ref', 'rama_prepro', 'total'
+]
+
+
+def energy_summary(
+    variant: pd.DataFrame,
+    wild_type: pd.DataFrame,
+    mutations: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    The summary table of the original row-by-row energy_calc
+    :param variant:
+        The residue energy breakdown for the variant structure
+    :param wild_type:
+        The residue energy breakdown for the wild-type structure
+    :param mutations:
+        The mutations between the wild-type and variant
+    :return:
+    """
+    mutated = mutations.index.tolist()
+    results = interaction_analysis(variant, wild_type, mutated)
+    hbonds_v = hydrogen_bonds(variant)
+    hbonds_w = hydrogen_bonds(wild_type)
+    classes = [
+        (salt_bridges(variant), salt_bridges(wild_type)),
+        (sulfide_bonds(variant), sulfide_bonds(wild_type))
+    ]
+    classes.extend(
+        (hbonds_v[x], hbonds_w[x])
+        for x in ['sc_sc', 'bb_sc', 'bb_bb_sr', 'bb_bb_lr']
+    )
+    data = [
+        {x.upper(): len(y) for x, y in results.items()},
+        {x.upper(): round(y['total'].sum(), 4) if len(y) else 0
+         for x, y in results.items()},
+        {x.upper(): len(y[y['total'] >= 1]) if len(y) else 0
+         for x, y in results.items()},
+        {x.upper(): len(y[y['total'] <= -1]) if len(y) else 0
+         for x, y in results.items()}
+    ]
+    for class_v, class_w in classes:
+        changes = interaction_analysis(class_v, class_w, mutated)
+        data.append({x.upper(): len(y) for x, y in changes.items()})
+    return pd.DataFrame(data)
+
+
+def salt_bridges(interactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Find Salt Bridges
+    :param interactions:
+    :return:
+    """
+    return interactions[
+        (interactions['hbond_sc'] < 0) &
+        (
+            (
+                (interactions['restype1'].isin(['ASP', 'GLU'])) &
+                (interactions['restype2'].isin(['ARG', 'HIS', 'LYS']))
+            ) |
+            (
+                (interactions['restype1'].isin(['ARG', 'HIS', 'LYS'])) &
+                (interactions['restype2'].isin(['ASP', 'GLU']))
+            )
+        )
+    ]
+
+
+def sulfide_bonds(interactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Find Disulfide Bonds
+    :param interactions:
+    :return:
+    """
+    return interactions[
+        (
+            (interactions['restype1'] == 'CYS') &
+            (interactions['restype2'] == 'CYS')
+        ) |
+        (interactions['dslf_fa13'] < 0)
+    ]
+
+
+def hydrogen_bonds(interactions: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Find Hydrogen Bonds
+    :param interactions:
+    :return:
+    """
+    return {
+        'sc_sc': interactions[interactions['hbond_sc'] < 0],
+        'bb_sc': interactions[interactions['hbond_bb_sc'] < 0],
+        'bb_bb_sr': interactions[interactions['hbond_sr_bb'] < 0],
+        'bb_bb_lr': interactions[interactions['hbond_lr_bb'] < 0]
+    }
+
+
+def interaction_analysis(
+    variant: pd.DataFrame,
+    wild_type: pd.DataFrame,
+    mutated: List[int]
+) -> Dict[str, pd.DataFrame]:
+    """
+    Classify interactions into 6 categories one row at a time
+    :param variant:
+    :param wild_type:
+    :param mutated:
+    :return:
+    """
+    position = ['resi1', 'resi2']
+    position_v = variant[position].values.tolist()
+    position_w = wild_type[position].values.tolist()
+    changes = {x: [] for x in 'abcdef'}
+    for row in variant.iterrows():
+        touches = row[1]['resi1'] in mutated or row[1]['resi2'] in mutated
+        if row[1][position].values.tolist() in position_w:
+            changes['b' if touches else 'a'].append(
+                subtract_rows(row, wild_type)
+            )
+        else:
+            changes['f' if touches else 'e'].append(row[1].values)
+    for row in wild_type.iterrows():
+        touches = row[1]['resi1'] in mutated or row[1]['resi2'] in mutated
+        if row[1][position].values.tolist() not in position_v:
+            changes['d' if touches else 'c'].append(row[1].values)
+    results = {}
+    for key, rows in changes.items():
+        results[key] = pd.DataFrame(rows)
+        if len(rows) > 0:
+            results[key].columns = variant.columns
+    return results
+
+
+def subtract_rows(
+    row: Tuple[Hashable, pd.Series],
+    df: pd.DataFrame
+) -> list:
+    """
+    Subtract the numerical values of corresponding interactions
+    :param row:
+    :param df:
+    :return:
+    """
+    query = df[
+        (df['resi1'] == row[1]['resi1']) &
+        (df['resi2'] == row[1]['resi2'])
+    ].values
+    data = list(row[1][0:6].values)
+    data.extend(list(row[1][6:] - query[0, 6:]))
+    return data
+
+
+def fill_holes(
+    wild: pd.DataFrame,
+    variant: pd.DataFrame
+) -> Dict[str, pd.DataFrame]:
+    """
+    The original list-based hole filling of the Energy Heatmap page
+    :param wild:
+    :param variant:
+    :return:
+    """
+    cw = pd.DataFrame(wild[ROWS + ['resi1', 'resi2']], copy=True)
+    cv = pd.DataFrame(variant[ROWS + ['resi1', 'resi2']], copy=True)
+    pairs_w = cw[['resi1', 'resi2']].values.tolist()
+    pairs_v = cv[['resi1', 'resi2']].values.tolist()
+    new_values = []
+    for resi1, resi2 in [x for x in pairs_v if x not in pairs_w]:
+        row = {'resi1': resi1, 'resi2': resi2}
+        row.update({x: 0 for x in ROWS})
+        new_values.append(row)
+    cw = pd.concat([cw, pd.DataFrame(new_values)])
+    new_values = []
+    for resi1, resi2 in [x for x in pairs_w if x not in pairs_v]:
+        row = {'resi1': resi1, 'resi2': resi2}
+        row.update({x: 0 for x in ROWS})
+        new_values.append(row)
+    cv = pd.concat([cv, pd.DataFrame(new_values)])
+    cw.sort_values(by=['resi1', 'resi2'], inplace=True)
+    cv.sort_values(by=['resi1', 'resi2'], inplace=True)
+    cw.reset_index(inplace=True, drop=True)
+    cv.reset_index(inplace=True, drop=True)
+    return {'wild': cw, 'variant': cv}
+
+
+def resi_energy_map(
+    wild: pd.DataFrame,
+    variant: pd.DataFrame,
+    colormap: List[str],
+    min_value: float,
+    max_value: float
+) -> Dict[int, str]:
+    """
+    The original per-residue query loop of the Energy Heatmap page
+    :param wild:
+    :param variant:
+    :param colormap:
+    :param min_value:
+    :param max_value:
+    :return:
+    """
+    resi_max = max(
+        wild['resi1'].values.tolist() + wild['resi2'].values.tolist()
+    )
+    energy = {}
+    for i in range(1, resi_max + 1):
+        energy_wild = wild[
+            (wild['resi1'] == i) | (wild['resi2'] == i)
+        ]['total'].sum()
+        energy_variant = variant[
+            (variant['resi1'] == i) | (variant['resi2'] == i)
+        ]['total'].sum()
+        energy[i] = energy_variant - energy_wild
+    results = {}
+    for key, value in energy.items():
+        if value < min_value:
+            results[key] = colormap[0]
+        elif value > max_value:
+            results[key] = colormap[-1]
+        else:
+            index = (value - min_value) / (max_value - min_value)
+            results[key] = colormap[round(index * len(colormap))]
+    return results
+
+
+def net_energy(
+    inter: pd.DataFrame,
+    residues: List[int]
+) -> Tuple[Dict[int, float], Dict[int, list]]:
+    """
+    The original net energy loop of the Residue Depth page
+    :param inter:
+    :param residues:
+    :return:
+    """
+    entries = {}
+    net = {}
+    for i in residues:
+        query = inter[(inter['resi1'] == i) | (inter['resi2'] == i)]
+        net[i] = query['total'].sum()
+        entries[i] = query[['resi1', 'resi2', 'total']].values.tolist()
+    return net, entries
+
+
+def residue_depth(pdb_text: str, msms: str) -> Dict[int, float]:
+    """
+    The original residue depth calculation through biopython, which writes
+    the xyzr and surface files to disk and measures every atom against
+    every vertex
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param msms:
+        Filepath of the MSMS executable
+    :return:
+    """
+    parser = PDBParser()
+    parser.QUIET = True
+    structure = parser.get_structure(0, StringIO(pdb_text))
+    rd = ResidueDepth(model=structure[0], msms_exec=msms)
+    return {x[1][1]: y[0] for x, y in rd.property_dict.items()}
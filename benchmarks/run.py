@@ -0,0 +1,817 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from io import StringIO
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import legacy, synthetic
+from lib import energy_breakdown as eb
+from lib.cleaning import renumber
+from lib.depth import (
+    MSMS, SurfaceCache, residue_depth, structure_key, variant_depth
+)
+from lib.burial import residue_burial
+from lib.prescreen import prescreen
+
+DEFAULT_SIZES = [100, 300, 1000, 3000, 9999]
+PACKAGES = ['numpy', 'pandas', 'scipy', 'bokeh', 'streamlit', 'Bio']
+COLORMAP = [f'#{x:02x}{x:02x}{x:02x}' for x in range(256)]
+
+
+class Case:
+    """
+    The synthetic inputs of one benchmark size. Derived inputs are built on
+    first use and shared by all stages
+    """
+    def __init__(self, size: int, density: float, seed: int, folder: str):
+        """
+        Generate the sequences, structures and energy breakdowns
+        :param size:
+            The number of residues
+        :param density:
+            The fraction of mutated positions
+        :param seed:
+            The seed of all random draws
+        :param folder:
+            A scratch folder for the files written by the stages
+        """
+        self.size = size
+        self.folder = folder
+        self.wild_sequence = synthetic.sequence(size, seed)
+        self.variant_sequence, self.mutations = synthetic.mutate(
+            self.wild_sequence, density, seed
+        )
+        self.energy_wild = synthetic.breakdown(self.wild_sequence, seed)
+        self.energy_variant = synthetic.variant_breakdown(
+            self.energy_wild, self.variant_sequence, self.mutations, seed
+        )
+        rng = np.random.default_rng(seed)
+        self.depth = {
+            i: float(x) for i, x in enumerate(rng.gamma(2, 2, size), 1)
+        }
+        self.__cache: Dict[str, Any] = {}
+
+    def get(self, key: str, function: Callable[[], Any]) -> Any:
+        """
+        Build a derived input once
+        :param key:
+            The name of the input
+        :param function:
+            Creates the input
+        :return:
+        """
+        if key not in self.__cache.keys():
+            self.__cache[key] = function()
+        return self.__cache[key]
+
+    def structure(self, side: str) -> str:
+        """
+        The PDB file of one side, numbered from 3 to exercise renumbering
+        :param side:
+            "wild" or "variant"
+        :return:
+        """
+        residues = getattr(self, f'{side}_sequence')
+        start = min(3, synthetic.MAX_RESIDUES - self.size + 1)
+        return self.get(
+            f'pdb_{side}', lambda: synthetic.structure(residues, start)
+        )
+
+    def clean(self, side: str) -> str:
+        """
+        The renumbered PDB file of one side
+        :param side:
+            "wild" or "variant"
+        :return:
+        """
+        return self.get(
+            f'clean_{side}', lambda: renumber(self.structure(side))
+        )
+
+    def surfaces(self) -> SurfaceCache:
+        """
+        A surface cache of this case, kept apart from the application cache
+        :return:
+        """
+        return self.get(
+            'surfaces', lambda: SurfaceCache(f'{self.folder}/depth')
+        )
+
+
+class StageUnavailable(Exception):
+    """
+    Raised when a stage cannot run in this environment
+    """
+
+
+def page(name: str):
+    """
+    Import a streamlit page module
+    :param name:
+        The file name of the page without extension
+    :return:
+    """
+    try:
+        return __import__(f'my_pages.{name}', fromlist=[name])
+    except Exception as error:
+        raise StageUnavailable(
+            f'my_pages.{name} cannot be imported: {error}'
+        ) from error
+
+
+def stage_renumber(case: Case) -> str:
+    """
+    Renumber the wild-type structure
+    :param case:
+    :return:
+    """
+    return renumber(case.structure('wild'))
+
+
+def check_renumber(case: Case, result: str) -> float:
+    """
+    The number of residues whose renumbered position is wrong
+    :param case:
+    :param result:
+    :return:
+    """
+    numbers = pd.unique(np.array(
+        [int(x[22:26]) for x in result.split('\n')]
+    ))
+    expected = np.arange(1, case.size + 1)
+    if len(numbers) != len(expected):
+        return float(case.size)
+    return float(np.sum(numbers != expected))
+
+
+def stage_mutations(case: Case) -> pd.DataFrame:
+    """
+    Find the mutations with the File Upload page
+    :param case:
+    :return:
+    """
+    module = page('File_Upload')
+    module.STATE = {
+        'pdb_wild_clean': StringIO(case.clean('wild')),
+        'pdb_variant_clean': StringIO(case.clean('variant'))
+    }
+    return module.mutations()
+
+
+def check_mutations(case: Case, result: pd.DataFrame) -> float:
+    """
+    The number of mutations that differ from the generated ones
+    :param case:
+    :param result:
+    :return:
+    """
+    expected = set(case.mutations.itertuples())
+    return float(len(expected ^ set(result.itertuples())))
+
+
+def stage_depth(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the wild-type with MSMS, starting from an
+    empty surface cache
+    :param case:
+    :return:
+    """
+    case.surfaces().clear()
+    return stage_depth_cached(case)
+
+
+def stage_depth_cached(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the wild-type, reading the surface cache
+    filled by the depth stage
+    :param case:
+    :return:
+    """
+    return residue_depth(StringIO(case.clean('wild')), cache=case.surfaces())
+
+
+def stage_depth_incremental(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the variant by patching the cached
+    wild-type surface around the mutations. The variant is removed from the
+    cache first, so that a full fallback is timed rather than read back
+    :param case:
+    :return:
+    """
+    case.surfaces().discard(structure_key(case.clean('variant')))
+    return variant_depth(
+        pdb_wild=StringIO(case.clean('wild')),
+        pdb_variant=StringIO(case.clean('variant')),
+        positions=case.mutations.index,
+        cache=case.surfaces()
+    )
+
+
+def full_variant_depth(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the variant from its complete surface
+    :param case:
+    :return:
+    """
+    return residue_depth(StringIO(case.clean('variant')), cache=None)
+
+
+def legacy_depth(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the wild-type through biopython
+    :param case:
+    :return:
+    """
+    return legacy.residue_depth(case.clean('wild'), MSMS)
+
+
+def compare_depth(
+    result: Dict[int, float],
+    reference: Dict[int, float]
+) -> float:
+    """
+    The largest depth difference of any residue, in angstroms
+    :param result:
+    :param reference:
+    :return:
+    """
+    if result.keys() != reference.keys():
+        return float('inf')
+    return float(max(abs(result[x] - reference[x]) for x in reference))
+
+
+def stage_burial(case: Case) -> Dict[int, float]:
+    """
+    Estimate the residue depth of the wild-type from Shrake-Rupley points,
+    without MSMS
+    :param case:
+    :return:
+    """
+    burial = residue_burial(case.clean('wild'), ['surface_depth'])
+    return burial['surface_depth'].to_dict()
+
+
+def msms_depth(case: Case) -> Dict[int, float]:
+    """
+    Calculate the residue depth of the wild-type with MSMS
+    :param case:
+    :return:
+    """
+    return residue_depth(StringIO(case.clean('wild')), cache=None)
+
+
+def stage_prescreen(case: Case) -> pd.DataFrame:
+    """
+    Estimate the residue energy breakdown of the wild-type without Rosetta
+    :param case:
+    :return:
+    """
+    return prescreen(case.clean('wild'))
+
+
+def check_prescreen(case: Case, result: pd.DataFrame) -> float:
+    """
+    The number of columns missing from or out of place in the layout of a
+    Rosetta breakdown, plus the number of pairs out of order
+    :param case:
+    :param result:
+    :return:
+    """
+    columns = case.energy_wild.columns.tolist()
+    misplaced = sum(
+        x != y for x, y in zip(columns, result.columns.tolist())
+    ) + abs(len(columns) - len(result.columns))
+    unordered = int((result['resi1'] >= result['resi2']).sum())
+    return float(misplaced + unordered)
+
+
+def stage_convert(case: Case) -> pd.DataFrame:
+    """
+    Convert a Rosetta silent file to a breakdown table
+    :param case:
+    :return:
+    """
+    out_file = f'{case.folder}/energy_wild.out'
+    csv_file = f'{case.folder}/energy_wild.csv'
+    text = case.get('silent', lambda: synthetic.silent_file(
+        case.energy_wild, out_file, f'{case.folder}/wild.pdb'
+    ))
+    with open(out_file, 'w') as file:
+        file.write(text)
+    eb.convert_outfile(out_file, csv_file)
+    data = pd.read_csv(csv_file)
+    data = data[data['resi2'].astype(str) != '--']
+    return data.astype({'resi2': int}).reset_index(drop=True)
+
+
+def check_convert(case: Case, result: pd.DataFrame) -> float:
+    """
+    The largest difference from the breakdown that was written
+    :param case:
+    :param result:
+    :return:
+    """
+    if len(result) != len(case.energy_wild):
+        return float('inf')
+    columns = synthetic.TERMS + ['total', 'resi1', 'resi2']
+    return float(np.max(np.abs(
+        result[columns].values - case.energy_wild[columns].values
+    )))
+
+
+def stage_energy(case: Case) -> pd.DataFrame:
+    """
+    Run the interaction analysis without a cached pair table
+    :param case:
+    :return:
+    """
+    with eb.TABLES_LOCK:
+        eb.TABLES.clear()
+    return stage_energy_cached(case)
+
+
+def stage_energy_cached(case: Case) -> pd.DataFrame:
+    """
+    Run the interaction analysis, reusing the cached pair table
+    :param case:
+    :return:
+    """
+    results = eb.energy_calc(
+        case.energy_variant, case.energy_wild, case.mutations
+    )
+    return results['summary']
+
+
+def legacy_energy(case: Case) -> pd.DataFrame:
+    """
+    Run the original row-by-row interaction analysis
+    :param case:
+    :return:
+    """
+    return legacy.energy_summary(
+        case.energy_variant, case.energy_wild, case.mutations
+    )
+
+
+def compare_summary(result: pd.DataFrame, reference: pd.DataFrame) -> float:
+    """
+    The largest difference between two summary tables
+    :param result:
+    :param reference:
+    :return:
+    """
+    reference = reference.reindex(columns=result.columns).fillna(0)
+    return float(np.max(np.abs(
+        result.values.astype(float) - reference.values.astype(float)
+    )))
+
+
+def stage_fill(case: Case) -> Dict[str, pd.DataFrame]:
+    """
+    Align the wild-type and variant pairs for the heatmaps
+    :param case:
+    :return:
+    """
+    return page('Energy_Heatmap').fill_holes(
+        case.energy_wild, case.energy_variant
+    )
+
+
+def legacy_fill(case: Case) -> Dict[str, pd.DataFrame]:
+    """
+    Align the pairs with the original list-based loop
+    :param case:
+    :return:
+    """
+    return legacy.fill_holes(case.energy_wild, case.energy_variant)
+
+
+def compare_fill(
+    result: Dict[str, pd.DataFrame],
+    reference: Dict[str, pd.DataFrame]
+) -> float:
+    """
+    The largest difference between two pairs of aligned tables
+    :param result:
+    :param reference:
+    :return:
+    """
+    deviation = 0.0
+    for side in ['wild', 'variant']:
+        if len(result[side]) != len(reference[side]):
+            return float('inf')
+        columns = legacy.ROWS + ['resi1', 'resi2']
+        deviation = max(deviation, float(np.max(np.abs(
+            result[side][columns].values.astype(float) -
+            reference[side][columns].values.astype(float)
+        ))))
+    return deviation
+
+
+def stage_energy_map(case: Case) -> Dict[int, str]:
+    """
+    Color the residues by their change in net energy
+    :param case:
+    :return:
+    """
+    return page('Energy_Heatmap').resi_energy_map(
+        case.energy_wild, case.energy_variant, COLORMAP, -4, 4
+    )
+
+
+def legacy_energy_map(case: Case) -> Dict[int, str]:
+    """
+    Color the residues with the original per-residue queries
+    :param case:
+    :return:
+    """
+    return legacy.resi_energy_map(
+        case.energy_wild, case.energy_variant, COLORMAP, -4, 4
+    )
+
+
+def compare_colors(result: Dict[int, str], reference: Dict[int, str]) -> float:
+    """
+    The fraction of residues that were given another color
+    :param result:
+    :param reference:
+    :return:
+    """
+    if result.keys() != reference.keys():
+        return 1.0
+    changed = sum(result[x] != reference[x] for x in reference.keys())
+    return changed / max(len(reference), 1)
+
+
+def stage_plots(case: Case) -> Dict[int, float]:
+    """
+    Build the side-by-side and difference heatmaps and the net energy vs
+    depth scatter plot sources
+    :param case:
+    :return:
+    """
+    heatmap = page('Energy_Heatmap')
+    depth = page('Residue_Depth')
+    filled = case.get('filled', lambda: stage_fill(case))
+    tensors = heatmap.energy_tensors(case.energy_wild, case.energy_variant)
+    difference = (tensors['variant'] - tensors['wild']).frame()
+    heatmap.create_heatmap('wild', filled['wild'])
+    heatmap.create_heatmap('variant', filled['variant'])
+    heatmap.create_heatmap('Difference', difference, extrema=2)
+    mut_map = depth.changes(
+        case.energy_wild, case.energy_variant, case.mutations
+    )
+    net, entries = depth.net_energy(case.energy_variant, list(case.depth))
+    depth.create_source_variant(case.depth, net, mut_map)
+    return net
+
+
+def legacy_plots(case: Case) -> Dict[int, float]:
+    """
+    The net energies with the original Residue Depth loop
+    :param case:
+    :return:
+    """
+    return legacy.net_energy(case.energy_variant, list(case.depth))[0]
+
+
+def compare_net(
+    result: Dict[int, float],
+    reference: Dict[int, float]
+) -> float:
+    """
+    The largest difference between two net energy maps
+    :param result:
+    :param reference:
+    :return:
+    """
+    return float(max(abs(result[x] - reference[x]) for x in reference))
+
+
+STAGES = {
+    'renumber_pdb': {
+        'run': stage_renumber,
+        'check': check_renumber,
+        'tolerance': 0,
+        'structure': True
+    },
+    'mutations': {
+        'run': stage_mutations,
+        'check': check_mutations,
+        'tolerance': 0,
+        'structure': True
+    },
+    'depth': {
+        'run': stage_depth,
+        'legacy': legacy_depth,
+        'compare': compare_depth,
+        'tolerance': 1e-3,
+        'structure': True
+    },
+    'depth_cached': {
+        'run': stage_depth_cached,
+        'legacy': legacy_depth,
+        'compare': compare_depth,
+        'tolerance': 1e-3,
+        'structure': True
+    },
+    'depth_incremental': {
+        'run': stage_depth_incremental,
+        'legacy': full_variant_depth,
+        'compare': compare_depth,
+        'tolerance': 0.25,
+        'structure': True
+    },
+    'burial': {
+        'run': stage_burial,
+        'legacy': msms_depth,
+        'compare': compare_depth,
+        'tolerance': 1.5,
+        'structure': True
+    },
+    'prescreen': {
+        'run': stage_prescreen,
+        'check': check_prescreen,
+        'tolerance': 0,
+        'structure': True
+    },
+    'convert_outfile': {
+        'run': stage_convert,
+        'check': check_convert,
+        'tolerance': 1e-6
+    },
+    'energy_calc': {
+        'run': stage_energy,
+        'legacy': legacy_energy,
+        'compare': compare_summary,
+        'tolerance': 1e-3
+    },
+    'energy_calc_cached': {
+        'run': stage_energy_cached,
+        'legacy': legacy_energy,
+        'compare': compare_summary,
+        'tolerance': 1e-3
+    },
+    'fill_holes': {
+        'run': stage_fill,
+        'legacy': legacy_fill,
+        'compare': compare_fill,
+        'tolerance': 1e-3
+    },
+    'resi_energy_map': {
+        'run': stage_energy_map,
+        'legacy': legacy_energy_map,
+        'compare': compare_colors,
+        'tolerance': 0.01
+    },
+    'plot_builders': {
+        'run': stage_plots,
+        'legacy': legacy_plots,
+        'compare': compare_net,
+        'tolerance': 1e-3
+    }
+}
+
+
+def measure(function: Callable[[], Any], repeats: int) -> Dict[str, Any]:
+    """
+    Time a function several times
+    :param function:
+        The function to time
+    :param repeats:
+        The number of runs
+    :return:
+        The wall time of every run and the result of the last run
+    """
+    seconds = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return {'seconds': seconds, 'result': result}
+
+
+def run_stage(
+    name: str,
+    case: Case,
+    repeats: int,
+    legacy_limit: int,
+    limits: bool = True
+) -> Dict[str, Any]:
+    """
+    Time one stage on one case and check its result
+    :param name:
+        The name of the stage in STAGES
+    :param case:
+        The synthetic inputs
+    :param repeats:
+        The number of timed runs
+    :param legacy_limit:
+        The largest size the legacy implementation is run at
+    :param limits:
+        If False, the size limit of the stage is ignored
+    :return:
+        The report entry of the stage
+    """
+    stage = STAGES[name]
+    entry = {
+        'stage': name,
+        'size': case.size,
+        'pairs_wild': len(case.energy_wild),
+        'pairs_variant': len(case.energy_variant),
+        'status': 'ok'
+    }
+    if limits and case.size > stage.get('limit', case.size):
+        entry.update(status='skipped', reason='above the size limit')
+        return entry
+    if stage.get('structure') and case.size > synthetic.MAX_RESIDUES:
+        entry.update(status='skipped', reason='too large for a PDB file')
+        return entry
+    try:
+        timing = measure(lambda: stage['run'](case), repeats)
+    except StageUnavailable as error:
+        entry.update(status='skipped', reason=str(error))
+        return entry
+    except Exception as error:
+        entry.update(status='error', reason=f'{type(error).__name__}: {error}')
+        return entry
+    entry['seconds'] = timing['seconds']
+    entry['best'] = min(timing['seconds'])
+    entry['median'] = float(np.median(timing['seconds']))
+
+    deviation: Optional[float] = None
+    if 'check' in stage.keys():
+        deviation = stage['check'](case, timing['result'])
+    elif 'legacy' in stage.keys() and case.size <= legacy_limit:
+        reference = case.get(
+            stage['legacy'].__name__,
+            lambda: measure(lambda: stage['legacy'](case), 1)
+        )
+        entry['legacy_best'] = min(reference['seconds'])
+        entry['speedup'] = entry['legacy_best'] / max(entry['best'], 1e-9)
+        deviation = stage['compare'](timing['result'], reference['result'])
+    if deviation is not None:
+        entry['deviation'] = deviation
+        entry['match'] = bool(deviation <= stage.get('tolerance', 0))
+    return entry
+
+
+def git_commit() -> Dict[str, Any]:
+    """
+    The commit the benchmark was run on
+    :return:
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+            text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': bool(status)}
+
+
+def versions() -> Dict[str, Optional[str]]:
+    """
+    The versions of the packages the timings depend on
+    :return:
+    """
+    results = {'python': platform.python_version()}
+    for name in PACKAGES:
+        try:
+            results[name] = __import__(name).__version__
+        except ImportError:
+            results[name] = None
+    return results
+
+
+def run_benchmarks(
+    sizes: List[int],
+    stages: List[str],
+    density: float = 0.02,
+    repeats: int = 3,
+    seed: int = 0,
+    legacy_limit: int = 1000,
+    limits: bool = True
+) -> Dict[str, Any]:
+    """
+    Run the benchmark suite
+    :param sizes:
+        The numbers of residues of the synthetic proteins
+    :param stages:
+        The names of the stages to run
+    :param density:
+        The fraction of mutated positions
+    :param repeats:
+        The number of timed runs of every stage
+    :param seed:
+        The seed of the synthetic inputs
+    :param legacy_limit:
+        The largest size the legacy implementations are run at
+    :param limits:
+        If False, the size limits of the stages are ignored
+    :return:
+        The report
+    """
+    report = {
+        **git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'platform': platform.platform(),
+        'versions': versions(),
+        'parameters': {
+            'sizes': sizes,
+            'stages': stages,
+            'density': density,
+            'repeats': repeats,
+            'seed': seed,
+            'legacy_limit': legacy_limit,
+            'limits': limits
+        },
+        'results': []
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            case = Case(size, density, seed, folder)
+            for name in stages:
+                entry = run_stage(name, case, repeats, legacy_limit, limits)
+                report['results'].append(entry)
+                print(summary_line(entry), flush=True)
+    return report
+
+
+def summary_line(entry: Dict[str, Any]) -> str:
+    """
+    Describe a report entry on one line
+    :param entry:
+    :return:
+    """
+    text = f'{entry["stage"]:<20} {entry["size"]:>6}  '
+    if entry['status'] != 'ok':
+        return text + f'{entry["status"]}: {entry["reason"]}'
+    text += f'{entry["best"]:>10.4f} s'
+    if 'speedup' in entry.keys():
+        text += f'  legacy {entry["legacy_best"]:>10.4f} s' \
+                f'  x{entry["speedup"]:.1f}'
+    if 'match' in entry.keys():
+        text += '  ok' if entry['match'] else \
+            f'  MISMATCH {entry["deviation"]:g}'
+    return text
+
+
+def main() -> None:
+    """
+    Run the benchmark suite from the command line and write the report
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        description='Time every pipeline stage on synthetic proteins'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES.keys()),
+                        choices=list(STAGES.keys()))
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy-limit', type=int, default=1000)
+    parser.add_argument('--no-limits', action='store_true')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    report = run_benchmarks(
+        sizes=args.sizes,
+        stages=args.stages,
+        density=args.density,
+        repeats=args.repeats,
+        seed=args.seed,
+        legacy_limit=args.legacy_limit,
+        limits=not args.no_limits
+    )
+    output = args.output
+    if output is None:
+        name = (report['commit'] or 'unknown')[:10]
+        output = f'benchmarks/reports/{name}.json'
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Report written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import json
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+
+RESIDUES = [
+    'ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+    'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL'
+]
+TERMS = [
+    'fa_atr', 'fa_rep', 'fa_sol', 'fa_intra_rep', 'fa_intra_sol_xover4',
+    'lk_ball_wtd', 'fa_elec', 'pro_close', 'hbond_sr_bb', 'hbond_lr_bb',
+    'hbond_bb_sc', 'hbond_sc', 'dslf_fa13', 'omega', 'fa_dun', 'p_aa_pp',
+    'yhh_planarity', 'ref', 'rama_prepro'
+]
+BACKBONE = {
+    'N': (-0.53, 1.36, 0.0),
+    'CA': (0.0, 0.0, 0.0),
+    'C': (1.52, 0.0, 0.0),
+    'O': (2.15, 1.05, 0.0),
+    'CB': (-0.53, -0.77, 1.21)
+}
+HELIX_LENGTH = 20
+HELIX_SPACING = 10.0
+MAX_RESIDUES = 9999
+
+
+def sequence(size: int, seed: int = 0) -> List[str]:
+    """
+    A random sequence of residue names
+    :param size:
+        The number of residues
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    return list(rng.choice(RESIDUES, size))
+
+
+def mutate(
+    residues: List[str],
+    density: float,
+    seed: int = 0
+) -> Tuple[List[str], pd.DataFrame]:
+    """
+    Introduce point mutations into a sequence
+    :param residues:
+        The wild-type sequence of residue names
+    :param density:
+        The fraction of positions to mutate
+    :param seed:
+    :return:
+        The variant sequence and the mutations dataframe in the layout of
+        the File Upload page
+    """
+    rng = np.random.default_rng(seed + 1)
+    count = max(1, int(round(density * len(residues))))
+    positions = np.sort(rng.choice(len(residues), count, replace=False))
+    variant = list(residues)
+    for i in positions:
+        choices = [x for x in RESIDUES if x != residues[i]]
+        variant[i] = choices[rng.integers(len(choices))]
+    with open('lib/aa_map.json', 'r') as file:
+        aa_map = json.load(file)
+    mutations = pd.DataFrame({
+        'Position': positions + 1,
+        'Mutated': [aa_map[variant[i]] for i in positions],
+        'Wild': [aa_map[residues[i]] for i in positions]
+    })
+    return variant, mutations.set_index('Position')
+
+
+def coordinates(size: int) -> np.ndarray:
+    """
+    Place the alpha carbons of a protein on a bundle of antiparallel helices
+    packed on a square grid
+    :param size:
+        The number of residues
+    :return:
+        An array of shape (size, 3)
+    """
+    number = np.arange(size)
+    helix = number // HELIX_LENGTH
+    step = number % HELIX_LENGTH
+    width = int(np.ceil(np.sqrt(size / HELIX_LENGTH)))
+    direction = np.where(helix % 2 == 0, 1, -1)
+    rise = np.where(direction > 0, step, HELIX_LENGTH - 1 - step) * 1.5
+    angle = np.radians(100.0 * number)
+    return np.column_stack([
+        (helix % width) * HELIX_SPACING + 2.3 * np.cos(angle),
+        (helix // width) * HELIX_SPACING + 2.3 * np.sin(angle),
+        rise
+    ])
+
+
+def structure(residues: List[str], start: int = 1) -> str:
+    """
+    Write a single-chain PDB file with backbone and beta carbon atoms
+    :param residues:
+        The sequence of residue names
+    :param start:
+        The number of the first residue, to exercise renumbering
+    :return:
+        The contents of the PDB file
+    """
+    if len(residues) + start - 1 > MAX_RESIDUES:
+        raise ValueError(f'PDB files hold at most {MAX_RESIDUES} residues')
+    rows = []
+    serial = 1
+    for number, (name, center) in enumerate(
+        zip(residues, coordinates(len(residues)))
+    ):
+        for atom, offset in BACKBONE.items():
+            if atom == 'CB' and name == 'GLY':
+                continue
+            x, y, z = center + np.array(offset)
+            rows.append(
+                f'ATOM  {serial:>5} {atom:<4} {name:>3} A'
+                f'{number + start:>4}    {x:>8.3f}{y:>8.3f}{z:>8.3f}'
+                f'{1.0:>6.2f}{0.0:>6.2f}           {atom[0]}'
+            )
+            serial += 1
+    rows.append('TER')
+    rows.append('END')
+    return '\n'.join(rows)
+
+
+def breakdown(
+    residues: List[str],
+    seed: int = 0,
+    partners: int = 8
+) -> pd.DataFrame:
+    """
+    A residue energy breakdown with random score terms. Every residue
+    interacts with a few residues further along the chain
+    :param residues:
+        The sequence of residue names
+    :param seed:
+    :param partners:
+        The number of partner residues drawn for every residue
+    :return:
+        The breakdown in the layout read from Rosetta
+    """
+    rng = np.random.default_rng(seed)
+    size = len(residues)
+    first = np.repeat(np.arange(1, size + 1), partners)
+    second = first + rng.integers(1, 30, len(first))
+    keep = second <= size
+    pairs = np.unique(np.column_stack([first[keep], second[keep]]), axis=0)
+    names = np.array(residues)
+    data = pd.DataFrame({
+        'resi1': pairs[:, 0],
+        'pdbid1': [f'{x}A' for x in pairs[:, 0]],
+        'restype1': names[pairs[:, 0] - 1],
+        'resi2': pairs[:, 1],
+        'pdbid2': [f'{x}A' for x in pairs[:, 1]],
+        'restype2': names[pairs[:, 1] - 1]
+    })
+    values = rng.normal(0, 0.5, (len(pairs), len(TERMS)))
+    values *= rng.random((len(pairs), len(TERMS))) < 0.4
+    for number, term in enumerate(TERMS):
+        data[term] = values[:, number].round(3)
+    data['total'] = data[TERMS].sum(axis=1).round(3)
+    return data
+
+
+def variant_breakdown(
+    wild: pd.DataFrame,
+    residues: List[str],
+    mutations: pd.DataFrame,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Derive the breakdown of a variant from the wild-type breakdown: pairs
+    touching a mutation are rescored, and a few other pairs are rescored,
+    lost or gained
+    :param wild:
+        The residue energy breakdown of the wild-type
+    :param residues:
+        The variant sequence of residue names
+    :param mutations:
+        The mutations dataframe
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed + 2)
+    data = wild.copy()
+    names = np.array(residues)
+    data['restype1'] = names[data['resi1'].values - 1]
+    data['restype2'] = names[data['resi2'].values - 1]
+    touched = data['resi1'].isin(mutations.index) | \
+        data['resi2'].isin(mutations.index)
+    changed = touched.values | (rng.random(len(data)) < 0.05)
+    values = rng.normal(0, 0.5, (int(changed.sum()), len(TERMS)))
+    data.loc[changed, TERMS] = values.round(3)
+    data.loc[changed, 'total'] = data.loc[changed, TERMS].sum(axis=1).round(3)
+    lost = rng.random(len(data)) < 0.02
+    gained = breakdown(residues, seed + 3, partners=1)
+    gained = gained.sample(frac=0.1, random_state=seed)
+    data = pd.concat([data[~lost], gained])
+    data = data.drop_duplicates(['resi1', 'resi2'])
+    return data.sort_values(['resi1', 'resi2'], ignore_index=True)
+
+
+def silent_file(data: pd.DataFrame, file_name: str, pose: str) -> str:
+    """
+    Write a breakdown as Rosetta Energy Breakdown silent output, with the
+    one-body row of every residue ahead of its pairs
+    :param data:
+        The residue energy breakdown
+    :param file_name:
+        The path the silent file will be written to, which sets the header
+        offset that convert_outfile corrects
+    :param pose:
+        The pose identifier written on every row
+    :return:
+        The contents of the silent file
+    """
+    spacer = len(file_name) - 17
+    onebody = data.drop_duplicates('resi1')[['resi1', 'pdbid1', 'restype1']]
+    onebody = onebody.assign(
+        resi2='--', pdbid2='--', restype2='onebody',
+        **{x: 0.0 for x in TERMS + ['total']}
+    )
+    rows = pd.concat([onebody, data], ignore_index=True)
+    rows['order'] = np.where(rows['resi2'].astype(str) == '--', 0, 1)
+    rows = rows.sort_values(['resi1', 'order'], kind='stable')
+    rows = rows.drop(columns='order')
+    for term in TERMS + ['total']:
+        rows[term] = rows[term].map('{:.3f}'.format)
+    columns = list(rows.columns)
+    text = rows.astype(str).values
+    widths = [
+        max(len(x), max(len(y) for y in text[:, i])) + 2
+        for i, x in enumerate(columns)
+    ]
+    width = max(len(pose) + 1, spacer + len('pose_id') + 1)
+    lines = ['SCORE:' + f'{"pose_id":>{width - spacer}}' + ''.join(
+        f'{x:>{w}}' for x, w in zip(columns, widths)
+    ) + '  description']
+    for row in text:
+        lines.append('SCORE:' + f'{pose:>{width}}' + ''.join(
+            f'{x:>{w}}' for x, w in zip(row, widths)
+        ) + '  pose_0001')
+    return '\n'.join(lines)
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, Tuple
+from Bio.PDB.Polypeptide import is_aa
+from scipy.spatial import cKDTree
+from lib.msms import atom_radii, read_atoms, residue_depth
+
+NEIGHBOUR_RADIUS = 10.0
+HSE_RADIUS = 13.0
+SASA_PROBE = 1.4
+SPHERE_POINTS = 30
+CHUNK_ATOMS = 20000
+METRICS = {
+    'depth': 'Residue Depth from Surface',
+    'surface_depth': 'Approximate Depth from Surface',
+    'neighbours': f'Neighbours within {NEIGHBOUR_RADIUS:.0f} A',
+    'hse_up': 'Half Sphere Exposure (Up)',
+    'hse_down': 'Half Sphere Exposure (Down)',
+    'sasa': 'Solvent Accessible Surface Area'
+}
+SURFACE_METRICS = ['surface_depth', 'sasa']
+PSEUDO_CB = (-0.58273431, 0.56802827, -0.54067466)
+
+
+def sphere_points(count: int = SPHERE_POINTS) -> np.ndarray:
+    """
+    Spread points evenly over the unit sphere along a golden section spiral
+    :param count:
+        The number of points
+    :return:
+        The unit vectors, shape (count, 3)
+    """
+    index = np.arange(count) + 0.5
+    z = 1 - 2 * index / count
+    ring = np.sqrt(1 - z ** 2)
+    angle = np.pi * (3 - np.sqrt(5)) * index
+    return np.column_stack([ring * np.cos(angle), ring * np.sin(angle), z])
+
+
+def shrake_rupley(
+    coordinates: np.ndarray,
+    radii: np.ndarray,
+    probe_radius: float = SASA_PROBE,
+    points: int = SPHERE_POINTS
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the solvent accessible surface area of every atom with the
+    Shrake-Rupley algorithm. Every atom is covered with points at its radius
+    plus the probe radius, and a point is accessible unless it lies inside
+    the expanded sphere of another atom. Rather than searching around every
+    point, the overlapping pairs of expanded spheres are found once with a
+    KD-tree, and every pair buries the points of the first atom whose
+    projection on the pair axis falls below a threshold
+    :param coordinates:
+        The atom centers, shape (n, 3)
+    :param radii:
+        The atom radii
+    :param probe_radius:
+        The radius of the solvent probe in angstroms
+    :param points:
+        The number of points on every atom
+    :return:
+        The accessible area of every atom in square angstroms, the atom
+        every accessible point belongs to and the unit vector of that point
+    """
+    sphere = sphere_points(points)
+    expanded = radii + probe_radius
+    pairs = cKDTree(coordinates).query_pairs(
+        2 * float(expanded.max()), output_type='ndarray'
+    )
+    offset = coordinates[pairs[:, 0]] - coordinates[pairs[:, 1]]
+    distance = np.sum(offset ** 2, axis=1)
+    overlap = distance < expanded[pairs].sum(axis=1) ** 2
+    pairs = np.concatenate([pairs[overlap], pairs[overlap][:, ::-1]])
+    offset = np.concatenate([offset[overlap], -offset[overlap]])
+    distance = np.tile(distance[overlap], 2)
+    order = np.argsort(pairs[:, 0], kind='stable')
+    atoms, pairs = pairs[order, 0], pairs[order]
+    offset, distance = offset[order], distance[order]
+    own, other = expanded[pairs[:, 0]], expanded[pairs[:, 1]]
+    threshold = (other ** 2 - own ** 2 - distance) / (2 * own)
+    unit = sphere.T.astype(np.float32)
+    buried = np.zeros((len(coordinates), points), dtype=bool)
+    bounds = np.searchsorted(
+        atoms, np.arange(0, len(coordinates) + CHUNK_ATOMS, CHUNK_ATOMS)
+    )
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        projection = offset[start:end].astype(np.float32) @ unit
+        hidden = projection < threshold[start:end, None]
+        first = np.flatnonzero(np.diff(atoms[start:end], prepend=-1))
+        buried[atoms[start:end][first]] = np.logical_or.reduceat(
+            hidden, first, axis=0
+        )
+    area = 4 * np.pi * expanded ** 2 / points
+    owner, dot = np.nonzero(~buried)
+    return (points - buried.sum(axis=1)) * area, owner, sphere[dot]
+
+
+def residue_centres(atoms: pd.DataFrame) -> pd.DataFrame:
+    """
+    Find the alpha carbon of every amino acid and the direction of its side
+    chain. Residues without a beta carbon, such as glycine, use the pseudo
+    beta carbon placed from the backbone atoms
+    :param atoms:
+        The atom table created by read_atoms
+    :return:
+        A dataframe indexed by chain and residue number, with the alpha
+        carbon coordinates and the unit side chain vector
+    """
+    atoms = atoms[atoms['resname'].map(is_aa)]
+    names = atoms['name'].str.strip()
+    position = {
+        x: atoms[names == x].drop_duplicates(['chain', 'resi'])
+        .set_index(['chain', 'resi'])[['x', 'y', 'z']]
+        for x in ['N', 'CA', 'C', 'CB']
+    }
+    residues = atoms[['chain', 'resi']].drop_duplicates()
+    index = pd.MultiIndex.from_frame(residues)
+    ca, n, c, cb = (
+        position[x].reindex(index).values for x in ['CA', 'N', 'C', 'CB']
+    )
+    b, c = ca - n, c - ca
+    a = np.cross(b, c)
+    pseudo = ca + PSEUDO_CB[0] * a + PSEUDO_CB[1] * b + PSEUDO_CB[2] * c
+    side = np.where(np.isnan(cb), pseudo, cb) - ca
+    with np.errstate(invalid='ignore', divide='ignore'):
+        side /= np.linalg.norm(side, axis=1, keepdims=True)
+    return pd.DataFrame(
+        np.column_stack([ca, side]), index=index,
+        columns=['x', 'y', 'z', 'side_x', 'side_y', 'side_z']
+    )
+
+
+def neighbour_count(
+    centres: pd.DataFrame,
+    radius: float = NEIGHBOUR_RADIUS
+) -> np.ndarray:
+    """
+    Count the alpha carbons within a distance of every alpha carbon
+    :param centres:
+        The residue table created by residue_centres
+    :param radius:
+        The distance in angstroms
+    :return:
+        The number of other residues in reach, NaN without an alpha carbon
+    """
+    coordinates = centres[['x', 'y', 'z']].values
+    known = ~np.isnan(coordinates).any(axis=1)
+    counts = np.full(len(centres), np.nan)
+    tree = cKDTree(coordinates[known])
+    counts[known] = tree.query_ball_point(
+        coordinates[known], r=radius, return_length=True
+    ) - 1
+    return counts
+
+
+def half_sphere_exposure(
+    centres: pd.DataFrame,
+    radius: float = HSE_RADIUS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the alpha carbons within a distance of every alpha carbon by the
+    plane normal to its side chain vector, following Hamelryck's half
+    sphere exposure
+    :param centres:
+        The residue table created by residue_centres
+    :param radius:
+        The radius of the sphere in angstroms
+    :return:
+        The number of residues on the side chain side and on the opposite
+        side, NaN where the side chain vector is unknown
+    """
+    coordinates = centres[['x', 'y', 'z']].values
+    side = centres[['side_x', 'side_y', 'side_z']].values
+    known = np.flatnonzero(~np.isnan(np.hstack([coordinates, side])).any(1))
+    pairs = cKDTree(coordinates[known]).query_pairs(
+        radius, output_type='ndarray'
+    )
+    first, second = known[pairs[:, 0]], known[pairs[:, 1]]
+    offset = coordinates[second] - coordinates[first]
+    ups = [
+        np.sum(side[first] * offset, axis=1) > 0,
+        np.sum(side[second] * -offset, axis=1) > 0
+    ]
+    up, down = np.full(len(centres), np.nan), np.full(len(centres), np.nan)
+    up[known], down[known] = 0, 0
+    for residues, is_up in zip([first, second], ups):
+        up += np.bincount(residues[is_up], minlength=len(centres))
+        down += np.bincount(residues[~is_up], minlength=len(centres))
+    return up, down
+
+
+def residue_burial(
+    pdb_text: str,
+    metrics: Iterable[str] = ('surface_depth', 'neighbours', 'hse_up'),
+    probe_radius: float = SASA_PROBE,
+    points: int = SPHERE_POINTS
+) -> pd.DataFrame:
+    """
+    Estimate how deeply every residue is buried without MSMS. Neighbour
+    counts and half sphere exposure only need the alpha carbons. The
+    surface metrics run Shrake-Rupley over every atom: the accessible area
+    of every residue, and an approximate depth. The surface of MSMS lies one
+    probe radius inside the accessible probe centres, so the depth of an
+    atom is its distance to the closest accessible point less the probe
+    radius
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param metrics:
+        The keys of METRICS to calculate, other than "depth"
+    :param probe_radius:
+        The radius of the solvent probe in angstroms
+    :param points:
+        The number of Shrake-Rupley points on every atom
+    :return:
+        A dataframe indexed by residue number with one column per metric.
+        When several chains share a number the last chain is kept
+    """
+    metrics = list(metrics)
+    unknown = set(metrics) - set(METRICS.keys()) | {'depth'} & set(metrics)
+    if unknown:
+        raise ValueError(f'Unknown burial metrics: {sorted(unknown)}')
+    atoms = read_atoms(pdb_text)
+    centres = residue_centres(atoms)
+    results = pd.DataFrame(index=centres.index)
+    if 'neighbours' in metrics:
+        results['neighbours'] = neighbour_count(centres)
+    if {'hse_up', 'hse_down'} & set(metrics):
+        results['hse_up'], results['hse_down'] = half_sphere_exposure(
+            centres
+        )
+    if set(SURFACE_METRICS) & set(metrics):
+        coordinates = atoms[['x', 'y', 'z']].values
+        radii = atom_radii(atoms['resname'].values, atoms['name'].values)
+        area, owner, directions = shrake_rupley(
+            coordinates, radii, probe_radius, points
+        )
+        if 'sasa' in metrics:
+            sasa = atoms[['chain', 'resi']].assign(sasa=area)
+            results['sasa'] = sasa.groupby(['chain', 'resi'])['sasa'].sum()
+        if 'surface_depth' in metrics:
+            reach = radii[owner, None] + probe_radius
+            accessible = coordinates[owner] + reach * directions
+            depth = residue_depth(atoms, accessible) - probe_radius
+            results['surface_depth'] = depth.reindex(
+                results.index.get_level_values('resi')
+            ).values
+    results = results[[x for x in metrics if x in results.columns]]
+    results = results.reset_index().drop_duplicates('resi', keep='last')
+    return results.set_index('resi').drop(columns='chain')
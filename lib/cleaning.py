@@ -0,0 +1,98 @@
+import re
+import pandas as pd
+from io import StringIO
+from typing import List
+
+COLUMNS = [
+    (0, 6), (6, 11), (12, 16), (17, 20), (21, 22), (22, 26),
+    (30, 38), (38, 46), (46, 54), (54, 60), (60, 66), (66, 80)
+]
+
+
+def adjust_pdb(x: str) -> str:
+    """
+    Internal format adjuster for cleaning PDB files
+    :param x:
+    :return:
+    """
+    initial = len(x)
+    if initial == 1:
+        x += '  '
+    if initial == 2:
+        x += ' '
+    if x[0].isnumeric() and initial == 3:
+        x += ' '
+    return x
+
+
+def find_start(data: str) -> int:
+    """
+    Internal format adjuster for cleaning PDB files
+    :param data:
+    :return:
+    """
+    start = data.find(re.findall(r'\w\w\w \w', data)[0]) + 5
+    number = ''
+    final = False
+    while len(number) == 0 or not final:
+        if data[start].isnumeric():
+            number += data[start]
+        elif len(number) > 0:
+            final = True
+        start += 1
+    return int(number)
+
+
+def renumber(text: str) -> str:
+    """
+    Keep the ATOM records of a PDB file and renumber them so that the first
+    residue is at position 1. The records are read at their fixed PDB
+    columns, so four digit residue numbers next to the chain are kept
+    :param text:
+        The contents of a single-model PDB file
+    :return:
+        The contents of the cleaned PDB file
+    """
+    temp_file = StringIO()
+    rows = [x for x in text.split('\n') if x[0:4] == 'ATOM']
+    offset = 1 - find_start(rows[0])
+    temp_file.write('\n'.join(rows))
+    temp_file.seek(0)
+    data = pd.read_fwf(temp_file, header=None, colspecs=COLUMNS)
+
+    data.columns = [
+        'ATOM', 'atom_number', 'PDB_atom', 'resi_3', 'resi_1',
+        'resi_number', 'A', 'B', 'C', 'D', 'E', 'atom'
+    ]
+    data['resi_number'] = data['resi_number'] + offset
+    data['PDB_atom'] = data['PDB_atom'].apply(adjust_pdb)
+    rows = []
+    spacing = [4, 7, 5, 4, 2, 4, 12, 8, 8, 6, 6, 12]
+    for row in data.itertuples(index=False):
+        rows.append(''.join(f'{x:>{y}}' for x, y in zip(row, spacing)))
+    return '\n'.join(rows)
+
+
+def split_models(text: str) -> List[str]:
+    """
+    Split a multi-model PDB file, such as an NMR ensemble or a trajectory
+    of MD snapshots, into one PDB text per model
+    :param text:
+        The contents of the PDB file
+    :return:
+        The models in file order. A file without MODEL records is returned
+        as a single model
+    """
+    models = []
+    current = []
+    for line in text.split('\n'):
+        if line[0:5] == 'MODEL':
+            current = []
+        elif line[0:6] == 'ENDMDL':
+            models.append('\n'.join(current))
+            current = []
+        else:
+            current.append(line)
+    if not models:
+        return [text]
+    return models
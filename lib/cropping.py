@@ -0,0 +1,222 @@
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from io import StringIO
+from threading import Lock
+from typing import Dict, Iterable, Tuple
+from lib.msms import read_atoms
+from lib.spatial import NeighbourIndex, load_atoms
+from lib.energy_breakdown import score_structure
+from lib.timing import span
+from lib.metrics import cache_lookup
+
+SHELL_RADIUS = 8.0
+BUFFER_RADIUS = 6.0
+BREAKDOWN_CACHE_SIZE = 4
+BREAKDOWNS: Dict[str, pd.DataFrame] = OrderedDict()
+BREAKDOWNS_LOCK = Lock()
+
+
+def residue_table(pdb_text: str) -> pd.DataFrame:
+    """
+    List the residues of a structure in file order with the numbers Rosetta
+    gives them
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :return:
+        A dataframe with the chain, PDB number, Rosetta pdbid label and pose
+        number of every residue
+    """
+    atoms = read_atoms(pdb_text)
+    residues = atoms[['chain', 'resi']].drop_duplicates().reset_index(
+        drop=True
+    )
+    residues['pdbid'] = residues['resi'].astype(str) + residues['chain']
+    residues['pose'] = np.arange(1, len(residues) + 1)
+    return residues
+
+
+def crop(pdb_text: str, residues: Iterable[int]) -> str:
+    """
+    Keep the atoms of some residues of a structure. The kept residues keep
+    their PDB numbers, so that their Rosetta pdbid labels identify them in
+    the complete structure
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param residues:
+        The positions of the residues to keep
+    :return:
+        The contents of the cropped PDB file
+    """
+    kept = set(int(x) for x in residues)
+    rows = [
+        x for x in pdb_text.split('\n')
+        if x.startswith(('ATOM', 'HETATM')) and int(x[22:26]) in kept
+    ]
+    return '\n'.join(rows + ['END'])
+
+
+def crop_region(
+    pdb_wild: StringIO,
+    pdb_variant: StringIO,
+    positions: Iterable[int],
+    radius: float = SHELL_RADIUS,
+    buffer: float = BUFFER_RADIUS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the residues around the mutations whose pairs are rescored, and the
+    residues scored with them to give those pairs their environment
+    :param pdb_wild:
+        The cleaned wild-type PDB file
+    :param pdb_variant:
+        The cleaned variant PDB file
+    :param positions:
+        The mutated positions
+    :param radius:
+        The radius of the mutation shell in angstroms
+    :param buffer:
+        The distance from the shell within which residues are kept in the
+        cropped structures, in angstroms
+    :return:
+        The sorted positions of the shell, and of the shell and its buffer
+    """
+    indexes = [NeighbourIndex(load_atoms(x)) for x in [pdb_wild, pdb_variant]]
+    positions = list(positions)
+    shell = np.union1d(*[x.shell(positions, radius) for x in indexes])
+    region = np.union1d(*[x.shell(shell, buffer) for x in indexes])
+    return shell, region
+
+
+def full_breakdown(
+    pdb_text: str,
+    name: str,
+    executable: str,
+    folder: str = 'lib/storage'
+) -> pd.DataFrame:
+    """
+    Score a complete structure with Rosetta, reusing the breakdown when the
+    same structure has been scored before. Every run writes its files to a
+    temporary folder of its own, so concurrent jobs never share them
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param name:
+        The name of the structure, used for the files written to disk
+    :param executable:
+        Filepath of the Rosetta executable to run
+    :param folder:
+        The folder the temporary folder of every Rosetta run is created in
+    :return:
+        The residue energy breakdown dataframe
+    """
+    key = hashlib.sha256(f'{executable}\n{pdb_text}'.encode()).hexdigest()
+    with BREAKDOWNS_LOCK:
+        if key in BREAKDOWNS.keys():
+            BREAKDOWNS.move_to_end(key)
+            cache_lookup('breakdown', True, len(BREAKDOWNS))
+            return BREAKDOWNS[key]
+    with tempfile.TemporaryDirectory(dir=folder) as scratch:
+        energy = score_structure(pdb_text, name, executable, scratch)
+    with BREAKDOWNS_LOCK:
+        BREAKDOWNS[key] = energy
+        while len(BREAKDOWNS) > BREAKDOWN_CACHE_SIZE:
+            BREAKDOWNS.popitem(last=False)
+        cache_lookup('breakdown', False, len(BREAKDOWNS))
+    return energy
+
+
+def map_numbering(energy: pd.DataFrame, pdb_text: str) -> pd.DataFrame:
+    """
+    Renumber the breakdown of a cropped structure with the pose numbers of
+    the complete structure, matching residues by their pdbid labels
+    :param energy:
+        The residue energy breakdown of the cropped structure
+    :param pdb_text:
+        The contents of the complete cleaned PDB file
+    :return:
+        A renumbered copy of the breakdown
+    """
+    pose = residue_table(pdb_text).set_index('pdbid')['pose']
+    energy = energy.copy()
+    for i in ['1', '2']:
+        energy[f'resi{i}'] = energy[f'pdbid{i}'].astype(str).str.strip().map(
+            pose
+        ).astype(int).values
+    return energy
+
+
+def splice(
+    full: pd.DataFrame,
+    cropped: pd.DataFrame,
+    shell: np.ndarray
+) -> pd.DataFrame:
+    """
+    Replace the pairs of a complete breakdown that involve the shell with
+    the pairs of a cropped breakdown
+    :param full:
+        The breakdown of the complete wild-type structure
+    :param cropped:
+        The renumbered breakdown of a cropped structure
+    :param shell:
+        The positions of the mutation shell
+    :return:
+        The combined breakdown, ordered by position
+    """
+    inside = full['resi1'].isin(shell) | full['resi2'].isin(shell)
+    kept = cropped['resi1'].isin(shell) | cropped['resi2'].isin(shell)
+    energy = pd.concat([full[~inside], cropped[kept]], ignore_index=True)
+    energy = energy.sort_values(['resi1', 'resi2'], kind='stable')
+    return energy.reset_index(drop=True)
+
+
+def cropped_breakdowns(
+    pdb_wild: StringIO,
+    pdb_variant: StringIO,
+    positions: Iterable[int],
+    executable: str,
+    radius: float = SHELL_RADIUS,
+    buffer: float = BUFFER_RADIUS,
+    folder: str = 'lib/storage'
+) -> Dict[str, pd.DataFrame]:
+    """
+    Score a variant with Rosetta by rescoring only the region around its
+    mutations. The shell of residues near the mutations and a buffer around
+    it are cut out of both structures and scored. Pairs involving the shell
+    come from the cropped structures, and every other pair is taken from
+    the complete wild-type breakdown, which is scored once and cached. Both
+    breakdowns share the pairs outside the shell, so their differences are
+    confined to it and the wild-type and variant shells are scored in the
+    same environment
+    :param pdb_wild:
+        The cleaned wild-type PDB file
+    :param pdb_variant:
+        The cleaned variant PDB file
+    :param positions:
+        The mutated positions
+    :param executable:
+        Filepath of the Rosetta executable to run
+    :param radius:
+        The radius of the mutation shell in angstroms
+    :param buffer:
+        The distance from the shell within which residues are kept in the
+        cropped structures, in angstroms
+    :param folder:
+        The folder the temporary folder of every Rosetta run is created in
+    :return:
+        The wild-type and variant residue energy breakdowns
+    """
+    texts = {'wild': pdb_wild.getvalue(), 'variant': pdb_variant.getvalue()}
+    full = full_breakdown(texts['wild'], 'wild', executable, folder)
+    shell, region = crop_region(
+        pdb_wild, pdb_variant, positions, radius, buffer
+    )
+    results = {}
+    for side, text in texts.items():
+        with span('rosetta_crop', structure=side, residues=len(region)), \
+                tempfile.TemporaryDirectory(dir=folder) as scratch:
+            cropped = score_structure(
+                crop(text, region), f'{side}_crop', executable, scratch
+            )
+        results[side] = splice(full, map_numbering(cropped, text), shell)
+    return results
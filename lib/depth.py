@@ -0,0 +1,346 @@
+import os
+import hashlib
+import numpy as np
+from io import StringIO
+from threading import Lock
+from typing import Dict, Iterable, Optional
+from scipy.spatial import cKDTree
+from lib.timing import span
+from lib.metrics import cache_lookup
+from lib.msms import (
+    MSMS, PROBE_RADIUS, DENSITY, atom_depth, atom_radii, read_atoms,
+    residue_average, surface, residue_depth as average_depth
+)
+
+CACHE_PATH = 'lib/storage/depth'
+CACHE_BYTES = 256 * 2 ** 20
+ENTRY_VERSION = 3
+PATCH_RADIUS = 6.0
+PATCH_BUFFER = 5.0
+PATCH_FRACTION = 0.5
+
+
+class SurfaceCache:
+    """
+    A bounded on-disk cache of MSMS surfaces and residue depths, keyed by
+    the contents of the structure and the surface parameters. The least
+    recently used entries are evicted once the cache outgrows its size
+    """
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_BYTES):
+        """
+        Open the cache. Its folder is created with the first entry
+        :param path:
+            The folder the entries are stored in
+        :param max_bytes:
+            The largest total size of the entries
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.__lock = Lock()
+
+    def __file(self, key: str) -> str:
+        """
+        The file of an entry
+        :param key:
+        :return:
+        """
+        return os.path.join(self.path, f'{key}.npz')
+
+    def __len__(self) -> int:
+        """
+        The number of entries
+        :return:
+        """
+        if not os.path.isdir(self.path):
+            return 0
+        return len([x for x in os.listdir(self.path) if x.endswith('.npz')])
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Load an entry and mark it as recently used
+        :param key:
+        :return:
+            The stored arrays, or None when the entry is missing
+        """
+        file_name = self.__file(key)
+        with self.__lock:
+            try:
+                with np.load(file_name) as data:
+                    entry = {x: data[x] for x in data.files}
+                os.utime(file_name)
+            except (OSError, ValueError):
+                entry = None
+        cache_lookup('depth', entry is not None, len(self))
+        return entry
+
+    def put(self, key: str, entry: Dict[str, np.ndarray]) -> None:
+        """
+        Store an entry and evict the least recently used entries beyond the
+        size limit
+        :param key:
+        :param entry:
+            The arrays to store
+        :return: None
+        """
+        os.makedirs(self.path, exist_ok=True)
+        file_name = self.__file(key)
+        with self.__lock:
+            with open(f'{file_name}.tmp', 'wb') as stream:
+                np.savez(stream, **entry)
+            os.replace(f'{file_name}.tmp', file_name)
+            self.__evict()
+
+    def discard(self, key: str) -> None:
+        """
+        Remove one entry if it exists
+        :param key:
+        :return: None
+        """
+        with self.__lock:
+            if os.path.isfile(self.__file(key)):
+                os.remove(self.__file(key))
+
+    def clear(self) -> None:
+        """
+        Remove every entry
+        :return: None
+        """
+        with self.__lock:
+            if not os.path.isdir(self.path):
+                return
+            for file_name in os.listdir(self.path):
+                if file_name.endswith('.npz'):
+                    os.remove(os.path.join(self.path, file_name))
+
+    def __evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits
+        :return: None
+        """
+        files = [
+            os.path.join(self.path, x) for x in os.listdir(self.path)
+            if x.endswith('.npz')
+        ]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(x) for x in files)
+        while files and total > self.max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+
+SURFACES = SurfaceCache()
+
+
+def structure_key(
+    pdb_text: str,
+    probe_radius: float = PROBE_RADIUS,
+    density: float = DENSITY
+) -> str:
+    """
+    Address a surface by the atoms of the structure and the MSMS parameters,
+    so that the same structure uploaded again shares its entry
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param probe_radius:
+        The MSMS probe radius in angstroms
+    :param density:
+        The MSMS vertex density per square angstrom
+    :return:
+        A hexadecimal digest
+    """
+    digest = hashlib.sha256(
+        f'{ENTRY_VERSION}:{probe_radius}:{density}'.encode()
+    )
+    for line in pdb_text.splitlines():
+        if line.startswith(('ATOM', 'HETATM')):
+            digest.update(line.rstrip().encode())
+    return digest.hexdigest()
+
+
+def surface_entry(
+    pdb_text: str,
+    msms: str = MSMS,
+    cache: Optional[SurfaceCache] = SURFACES,
+    probe_radius: float = PROBE_RADIUS,
+    density: float = DENSITY
+) -> Dict[str, np.ndarray]:
+    """
+    Load the surface and residue depths of a structure from the cache, or
+    run MSMS and store them. Only the first surface component is kept, as
+    Biopython does, and the atoms are stored with their depths so that
+    variants can be patched without reading the structure again
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param msms:
+        Filepath of the MSMS executable
+    :param cache:
+        The surface cache, or None to always run MSMS
+    :param probe_radius:
+        The MSMS probe radius in angstroms
+    :param density:
+        The MSMS vertex density per square angstrom
+    :return:
+        The surface vertices and normals, the depth of every residue, and
+        the coordinates, residue number and depth of every atom
+    """
+    key = structure_key(pdb_text, probe_radius, density)
+    entry = None if cache is None else cache.get(key)
+    if entry is not None:
+        return entry
+    atoms = read_atoms(pdb_text)
+    coordinates = atoms[['x', 'y', 'z']].values
+    with span('msms', atoms=len(atoms)):
+        result = surface(
+            coordinates=coordinates,
+            radii=atom_radii(atoms['resname'].values, atoms['name'].values),
+            probe_radius=probe_radius,
+            density=density,
+            msms=msms
+        )
+    depths = atom_depth(coordinates, result.vertices)
+    depth = residue_average(atoms, depths)
+    entry = {
+        'vertices': result.vertices,
+        'normals': result.normals,
+        'residues': depth.index.values,
+        'depth': depth.values,
+        'coordinates': coordinates,
+        'atom_residues': atoms['resi'].values,
+        'atom_depth': depths
+    }
+    if cache is not None:
+        cache.put(key, entry)
+    return entry
+
+
+def residue_depth(
+    pdb_file: StringIO,
+    msms: str = MSMS,
+    cache: Optional[SurfaceCache] = SURFACES,
+    probe_radius: float = PROBE_RADIUS,
+    density: float = DENSITY
+) -> Dict[int, float]:
+    """
+    Calculate the depth of every residue below the solvent excluded surface
+    of MSMS. Structures seen before are read from the cache without running
+    MSMS
+    :param pdb_file:
+        The cleaned PDB file
+    :param msms:
+        Filepath of the MSMS executable
+    :param cache:
+        The surface cache, or None to always run MSMS
+    :param probe_radius:
+        The MSMS probe radius in angstroms
+    :param density:
+        The MSMS vertex density per square angstrom
+    :return:
+        The average atom depth of every residue, keyed by residue number
+    """
+    entry = surface_entry(
+        pdb_file.getvalue(), msms, cache, probe_radius, density
+    )
+    return dict(zip(entry['residues'].tolist(), entry['depth'].tolist()))
+
+
+def variant_depth(
+    pdb_wild: StringIO,
+    pdb_variant: StringIO,
+    positions: Iterable[int],
+    radius: float = PATCH_RADIUS,
+    msms: str = MSMS,
+    cache: Optional[SurfaceCache] = SURFACES,
+    probe_radius: float = PROBE_RADIUS,
+    density: float = DENSITY
+) -> Dict[int, float]:
+    """
+    Calculate the residue depth of a variant by patching the wild-type
+    surface around the mutated positions. MSMS only triangulates the atoms
+    near the mutations, and the surface within the patch radius of the
+    mutated residues of either structure is replaced by that local surface.
+    Every outer component of the patch is kept, since the crop may split
+    into several pieces and the first one need not contain the mutations.
+    Elsewhere the variant is assumed to keep the wild-type surface, so only
+    the residues with an atom closer to the patch than to its wild-type
+    surface are measured again, and every other residue keeps its cached
+    wild-type depth. The result is therefore an approximation. When the
+    wild-type surface is not cached yet, when the patch would cover most of
+    the structure, or when MSMS cannot triangulate it, the variant is
+    calculated in full
+    :param pdb_wild:
+        The cleaned wild-type PDB file
+    :param pdb_variant:
+        The cleaned variant PDB file
+    :param positions:
+        The mutated residue positions
+    :param radius:
+        The distance from any atom of a mutated residue within which the
+        surface is regenerated, in angstroms
+    :param msms:
+        Filepath of the MSMS executable
+    :param cache:
+        The surface cache holding the wild-type, or None to always calculate
+        the variant in full
+    :param probe_radius:
+        The MSMS probe radius in angstroms
+    :param density:
+        The MSMS vertex density per square angstrom
+    :return:
+        The average atom depth of every residue, keyed by residue number
+    """
+    wild = None if cache is None else cache.get(
+        structure_key(pdb_wild.getvalue(), probe_radius, density)
+    )
+    if wild is None:
+        return residue_depth(pdb_variant, msms, cache, probe_radius, density)
+    depth = dict(zip(wild['residues'].tolist(), wild['depth'].tolist()))
+    positions = np.asarray(list(positions), dtype=np.int64)
+    atoms = read_atoms(pdb_variant.getvalue())
+    coordinates = atoms[['x', 'y', 'z']].values
+    mutated = np.concatenate([
+        coordinates[atoms['resi'].isin(positions).values],
+        wild['coordinates'][np.isin(wild['atom_residues'], positions)]
+    ])
+    if not len(mutated):
+        return depth
+    tree = cKDTree(mutated)
+    crop = np.isfinite(tree.query(
+        coordinates, distance_upper_bound=radius + PATCH_BUFFER
+    )[0])
+    if crop.mean() > PATCH_FRACTION:
+        return residue_depth(pdb_variant, msms, cache, probe_radius, density)
+    try:
+        with span('msms_patch', atoms=int(crop.sum())):
+            patch = surface(
+                coordinates=coordinates[crop],
+                radii=atom_radii(
+                    atoms['resname'].values[crop],
+                    atoms['name'].values[crop]
+                ),
+                probe_radius=probe_radius,
+                density=density,
+                msms=msms,
+                all_components=True
+            )
+    except RuntimeError:
+        return residue_depth(pdb_variant, msms, cache, probe_radius, density)
+    inside_wild = np.isfinite(
+        tree.query(wild['vertices'], distance_upper_bound=radius)[0]
+    )
+    inside_patch = np.isfinite(
+        tree.query(patch.vertices, distance_upper_bound=radius)[0]
+    )
+    vertices = np.concatenate([
+        wild['vertices'][~inside_wild], patch.vertices[inside_patch]
+    ])
+    reach = radius + wild['atom_depth']
+    distance = tree.query(
+        wild['coordinates'], distance_upper_bound=float(reach.max())
+    )[0]
+    changed = np.union1d(
+        np.unique(wild['atom_residues'][distance <= reach]), positions
+    )
+    near = atoms[atoms['resi'].isin(changed).values]
+    depth.update(average_depth(near, vertices).to_dict())
+    return depth
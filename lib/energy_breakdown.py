@@ -1,10 +1,42 @@
-import sys
 import os
+import copy
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple, Hashable
-from streamlit.elements.progress import ProgressMixin
-sys.path.append(os.path.dirname(__file__))
-from rosetta import rosetta_simple
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Dict, Optional, Tuple
+from lib.rosetta import rosetta_simple
+from lib.fingerprint import frame_hash
+from lib.jobs import Progress
+from lib.interactions import (
+    CHANGES, PRECISION, THRESHOLDS, PairTable, InteractionResults
+)
+from lib.geometry import GEOMETRY, contact_distances, pair_lookup
+from lib.reweight import reweight_table
+from lib.timing import span
+from lib.metrics import cache_lookup
+
+CHUNK_SIZE = 20000
+TABLE_CACHE_SIZE = 4
+HBOND_CLASSES = [
+    'hbonds_sc_sc', 'hbonds_bb_sc', 'hbonds_bb_bb_sr', 'hbonds_bb_bb_lr'
+]
+DEFAULT_CUTOFFS = {
+    'salt_changes': 0.0,
+    'sulfide_changes': 0.0,
+    'hbonds_sc_sc': 0.0,
+    'hbonds_bb_sc': 0.0,
+    'hbonds_bb_bb_sr': 0.0,
+    'hbonds_bb_bb_lr': 0.0
+}
+DEFAULT_DISTANCES = {
+    'salt': 4.0,
+    'sc_sc': 3.5,
+    'bb_sc': 3.5,
+    'bb_bb': 3.5
+}
+TABLES: Dict[Tuple[str, str], PairTable] = OrderedDict()
+TABLES_LOCK = Lock()
 
 
 def run(
@@ -61,117 +93,353 @@ def convert_outfile(
     os.remove(f'{file_name[:-3]}txt')
 
 
+def score_structure(
+    pdb_text: str,
+    name: str,
+    executable: str,
+    folder: str = 'lib/storage'
+) -> pd.DataFrame:
+    """
+    Score a cleaned structure with the Rosetta Energy Breakdown Protocol
+    and read the result
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param name:
+        The name of the structure, used for the files written to disk
+    :param executable:
+        Filepath of the Rosetta executable to run
+    :param folder:
+        The folder the input, output and log files are written to
+    :return:
+        The residue energy breakdown dataframe
+    """
+    with open(f'{folder}/{name}.pdb', 'w') as file:
+        file.write(pdb_text)
+    with span('rosetta', structure=name):
+        run(
+            file_name=f'{folder}/{name}.pdb',
+            save_path=f'{folder}/energy_{name}.out',
+            log_path=f'{folder}/log_{name}.txt',
+            executable=executable
+        )
+    with span('parse', structure=name):
+        convert_outfile(
+            file_name=f'{folder}/energy_{name}.out',
+            save_path=f'{folder}/energy_{name}.csv'
+        )
+        energy = pd.read_csv(f'{folder}/energy_{name}.csv')
+        energy.drop(energy[energy['resi2'] == '--'].index, inplace=True)
+        energy['resi2'] = energy['resi2'].astype(int)
+    os.remove(f'{folder}/energy_{name}.csv')
+    os.remove(f'{folder}/energy_{name}.out')
+    return energy
+
+
+def pair_table(wild_type: pd.DataFrame, variant: pd.DataFrame) -> PairTable:
+    """
+    Join the wild-type and variant breakdowns, reusing the joined table when
+    the same pair of breakdowns has been joined before
+    :param wild_type:
+        The residue energy breakdown for the wild-type structure
+    :param variant:
+        The residue energy breakdown for the variant structure
+    :return:
+        The union table of wild-type and variant pairs
+    """
+    key = (frame_hash(wild_type), frame_hash(variant))
+    with TABLES_LOCK:
+        if key in TABLES.keys():
+            TABLES.move_to_end(key)
+            cache_lookup('pair_table', True, len(TABLES))
+            return TABLES[key]
+    position = ['resi1', 'resi2']
+    table = PairTable(
+        wild_type.drop_duplicates(position),
+        variant.drop_duplicates(position)
+    )
+    with TABLES_LOCK:
+        TABLES[key] = table
+        while len(TABLES) > TABLE_CACHE_SIZE:
+            TABLES.popitem(last=False)
+        cache_lookup('pair_table', False, len(TABLES))
+    return table
+
+
 def energy_calc(
     variant: pd.DataFrame,
     wild_type: pd.DataFrame,
     mutations: pd.DataFrame,
-    bar: ProgressMixin
-) -> Dict[str, pd.DataFrame or Dict[str, pd.DataFrame]]:
+    progress: Progress = None,
+    chunk_size: int = CHUNK_SIZE,
+    shell: Optional[np.ndarray] = None,
+    atoms_wild: Optional[pd.DataFrame] = None,
+    atoms_variant: Optional[pd.DataFrame] = None,
+    cutoffs: Optional[Dict[str, float]] = None,
+    thresholds: Tuple[float, float] = THRESHOLDS,
+    weights: Optional[Dict[str, float]] = None,
+    max_distances: Optional[Dict[str, float]] = None
+) -> InteractionResults:
     """
-    Identify Important Changes in Interaction Energies
+    Identify Important Changes in Interaction Energies. The joined pair
+    table is cached, so repeating the analysis with other mutations,
+    cutoffs, thresholds or weights only recomputes the classification
     :param variant:
         The residue energy breakdown for the variant structure
     :param wild_type:
         The residue energy breakdown for the wild-type structure
     :param mutations:
         The mutations between the wild-type and variant
-    :param bar:
-        The streamlit progressbar to push updates to
+    :param progress:
+        Progress counter that receives an update after the join, the
+        geometry, the reweighting, the class masks of each structure and
+        every classified chunk of pairs, and signals cancellation. Work it
+        already recorded, such as loading the structures, is kept
+    :param chunk_size:
+        The number of pairs processed between progress updates
+    :param shell:
+        If provided, only pairs involving at least one of these positions
+        are analyzed, such as the residues near the mutations. The other
+        pairs are skipped before the classes are determined
+    :param atoms_wild:
+        The atom table of the wild-type. When both atom tables are provided
+        a salt bridge or hydrogen bond also needs its charged groups or its
+        donor and acceptor within max_distances of each other
+    :param atoms_variant:
+        The atom table of the variant
+    :param cutoffs:
+        The energy below which a pair counts as a member of an interaction
+        class. Classes that are not listed use DEFAULT_CUTOFFS
+    :param thresholds:
+        The upper and lower total energy thresholds counted in the summary
+    :param weights:
+        If provided, the total score of every pair is recomputed with these
+        score term weights before the analysis
+    :param max_distances:
+        The longest charged-group and donor-acceptor distances of a salt
+        bridge and of every kind of hydrogen bond. Kinds that are not listed
+        use DEFAULT_DISTANCES
     :return:
-        A dictionary containing assorted dataframes
+        The interaction results, which can be accessed like a dictionary
+        containing assorted dataframes
     """
-    bar.progress(5)
-    results = interaction_analysis(
-        variant, wild_type, mutations.index.tolist()
-    )
-    bar.progress(25)
-    salt_changes = interaction_analysis(
-        salt_bridges(variant),
-        salt_bridges(wild_type),
-        mutations.index.tolist()
-    )
-    bar.progress(35)
-    sulfide_changes = interaction_analysis(
-        sulfide_bonds(variant),
-        sulfide_bonds(wild_type),
-        mutations.index.tolist()
-    )
-    bar.progress(45)
-    hbonds_v = hydrogen_bonds(variant)
-    hbonds_w = hydrogen_bonds(wild_type)
-    hbonds_sc_sc = interaction_analysis(
-        hbonds_v['sc_sc'],
-        hbonds_w['sc_sc'],
-        mutations.index.tolist()
-    )
-    bar.progress(55)
-    hbonds_bb_sc = interaction_analysis(
-        hbonds_v['bb_sc'],
-        hbonds_w['bb_sc'],
-        mutations.index.tolist()
-    )
-    bar.progress(65)
-    hbonds_bb_bb_sr = interaction_analysis(
-        hbonds_v['bb_bb_sr'],
-        hbonds_w['bb_bb_sr'],
-        mutations.index.tolist()
-    )
-    bar.progress(75)
-    hbonds_bb_bb_lr = interaction_analysis(
-        hbonds_v['bb_bb_lr'],
-        hbonds_w['bb_bb_lr'],
-        mutations.index.tolist()
+    if progress is None:
+        progress = Progress()
+    joined = len(wild_type) + len(variant)
+    done = progress.done
+    progress.resize(done + 4 * joined)
+    progress.check()
+    with span('interaction_analysis') as entry:
+        with span('pair_table'):
+            table = pair_table(wild_type, variant)
+        entry['attributes']['pairs'] = len(table)
+        rows = slice(None) if shell is None else np.flatnonzero(
+            np.isin(table.resi1, shell) | np.isin(table.resi2, shell)
+        )
+        selected = len(table.resi1[rows])
+        measure = atoms_wild is not None and atoms_variant is not None
+        progress.resize(
+            done + joined + 2 * len(table) * measure +
+            len(table) * bool(weights) + 3 * selected
+        )
+        progress.advance(joined)
+        if measure:
+            with span('geometry'):
+                columns = measure_geometry(
+                    table, atoms_wild, atoms_variant, progress
+                )
+            table = copy.copy(table)
+            table.extra = {**table.extra, **columns}
+        if weights:
+            table = reweight_table(table, weights)
+            progress.advance(len(table))
+        masks = {}
+        for side in ['wild', 'variant']:
+            present = getattr(table, f'in_{side}')[rows]
+            distances = {
+                x: table.extra[f'{x}_{side}'][rows] for x in DEFAULT_DISTANCES
+            } if measure else {}
+            masks[side] = {
+                x: y & present for x, y in class_masks(
+                    table.side_frame(side, rows), cutoffs, distances,
+                    max_distances
+                ).items()
+            }
+            progress.advance(selected)
+        with span('classify'):
+            index = classify(
+                table=table,
+                masks_wild=masks['wild'],
+                masks_variant=masks['variant'],
+                mutated=mutations.index.tolist(),
+                progress=progress,
+                chunk_size=chunk_size,
+                rows=rows
+            )
+        return InteractionResults(table, index, thresholds=thresholds)
+
+
+def measure_geometry(
+    table: PairTable,
+    atoms_wild: pd.DataFrame,
+    atoms_variant: pd.DataFrame,
+    progress: Optional[Progress] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Measure the shortest charged-group and donor-acceptor distances of both
+    structures for every pair of the union table. The table itself is left
+    unchanged, since it may be shared through the cache
+    :param table:
+        The union of the wild-type and variant pairs
+    :param atoms_wild:
+        The atom table of the wild-type
+    :param atoms_variant:
+        The atom table of the variant
+    :param progress:
+        If provided, advanced by the number of pairs after each structure
+    :return:
+        One distance column per kind of contact and structure, such as
+        "salt_wild"
+    """
+    columns = {}
+    for side, atoms in [('wild', atoms_wild), ('variant', atoms_variant)]:
+        for kind, contacts in contact_distances(atoms).items():
+            columns[f'{kind}_{side}'] = pair_lookup(
+                table.resi1, table.resi2, contacts
+            )
+        if progress is not None:
+            progress.advance(len(table))
+    return columns
+
+
+def classify(
+    table: PairTable,
+    masks_wild: Dict[str, np.ndarray],
+    masks_variant: Dict[str, np.ndarray],
+    mutated: List[int],
+    progress: Progress,
+    chunk_size: int = CHUNK_SIZE,
+    rows: np.ndarray or slice = slice(None)
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Classify interactions into 6 categories for every interaction class
+    :param table:
+        The union of the wild-type and variant pairs
+    :param masks_wild:
+        Class membership of the selected pairs in the wild-type
+    :param masks_variant:
+        Class membership of the selected pairs in the variant
+    :param mutated:
+        The mutated residues between the variant and wild-type
+    :param progress:
+        Progress counter that is advanced by the number of pairs after every
+        chunk
+    :param chunk_size:
+        The number of pairs processed between progress updates
+    :param rows:
+        The union table positions the masks describe, such as the pairs
+        that involve the mutation shell. Other pairs are left unclassified
+    :return:
+        For every class, the union table positions of each change type
+    """
+    positions = np.arange(len(table))[rows]
+    resi1_all, resi2_all = table.resi1[rows], table.resi2[rows]
+    mutated = np.asarray(mutated, dtype=np.int64)
+    codes = {
+        x: np.full(len(positions), -1, dtype=np.int8)
+        for x in masks_wild.keys()
+    }
+    for start in range(0, len(positions), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        resi1 = resi1_all[chunk]
+        resi2 = resi2_all[chunk]
+        touches = np.isin(resi1, mutated) | np.isin(resi2, mutated)
+        for key in codes.keys():
+            in_w = masks_wild[key][chunk]
+            in_v = masks_variant[key][chunk]
+            code = np.select([in_w & in_v, in_w, in_v], [0, 2, 4], -1)
+            codes[key][chunk] = np.where(code >= 0, code + touches, -1)
+        progress.advance(len(resi1))
+
+    index = {}
+    for key, code in codes.items():
+        index[key] = {}
+        for number, change in enumerate(CHANGES):
+            rows = positions[np.flatnonzero(code == number)]
+            order = table.order_wild if change in ['c', 'd'] \
+                else table.order_variant
+            rows = rows[np.argsort(order[rows], kind='stable')]
+            index[key][change] = rows.astype(np.int32)
+    return index
+
+
+def class_masks(
+    interactions: pd.DataFrame,
+    cutoffs: Optional[Dict[str, float]] = None,
+    distances: Optional[Dict[str, np.ndarray]] = None,
+    max_distances: Optional[Dict[str, float]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Determine the interaction classes every pair belongs to
+    :param interactions:
+        The residue energy breakdown dataframe
+    :param cutoffs:
+        The energy below which a pair counts as a member of each class.
+        Classes that are not listed use DEFAULT_CUTOFFS
+    :param distances:
+        If provided, the shortest distance of every pair for each kind of
+        contact, as returned by measure_geometry for one structure
+    :param max_distances:
+        The longest distance of each kind of contact. Kinds that are not
+        listed use DEFAULT_DISTANCES
+    :return:
+        A boolean array for each interaction class
+    """
+    cutoffs = {**DEFAULT_CUTOFFS, **(cutoffs or {})}
+    max_distances = {**DEFAULT_DISTANCES, **(max_distances or {})}
+    distances = distances or {}
+    hbonds = hydrogen_bond_masks(
+        interactions, {x[7:]: cutoffs[x] for x in HBOND_CLASSES},
+        distances, max_distances
     )
-    bar.progress(85)
-    data = [
-        {x.upper(): len(y) for x, y in results.items()},
-        {x.upper(): round(y['total'].sum(), 4) for x, y in results.items()},
-        {x.upper(): len(y[y['total'] >= 1]) for x, y in results.items()},
-        {x.upper(): len(y[y['total'] <= -1]) for x, y in results.items()},
-        {x.upper(): len(y) for x, y in salt_changes.items()},
-        {x.upper(): len(y) for x, y in sulfide_changes.items()},
-        {x.upper(): len(y) for x, y in hbonds_sc_sc.items()},
-        {x.upper(): len(y) for x, y in hbonds_bb_sc.items()},
-        {x.upper(): len(y) for x, y in hbonds_bb_bb_sr.items()},
-        {x.upper(): len(y) for x, y in hbonds_bb_bb_lr.items()}
-    ]
-    bar.progress(95)
-    data = pd.DataFrame(data)
-    data.index = [
-        'Changes',
-        'Sum',
-        'Energy > 1',
-        'Energy < -1',
-        'Salt Bridge',
-        'Sulfide Bonds',
-        'SC-SC HBonds',
-        'BB-SC HBonds',
-        'BB-BB-SR HBonds',
-        'BB-BB-LR HBonds'
-    ]
-    bar.progress(99)
-    return {
-        'summary': data,
-        'all_changes': results,
-        'salt_changes': salt_changes,
-        'sulfide_changes': sulfide_changes,
-        'hbonds_sc_sc': hbonds_sc_sc,
-        'hbonds_bb_sc': hbonds_bb_sc,
-        'hbonds_bb_bb_sr': hbonds_bb_bb_sr,
-        'hbonds_bb_bb_lr': hbonds_bb_bb_lr
+    masks = {
+        'all_changes': pd.Series(True, index=interactions.index),
+        'salt_changes': salt_bridge_mask(
+            interactions, cutoffs['salt_changes'], distances.get('salt'),
+            max_distances['salt']
+        ),
+        'sulfide_changes': sulfide_bond_mask(
+            interactions, cutoffs['sulfide_changes']
+        ),
+        'hbonds_sc_sc': hbonds['sc_sc'],
+        'hbonds_bb_sc': hbonds['bb_sc'],
+        'hbonds_bb_bb_sr': hbonds['bb_bb_sr'],
+        'hbonds_bb_bb_lr': hbonds['bb_bb_lr']
     }
+    return {x: y.values.astype(bool) for x, y in masks.items()}
 
 
-def salt_bridges(interactions: pd.DataFrame) -> pd.DataFrame:
+def salt_bridge_mask(
+    interactions: pd.DataFrame,
+    cutoff: float = 0.0,
+    distance: Optional[np.ndarray] = None,
+    max_distance: float = DEFAULT_DISTANCES['salt']
+) -> pd.Series:
     """
     Find Salt Bridges
     :param interactions:
         The residue energy breakdown dataframe
+    :param cutoff:
+        The side-chain hydrogen bond energy a salt bridge must fall below
+    :param distance:
+        If provided, the shortest charged-group distance of every pair
+    :param max_distance:
+        The longest charged-group distance of a salt bridge
     :return:
-        A dataframe of the salt bridge interactions
+        A boolean series marking the salt bridge interactions
     """
-    query = interactions[
-        (interactions['hbond_sc'] < 0) &
+    close = True if distance is None else distance <= max_distance
+    return (
+        (interactions['hbond_sc'] < cutoff) & close &
         (
             (
                 (interactions['restype1'].isin(['ASP', 'GLU'])) &
@@ -182,225 +450,172 @@ def salt_bridges(interactions: pd.DataFrame) -> pd.DataFrame:
                 (interactions['restype2'].isin(['ASP', 'GLU']))
             )
         )
-    ]
-    return query
+    )
 
 
-def sulfide_bonds(interactions: pd.DataFrame) -> pd.DataFrame:
+def salt_bridges(interactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Find Salt Bridges
+    :param interactions:
+        The residue energy breakdown dataframe
+    :return:
+        A dataframe of the salt bridge interactions
+    """
+    return interactions[salt_bridge_mask(interactions)]
+
+
+def sulfide_bond_mask(
+    interactions: pd.DataFrame,
+    cutoff: float = 0.0
+) -> pd.Series:
     """
     Find Disulfide Bonds
     :param interactions:
         The residue energy breakdown dataframe
+    :param cutoff:
+        The disulfide energy below which a pair counts as bonded
     :return:
-        A dataframe of the disulfide interactions
+        A boolean series marking the disulfide interactions
     """
-    query = interactions[
+    return (
         (
             (interactions['restype1'] == 'CYS') &
             (interactions['restype2'] == 'CYS')
         ) |
-        (interactions['dslf_fa13'] < 0)
-    ]
-    return query
+        (interactions['dslf_fa13'] < cutoff)
+    )
 
 
-def hydrogen_bonds(interactions: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+def sulfide_bonds(interactions: pd.DataFrame) -> pd.DataFrame:
     """
-    Find Hydrogen Bonds
+    Find Disulfide Bonds
     :param interactions:
         The residue energy breakdown dataframe
     :return:
-        A dictionary containing a dataframe of interactions
-         for each type of hydrogen bond
+        A dataframe of the disulfide interactions
     """
-    sc_sc = interactions[interactions['hbond_sc'] < 0]
-    bb_sc = interactions[interactions['hbond_bb_sc'] < 0]
-    bb_bb_sr = interactions[interactions['hbond_sr_bb'] < 0]
-    bb_bb_lr = interactions[interactions['hbond_lr_bb'] < 0]
-    return {
-        'sc_sc': sc_sc,
-        'bb_sc': bb_sc,
-        'bb_bb_sr': bb_bb_sr,
-        'bb_bb_lr': bb_bb_lr
-    }
+    return interactions[sulfide_bond_mask(interactions)]
 
 
-def interaction_analysis(
-    variant: pd.DataFrame,
-    wild_type: pd.DataFrame,
-    mutated: List[int]
-) -> Dict[str, pd.DataFrame]:
+def hydrogen_bond_masks(
+    interactions: pd.DataFrame,
+    cutoffs: Optional[Dict[str, float]] = None,
+    distances: Optional[Dict[str, np.ndarray]] = None,
+    max_distances: Optional[Dict[str, float]] = None
+) -> Dict[str, pd.Series]:
     """
-    Classify interactions into 6 categories
-    :param variant:
-        The residue energy breakdown for the variant
-    :param wild_type:
-        The residue energy breakdown for the wild-type
-    :param mutated:
-        The mutated residues between the variant and wild-type
+    Find Hydrogen Bonds
+    :param interactions:
+        The residue energy breakdown dataframe
+    :param cutoffs:
+        The energy below which a pair counts as a hydrogen bond, for each
+        type of hydrogen bond. Defaults to zero
+    :param distances:
+        If provided, the shortest donor-acceptor distance of every pair for
+        each kind of contact: sc_sc, bb_sc and bb_bb
+    :param max_distances:
+        The longest donor-acceptor distance of each kind of contact. Kinds
+        that are not listed use DEFAULT_DISTANCES
     :return:
-        A dictionary containing a dataframe of interactions for
-        each category
+        A dictionary containing a boolean series for each type of
+        hydrogen bond
     """
-    position = ['resi1', 'resi2']
-
-    position_v = variant[position].values.tolist()
-    position_w = wild_type[position].values.tolist()
-
-    change_a = []
-    change_b = []
-    change_c = []
-    change_d = []
-    change_e = []
-    change_f = []
-
-    for row in variant.iterrows():
-        if (
-            row[1][position].values.tolist() in position_w and
-            (
-                row[1]['resi1'] not in mutated and
-                row[1]['resi2'] not in mutated
-            )
-        ):
-            change_a.append(subtract_rows(row, wild_type))
-
-        if (
-            row[1][position].values.tolist() in position_w and
-            (
-                row[1]['resi1'] in mutated or
-                row[1]['resi2'] in mutated
-            )
-        ):
-            change_b.append(subtract_rows(row, wild_type))
-
-        if (
-            row[1][position].values.tolist() not in position_w and
-            (
-                row[1]['resi1'] not in mutated and
-                row[1]['resi2'] not in mutated
-            )
-        ):
-            change_e.append(row[1].values)
-
-        if (
-            row[1][position].values.tolist() not in position_w and
-            (
-                row[1]['resi1'] in mutated or
-                row[1]['resi2'] in mutated
-            )
-        ):
-            change_f.append(row[1].values)
-
-    for row in wild_type.iterrows():
-        if (
-            row[1][position].values.tolist() not in position_v and
-            (
-                row[1]['resi1'] not in mutated and
-                row[1]['resi2'] not in mutated
-            )
-        ):
-            change_c.append(row[1].values)
-
-        if (
-            row[1][position].values.tolist() not in position_v and
-            (
-                row[1]['resi1'] in mutated or
-                row[1]['resi2'] in mutated
-            )
-        ):
-            change_d.append(row[1].values)
-
-    change_a = pd.DataFrame(change_a)
-    change_b = pd.DataFrame(change_b)
-    change_c = pd.DataFrame(change_c)
-    change_d = pd.DataFrame(change_d)
-    change_e = pd.DataFrame(change_e)
-    change_f = pd.DataFrame(change_f)
-    dfs = [change_a, change_b, change_c, change_d, change_e, change_f]
-    for i in dfs:
-        if len(i) > 0:
-            i.columns = variant.columns
-
-    return {
-        'a': change_a,
-        'b': change_b,
-        'c': change_c,
-        'd': change_d,
-        'e': change_e,
-        'f': change_f
+    terms = {
+        'sc_sc': 'hbond_sc',
+        'bb_sc': 'hbond_bb_sc',
+        'bb_bb_sr': 'hbond_sr_bb',
+        'bb_bb_lr': 'hbond_lr_bb'
     }
+    cutoffs = cutoffs or {}
+    distances = distances or {}
+    max_distances = {**DEFAULT_DISTANCES, **(max_distances or {})}
+    masks = {}
+    for name, term in terms.items():
+        masks[name] = interactions[term] < cutoffs.get(name, 0.0)
+        kind = GEOMETRY[f'hbonds_{name}']
+        if kind in distances.keys():
+            masks[name] &= distances[kind] <= max_distances[kind]
+    return masks
 
 
-def subtract_rows(
-    row: Tuple[Hashable, pd.Series],
-    df: pd.DataFrame
-) -> list:
+def hydrogen_bonds(interactions: pd.DataFrame) -> Dict[str, pd.DataFrame]:
     """
-    Subtract the numerical values of corresponding interactions
-    :param row:
-        The row whose values are being subtracted from
-    :param df:
-        The dataframe that contains the matching row whose values will
-        be used for subtraction
+    Find Hydrogen Bonds
+    :param interactions:
+        The residue energy breakdown dataframe
     :return:
-        The adjusted values of the row, to be added into a new dataframe
+        A dictionary containing a dataframe of interactions
+         for each type of hydrogen bond
     """
-    query = df[
-        (df['resi1'] == row[1]['resi1']) &
-        (df['resi2'] == row[1]['resi2'])
-    ].values
-    data = list(row[1][0:6].values)
-    data.extend(list(row[1][6:] - query[0, 6:]))
-    return data
+    return {
+        x: interactions[y]
+        for x, y in hydrogen_bond_masks(interactions).items()
+    }
 
 
 def buried_hbonds(
-    resi_depth: dict[int, float],
+    results: InteractionResults,
+    resi_depth: Dict[int, float],
     threshold: float,
-    hbonds_sc_sc: Dict[str, pd.DataFrame],
-    hbonds_bb_sc: Dict[str, pd.DataFrame],
-    hbonds_bb_bb_lr: Dict[str, pd.DataFrame],
-    hbonds_bb_bb_sr: Dict[str, pd.DataFrame],
-    unsatisfied: bool = True,
-    **kwargs
-) -> None:
+    unsatisfied: bool = True
+) -> pd.DataFrame:
     """
-    An incomplete attempt to identify buried and unsatisfied
-     hydrogen bonds using residue depth
+    Identify hydrogen bonds between buried residues that were lost in the
+    variant, leaving the buried polar groups unsatisfied, or that were newly
+    formed in the variant
+    :param results:
+        The interaction results returned by energy_calc
     :param resi_depth:
+        The residue depth map. Use the wild-type depth for lost hydrogen
+        bonds and the variant depth for gained hydrogen bonds
     :param threshold:
-    :param hbonds_sc_sc:
-    :param hbonds_bb_sc:
-    :param hbonds_bb_bb_lr:
-    :param hbonds_bb_bb_sr:
+        A pair is buried when either residue is deeper than this depth
     :param unsatisfied:
-    :param kwargs:
+        Report lost hydrogen bonds (changes C and D) if True, otherwise
+        gained hydrogen bonds (changes E and F)
     :return:
+        A dataframe with one row per buried hydrogen bond
     """
-    frames = {
-        f'sc_sc_{"c" if unsatisfied else "e"}':
-            hbonds_sc_sc['c' if unsatisfied else 'e'],
-        f'sc_sc_{"d" if unsatisfied else "f"}':
-            hbonds_sc_sc['d' if unsatisfied else 'f'],
-        f'bb_sc_{"c" if unsatisfied else "e"}':
-            hbonds_bb_sc['c' if unsatisfied else 'e'],
-        f'bb_sc_{"d" if unsatisfied else "f"}':
-            hbonds_bb_sc['d' if unsatisfied else 'f'],
-        f'bb_bb_sr_{"c" if unsatisfied else "e"}':
-            hbonds_bb_bb_sr['c' if unsatisfied else 'e'],
-        f'bb_bb_sr_{"d" if unsatisfied else "f"}':
-            hbonds_bb_bb_sr['d' if unsatisfied else 'f'],
-        f'bb_bb_lr_{"c" if unsatisfied else "e"}':
-            hbonds_bb_bb_lr['c' if unsatisfied else 'e'],
-        f'bb_bb_lr_{"d" if unsatisfied else "f"}':
-            hbonds_bb_bb_lr['d' if unsatisfied else 'f']
-    }
+    changes = ['c', 'd'] if unsatisfied else ['e', 'f']
+    table = results.table
+    rows, labels, kinds = [], [], []
+    for label in HBOND_CLASSES:
+        for change in changes:
+            index = results.index[label][change]
+            rows.append(index)
+            labels.append(np.full(len(index), HBOND_CLASSES.index(label)))
+            kinds.append(np.full(len(index), CHANGES.index(change)))
+    rows = np.concatenate(rows).astype(np.int64)
+    labels = np.concatenate(labels).astype(np.int64)
+    kinds = np.concatenate(kinds).astype(np.int64)
+
+    size = max(list(resi_depth.keys()) + [table.resi1.max(initial=0),
+                                          table.resi2.max(initial=0)]) + 1
+    depth = np.full(size, np.nan, dtype=np.float32)
+    depth[list(resi_depth.keys())] = list(resi_depth.values())
+    depth_1 = depth[table.resi1[rows]]
+    depth_2 = depth[table.resi2[rows]]
+    deepest = np.fmax(depth_1, depth_2)
+    keep = deepest > threshold
 
-    for key, df in frames.items():
-        for row in df.iterrows():
-            data_1 = resi_depth[row[1]['resi1']]
-            data_2 = resi_depth[row[1]['resi2']]
-            if data_1 > threshold or data_2 > threshold:
-                print(f"{key:<10}", end=' ')
-                print(row[1][['resi1', 'resi2', 'total']].values, end=' ')
-                print(max([data_1, data_2]))
+    values = table.wild if unsatisfied else table.variant
+    labels_side = table.labels_wild if unsatisfied else table.labels_variant
+    rows = rows[keep]
+    data = pd.DataFrame({
+        'hbond_class': pd.Categorical.from_codes(
+            labels[keep], HBOND_CLASSES
+        ),
+        'change': pd.Categorical.from_codes(kinds[keep], CHANGES),
+        'resi1': table.resi1[rows],
+        'resi2': table.resi2[rows],
+        'restype1': labels_side['restype'].reindex(table.resi1[rows]).values,
+        'restype2': labels_side['restype'].reindex(table.resi2[rows]).values,
+        'total': values[rows, table.term('total')].astype(np.float64)
+        .round(PRECISION),
+        'depth1': depth_1[keep],
+        'depth2': depth_2[keep],
+        'depth': deepest[keep]
+    })
+    return data.sort_values(
+        by=['depth', 'resi1', 'resi2'], ascending=[False, True, True]
+    ).reset_index(drop=True)
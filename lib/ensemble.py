@@ -0,0 +1,291 @@
+import os
+import glob
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from scipy import stats
+from lib.jobs import Progress
+from lib.cleaning import renumber, split_models
+from lib.interactions import KEYS, PRECISION, residue_labels
+from lib.energy_breakdown import score_structure
+from lib.prescreen import prescreen
+from lib.timing import carry
+
+WORKERS = 4
+SHIFT = np.int64(1 << 32)
+SNAPSHOT_ROOT = os.environ.get('SNAPSHOT_ROOT', 'lib/storage/snapshots')
+
+
+def inside(path: str, root: str) -> bool:
+    """
+    Check that a path resolves to the root folder or a location below it,
+    following symbolic links
+    :param path:
+    :param root:
+    :return:
+    """
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def load_directory(path: str, root: str = SNAPSHOT_ROOT) -> List[str]:
+    """
+    Read every model of the PDB files in a folder of snapshots. Only
+    folders below the snapshot root can be read
+    :param path:
+        The folder, relative to the snapshot root
+    :param root:
+        The folder the snapshots are kept in. The SNAPSHOT_ROOT environment
+        variable sets the default
+    :return:
+        The models, ordered by file name
+    """
+    folder = os.path.join(root, path)
+    if not inside(folder, root):
+        raise ValueError(f'{path} is outside the snapshot folder')
+    if not os.path.isdir(folder):
+        raise ValueError(f'{path} is not a snapshot folder')
+    models = []
+    for file_name in sorted(glob.glob(os.path.join(folder, '*.pdb'))):
+        if not inside(file_name, root):
+            continue
+        with open(file_name, 'r') as file:
+            models.extend(split_models(file.read()))
+    return models
+
+
+class PairStatistics:
+    """
+    The running mean and variance of every score term of every pair over an
+    ensemble of structures, accumulated one model at a time with Welford's
+    algorithm. A pair missing from a model counts as zero energy
+    """
+    def __init__(self):
+        """
+        Create an empty accumulator
+        """
+        self.count = 0
+        self.terms: List[str] = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros((0, 0))
+        self.m2 = np.zeros((0, 0))
+        self.labels: pd.DataFrame or None = None
+
+    def add(self, data: pd.DataFrame) -> None:
+        """
+        Add the energy breakdown of one model
+        :param data:
+            The residue energy breakdown dataframe of the model
+        :return: None
+        """
+        data = data.drop_duplicates(['resi1', 'resi2'])
+        if not self.terms:
+            self.terms = [x for x in data.columns if x not in KEYS]
+            self.mean = np.zeros((0, len(self.terms)))
+            self.m2 = np.zeros((0, len(self.terms)))
+        keys = data['resi1'].values.astype(np.int64) * SHIFT + \
+            data['resi2'].values.astype(np.int64)
+        self.__grow(keys)
+        values = np.zeros_like(self.mean)
+        values[np.searchsorted(self.keys, keys)] = \
+            data[self.terms].values.astype(np.float64)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+        labels = residue_labels(data)
+        if self.labels is None:
+            self.labels = labels
+        else:
+            self.labels = self.labels.astype(str).combine_first(
+                labels.astype(str)
+            ).astype('category')
+
+    def __grow(self, keys: np.ndarray) -> None:
+        """
+        Make room for pairs that were not seen in earlier models. They
+        start with a mean and variance of zero, matching the zero energy
+        they had in those models
+        :param keys:
+            The pair keys of the new model
+        :return: None
+        """
+        new = np.setdiff1d(keys, self.keys)
+        if not len(new):
+            return
+        merged = np.union1d(self.keys, new)
+        position = np.searchsorted(merged, self.keys)
+        for name in ['mean', 'm2']:
+            grown = np.zeros((len(merged), len(self.terms)))
+            grown[position] = getattr(self, name)
+            setattr(self, name, grown)
+        self.keys = merged
+
+    def variance(self) -> np.ndarray:
+        """
+        The sample variance of every score term of every pair
+        :return:
+        """
+        if self.count < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.count - 1)
+
+    def frame(self) -> pd.DataFrame:
+        """
+        The mean energy breakdown of the ensemble, in the layout of a
+        single residue energy breakdown
+        :return:
+        """
+        resi1 = (self.keys // SHIFT).astype(np.int64)
+        resi2 = (self.keys % SHIFT).astype(np.int64)
+        data = {}
+        for name in KEYS:
+            resi = resi1 if name[-1] == '1' else resi2
+            if name in ['resi1', 'resi2']:
+                data[name] = resi
+            else:
+                data[name] = self.labels[name[:-1]].reindex(resi).values
+        for number, name in enumerate(self.terms):
+            data[name] = self.mean[:, number].round(PRECISION)
+        return pd.DataFrame(data, columns=KEYS + self.terms)
+
+
+def compare(
+    wild: PairStatistics,
+    variant: PairStatistics,
+    term: str = 'total'
+) -> pd.DataFrame:
+    """
+    Test every pair for a change of its mean energy between the wild-type
+    and variant ensembles with Welch's t-test
+    :param wild:
+        The statistics of the wild-type ensemble
+    :param variant:
+        The statistics of the variant ensemble
+    :param term:
+        The score term to compare
+    :return:
+        A dataframe with one row per pair, most significant first
+    """
+    keys = np.union1d(wild.keys, variant.keys)
+    columns = {}
+    for side, statistics in [('wild', wild), ('variant', variant)]:
+        column = statistics.terms.index(term)
+        position = np.searchsorted(statistics.keys, keys)
+        found = np.zeros(len(keys), dtype=bool)
+        inside = position < len(statistics.keys)
+        found[inside] = statistics.keys[position[inside]] == keys[inside]
+        mean = np.zeros(len(keys))
+        variance = np.zeros(len(keys))
+        mean[found] = statistics.mean[position[found], column]
+        variance[found] = statistics.variance()[position[found], column]
+        columns[side] = (mean, variance, statistics.count)
+
+    mean_w, var_w, n_w = columns['wild']
+    mean_v, var_v, n_v = columns['variant']
+    delta = mean_v - mean_w
+    error_w = var_w / max(n_w, 1)
+    error_v = var_v / max(n_v, 1)
+    error = error_w + error_v
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_value = delta / np.sqrt(error)
+        freedom = error ** 2 / (
+            error_w ** 2 / max(n_w - 1, 1) + error_v ** 2 / max(n_v - 1, 1)
+        )
+        p_value = 2 * stats.t.sf(np.abs(t_value), freedom)
+    p_value = np.where(error > 0, p_value, np.where(delta != 0, 0.0, 1.0))
+    if min(n_w, n_v) < 2:
+        p_value = np.full(len(keys), np.nan)
+    order = np.lexsort((-np.abs(delta), p_value))
+    data = pd.DataFrame({
+        'resi1': (keys // SHIFT).astype(np.int64),
+        'resi2': (keys % SHIFT).astype(np.int64),
+        'mean_wild': mean_w.round(PRECISION),
+        'std_wild': np.sqrt(var_w).round(PRECISION),
+        'mean_variant': mean_v.round(PRECISION),
+        'std_variant': np.sqrt(var_v).round(PRECISION),
+        'delta': delta.round(PRECISION),
+        't_value': t_value.round(PRECISION),
+        'p_value': p_value
+    })
+    return data.iloc[order].reset_index(drop=True)
+
+
+def score_model(
+    pdb_text: str,
+    name: str,
+    executable: Optional[str]
+) -> pd.DataFrame:
+    """
+    Clean and score one model of an ensemble. Rosetta runs in a temporary
+    folder of its own, so concurrent runs never share files
+    :param pdb_text:
+        The contents of the model
+    :param name:
+        The name of the model, used for the files written to disk
+    :param executable:
+        Filepath of the Rosetta executable to run, or None to estimate the
+        breakdown with the prescreen
+    :return:
+        The residue energy breakdown dataframe of the model
+    """
+    if executable is None:
+        return prescreen(renumber(pdb_text))
+    with tempfile.TemporaryDirectory(dir='lib/storage') as folder:
+        return score_structure(renumber(pdb_text), name, executable, folder)
+
+
+def run_ensemble(
+    models_wild: List[str],
+    models_variant: List[str],
+    executable: Optional[str],
+    progress: Progress = None,
+    workers: int = WORKERS
+) -> Tuple[PairStatistics, PairStatistics]:
+    """
+    Score every model of the wild-type and variant ensembles in parallel and
+    accumulate their statistics. Each breakdown is folded into the
+    statistics as soon as it finishes and is not kept afterwards
+    :param models_wild:
+        The models of the wild-type ensemble
+    :param models_variant:
+        The models of the variant ensemble
+    :param executable:
+        Filepath of the Rosetta executable to run, or None to estimate the
+        breakdowns with the prescreen
+    :param progress:
+        Progress counter that is advanced after every scored model and
+        signals cancellation
+    :param workers:
+        The number of Rosetta processes to run at the same time
+    :return:
+        The statistics of the wild-type and variant ensembles
+    """
+    if not models_wild or not models_variant:
+        raise ValueError('Both ensembles need at least one model')
+    if progress is None:
+        progress = Progress()
+    progress.set_total(len(models_wild) + len(models_variant))
+    statistics: Dict[str, PairStatistics] = {
+        'wild': PairStatistics(), 'variant': PairStatistics()
+    }
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='model')
+    try:
+        futures = {}
+        for side, models in [
+            ('wild', models_wild), ('variant', models_variant)
+        ]:
+            for number, model in enumerate(models):
+                future = pool.submit(
+                    carry(score_model), model, f'ensemble_{side}_{number}',
+                    executable
+                )
+                futures[future] = side
+        for future in as_completed(futures):
+            statistics[futures.pop(future)].add(future.result())
+            progress.advance(1)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return statistics['wild'], statistics['variant']
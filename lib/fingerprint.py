@@ -0,0 +1,20 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def frame_hash(data: pd.DataFrame) -> str:
+    """
+    Fingerprint the contents of a dataframe
+    :param data:
+        The dataframe to fingerprint
+    :return:
+        A hexadecimal digest that changes whenever a value changes
+    """
+    numbers = data.select_dtypes('number')
+    labels = data.drop(columns=numbers.columns)
+    digest = hashlib.sha1(','.join(map(str, data.columns)).encode())
+    digest.update(np.ascontiguousarray(numbers.values).tobytes())
+    if len(labels.columns):
+        digest.update(pd.util.hash_pandas_object(labels, index=False).values)
+    return digest.hexdigest()
@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from scipy.spatial import cKDTree
+
+SEARCH_RADIUS = 6.0
+
+ACIDIC = {
+    'ASP': ['OD1', 'OD2'],
+    'GLU': ['OE1', 'OE2']
+}
+BASIC = {
+    'ARG': ['NE', 'NH1', 'NH2'],
+    'HIS': ['ND1', 'NE2'],
+    'LYS': ['NZ']
+}
+DONORS = {
+    'ARG': ['NE', 'NH1', 'NH2'],
+    'ASN': ['ND2'],
+    'GLN': ['NE2'],
+    'HIS': ['ND1', 'NE2'],
+    'LYS': ['NZ'],
+    'SER': ['OG'],
+    'THR': ['OG1'],
+    'TRP': ['NE1'],
+    'TYR': ['OH']
+}
+ACCEPTORS = {
+    'ASN': ['OD1'],
+    'ASP': ['OD1', 'OD2'],
+    'GLN': ['OE1'],
+    'GLU': ['OE1', 'OE2'],
+    'HIS': ['ND1', 'NE2'],
+    'SER': ['OG'],
+    'THR': ['OG1'],
+    'TYR': ['OH']
+}
+BACKBONE_DONORS = ['N']
+BACKBONE_ACCEPTORS = ['O', 'OXT']
+
+GEOMETRY = {
+    'salt_changes': 'salt',
+    'hbonds_sc_sc': 'sc_sc',
+    'hbonds_bb_sc': 'bb_sc',
+    'hbonds_bb_bb_sr': 'bb_bb',
+    'hbonds_bb_bb_lr': 'bb_bb'
+}
+
+
+def atom_mask(atoms: pd.DataFrame, groups: Dict[str, List[str]]) -> np.ndarray:
+    """
+    Select the atoms that belong to a chemical group
+    :param atoms:
+        The atom table created by spatial.load_atoms
+    :param groups:
+        The atom names of the group for each residue type
+    :return:
+        A boolean array with one entry per atom
+    """
+    wanted = [f'{x}:{z}' for x, y in groups.items() for z in y]
+    names = atoms['resname'].astype(str) + ':' + atoms['name'].astype(str)
+    return names.isin(wanted).values
+
+
+def closest_contacts(
+    atoms: pd.DataFrame,
+    first: np.ndarray,
+    second: np.ndarray,
+    cutoff: float = SEARCH_RADIUS
+) -> pd.DataFrame:
+    """
+    Find the shortest distance between two groups of atoms for every pair
+    of residues, using one batched neighbour search
+    :param atoms:
+        The atom table created by spatial.load_atoms
+    :param first:
+        Boolean mask of the first group of atoms
+    :param second:
+        Boolean mask of the second group of atoms
+    :param cutoff:
+        Atoms further apart than this distance are ignored
+    :return:
+        A dataframe with resi1 < resi2 and the shortest distance
+    """
+    columns = ['resi1', 'resi2', 'distance']
+    first = np.flatnonzero(first)
+    second = np.flatnonzero(second)
+    if not len(first) or not len(second):
+        return pd.DataFrame(columns=columns)
+    coords = atoms[['x', 'y', 'z']].values.astype(np.float64)
+    resi = atoms['resi'].values
+    pairs = cKDTree(coords[first]).sparse_distance_matrix(
+        cKDTree(coords[second]), cutoff, output_type='ndarray'
+    )
+    resi1 = resi[first[pairs['i']]]
+    resi2 = resi[second[pairs['j']]]
+    keep = resi1 != resi2
+    data = pd.DataFrame({
+        'resi1': np.minimum(resi1, resi2)[keep],
+        'resi2': np.maximum(resi1, resi2)[keep],
+        'distance': pairs['v'][keep]
+    })
+    return data.groupby(['resi1', 'resi2'], as_index=False)['distance'].min()
+
+
+def contact_distances(atoms: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Measure the salt bridge and hydrogen bond geometry of every residue
+    pair of a structure
+    :param atoms:
+        The atom table created by spatial.load_atoms
+    :return:
+        A dataframe of shortest distances for each kind of interaction:
+        charged groups (salt), side-chain donor/acceptor (sc_sc),
+        backbone to side-chain (bb_sc) and backbone to backbone (bb_bb)
+    """
+    acidic = atom_mask(atoms, ACIDIC)
+    basic = atom_mask(atoms, BASIC)
+    donor_sc = atom_mask(atoms, DONORS)
+    acceptor_sc = atom_mask(atoms, ACCEPTORS)
+    donor_bb = atoms['name'].isin(BACKBONE_DONORS).values & \
+        (atoms['resname'] != 'PRO').values
+    acceptor_bb = atoms['name'].isin(BACKBONE_ACCEPTORS).values
+    bb_sc = pd.concat([
+        closest_contacts(atoms, donor_bb, acceptor_sc),
+        closest_contacts(atoms, donor_sc, acceptor_bb)
+    ])
+    return {
+        'salt': closest_contacts(atoms, acidic, basic),
+        'sc_sc': closest_contacts(atoms, donor_sc, acceptor_sc),
+        'bb_sc': bb_sc.groupby(['resi1', 'resi2'], as_index=False)[
+            'distance'
+        ].min(),
+        'bb_bb': closest_contacts(atoms, donor_bb, acceptor_bb)
+    }
+
+
+def pair_lookup(
+    resi1: np.ndarray,
+    resi2: np.ndarray,
+    contacts: pd.DataFrame
+) -> np.ndarray:
+    """
+    Look up the contact distance of many residue pairs at once
+    :param resi1:
+        The first residue of every pair
+    :param resi2:
+        The second residue of every pair
+    :param contacts:
+        The output of closest_contacts
+    :return:
+        A float32 array of distances, NaN where no contact was found
+    """
+    result = np.full(len(resi1), np.nan, dtype=np.float32)
+    if not len(contacts):
+        return result
+    shift = np.int64(1 << 32)
+    low = np.minimum(resi1, resi2).astype(np.int64)
+    high = np.maximum(resi1, resi2).astype(np.int64)
+    keys = low * shift + high
+    known = contacts['resi1'].values.astype(np.int64) * shift + \
+        contacts['resi2'].values.astype(np.int64)
+    order = np.argsort(known)
+    known = known[order]
+    position = np.clip(np.searchsorted(known, keys), 0, len(known) - 1)
+    found = known[position] == keys
+    distances = contacts['distance'].values[order]
+    result[found] = distances[position[found]]
+    return result
@@ -0,0 +1,632 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Mapping, Tuple
+from lib.geometry import GEOMETRY
+
+CHANGES = ['a', 'b', 'c', 'd', 'e', 'f']
+KEYS = ['resi1', 'pdbid1', 'restype1', 'resi2', 'pdbid2', 'restype2']
+DISTANCES = ['distance_wild', 'distance_variant']
+PRECISION = 3
+THRESHOLDS = (1.0, -1.0)
+
+
+def residue_labels(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collect the PDB identifier and residue type of every position
+    :param data:
+        The residue energy breakdown dataframe
+    :return:
+        A dataframe indexed by residue number
+    """
+    labels = []
+    for i in ['1', '2']:
+        part = data[[f'resi{i}', f'pdbid{i}', f'restype{i}']]
+        part.columns = ['resi', 'pdbid', 'restype']
+        labels.append(part)
+    labels = pd.concat(labels).drop_duplicates('resi')
+    labels = labels.set_index('resi').sort_index()
+    return labels.astype('category')
+
+
+class PairTable:
+    """
+    The union of the wild-type and variant interaction pairs, stored as
+    typed columns with one float32 value matrix per structure
+    """
+    def __init__(self, wild_type: pd.DataFrame, variant: pd.DataFrame):
+        """
+        Join the two residue energy breakdowns on (resi1, resi2). Each
+        breakdown must list every pair only once
+        :param wild_type:
+            The residue energy breakdown for the wild-type
+        :param variant:
+            The residue energy breakdown for the variant
+        """
+        self.columns: List[str] = variant.columns.tolist()
+        self.terms: List[str] = [x for x in self.columns if x not in KEYS]
+        position = ['resi1', 'resi2']
+        left = wild_type[position].astype(np.int64)
+        left = left.assign(iw=np.arange(len(wild_type)))
+        right = variant[position].astype(np.int64)
+        right = right.assign(iv=np.arange(len(variant)))
+        merged = pd.merge(left, right, on=position, how='outer')
+        iw = merged['iw'].fillna(-1).values.astype(np.int64)
+        iv = merged['iv'].fillna(-1).values.astype(np.int64)
+
+        self.resi1 = merged['resi1'].values.astype(np.int32)
+        self.resi2 = merged['resi2'].values.astype(np.int32)
+        self.order_wild = iw.astype(np.int32)
+        self.order_variant = iv.astype(np.int32)
+        self.wild = self.__values(wild_type, iw)
+        self.variant = self.__values(variant, iv)
+        self.labels_wild = residue_labels(wild_type)
+        self.labels_variant = residue_labels(variant)
+        self.extra: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        """
+        The number of distinct interaction pairs
+        :return:
+        """
+        return len(self.resi1)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Export the table as a flat dictionary of NumPy arrays
+        :return:
+        """
+        arrays = {
+            'columns': np.array(self.columns),
+            'resi1': self.resi1,
+            'resi2': self.resi2,
+            'order_wild': self.order_wild,
+            'order_variant': self.order_variant,
+            'wild': self.wild,
+            'variant': self.variant
+        }
+        for side in ['wild', 'variant']:
+            labels: pd.DataFrame = getattr(self, f'labels_{side}')
+            arrays[f'labels_{side}_resi'] = labels.index.values
+            for name in ['pdbid', 'restype']:
+                arrays[f'labels_{side}_{name}'] = np.asarray(
+                    labels[name].astype(str), dtype=str
+                )
+        for name, values in self.extra.items():
+            arrays[f'extra_{name}'] = values
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray]) -> 'PairTable':
+        """
+        Rebuild a table exported with to_arrays
+        :param arrays:
+            The exported arrays
+        :return:
+        """
+        table = cls.__new__(cls)
+        table.columns = arrays['columns'].tolist()
+        table.terms = [x for x in table.columns if x not in KEYS]
+        for name in [
+            'resi1', 'resi2', 'order_wild', 'order_variant', 'wild', 'variant'
+        ]:
+            setattr(table, name, arrays[name])
+        for side in ['wild', 'variant']:
+            labels = pd.DataFrame(
+                {
+                    'pdbid': arrays[f'labels_{side}_pdbid'],
+                    'restype': arrays[f'labels_{side}_restype']
+                },
+                index=pd.Index(arrays[f'labels_{side}_resi'], name='resi')
+            )
+            setattr(table, f'labels_{side}', labels.astype('category'))
+        table.extra = {
+            x[6:]: arrays[x] for x in arrays.keys() if x.startswith('extra_')
+        }
+        return table
+
+    def __values(self, data: pd.DataFrame, rows: np.ndarray) -> np.ndarray:
+        """
+        Scatter the score terms of one structure into the union order
+        :param data:
+            The residue energy breakdown of the structure
+        :param rows:
+            For every union pair, the row in data or -1 if it is absent
+        :return:
+            A float32 matrix with zeros for absent pairs
+        """
+        source = data[self.terms].values.astype(np.float32)
+        values = np.zeros((len(rows), len(self.terms)), dtype=np.float32)
+        present = rows >= 0
+        values[present] = source[rows[present]]
+        return values
+
+    @property
+    def in_wild(self) -> np.ndarray:
+        """
+        Whether each pair interacts in the wild-type
+        :return:
+        """
+        return self.order_wild >= 0
+
+    @property
+    def in_variant(self) -> np.ndarray:
+        """
+        Whether each pair interacts in the variant
+        :return:
+        """
+        return self.order_variant >= 0
+
+    def add_column(self, name: str, values: np.ndarray) -> None:
+        """
+        Attach an additional per-pair column, such as a measured distance
+        :param name:
+            The name of the column
+        :param values:
+            One value for every pair of the union table
+        :return: None
+        """
+        assert len(values) == len(self)
+        self.extra[name] = values
+
+    def term(self, name: str) -> int:
+        """
+        The column of a score term in the value matrices
+        :param name:
+            The name of the score term
+        :return:
+        """
+        return self.terms.index(name)
+
+    def side_frame(
+        self,
+        side: str,
+        rows: np.ndarray or slice = slice(None)
+    ) -> pd.DataFrame:
+        """
+        The residue types and score terms of pairs in one structure, in
+        union order. Pairs absent from the structure have zero energies
+        :param side:
+            "wild" or "variant"
+        :param rows:
+            The positions in the union table. Defaults to every pair
+        :return:
+        """
+        labels: pd.DataFrame = getattr(self, f'labels_{side}')
+        values = getattr(self, side)[rows]
+        data = {
+            'restype1': labels['restype'].reindex(self.resi1[rows]).values,
+            'restype2': labels['restype'].reindex(self.resi2[rows]).values
+        }
+        for number, name in enumerate(self.terms):
+            data[name] = values[:, number]
+        return pd.DataFrame(data)
+
+    def distance_columns(self, geometry: str = None) -> List[str]:
+        """
+        The distance columns available for a kind of contact
+        :param geometry:
+            The kind of contact, such as "salt"
+        :return:
+        """
+        if geometry is None or f'{geometry}_wild' not in self.extra.keys():
+            return []
+        return DISTANCES
+
+    def delta(
+        self,
+        rows: np.ndarray,
+        change: str,
+        terms: List[int] = None
+    ) -> np.ndarray:
+        """
+        The values reported for a change type: the difference for pairs
+        interacting in both structures, otherwise the values of the structure
+        the pair interacts in
+        :param rows:
+            Positions in the union table
+        :param change:
+            The change type, one of a-f
+        :param terms:
+            Columns of the value matrices to use. Defaults to every term
+        :return:
+            A float64 matrix with one row per position
+        """
+        if terms is None:
+            terms = list(range(len(self.terms)))
+        wild = self.wild[rows][:, terms].astype(np.float64)
+        variant = self.variant[rows][:, terms].astype(np.float64)
+        if change in ['a', 'b']:
+            values = variant - wild
+        elif change in ['c', 'd']:
+            values = wild
+        else:
+            values = variant
+        return values.round(PRECISION)
+
+    def reported(self, change: str, term: str = 'total') -> np.ndarray:
+        """
+        The value of one score term that a change type reports, for every
+        pair of the union table
+        :param change:
+            The change type, one of a-f
+        :param term:
+            The score term
+        :return:
+            A float64 array with one entry per pair
+        """
+        return self.delta(slice(None), change, [self.term(term)])[:, 0]
+
+    def frame(
+        self,
+        rows: np.ndarray,
+        change: str,
+        columns: List[str] = None,
+        geometry: str = None
+    ) -> pd.DataFrame:
+        """
+        Materialize rows of the union table in the residue energy breakdown
+        layout
+        :param rows:
+            Positions in the union table
+        :param change:
+            The change type, which decides the structure the values and
+            residue labels are taken from
+        :param columns:
+            The columns to build. Defaults to every column
+        :param geometry:
+            The kind of contact measured for the distance_wild and
+            distance_variant columns, such as "salt"
+        :return:
+        """
+        if columns is None:
+            columns = self.columns + self.distance_columns(geometry)
+        labels = self.labels_wild if change in ['c', 'd'] \
+            else self.labels_variant
+        needed = [x for x in columns if x in self.terms]
+        values = self.delta(rows, change, [self.term(x) for x in needed])
+        data = {}
+        for name in columns:
+            if name in ['resi1', 'resi2']:
+                data[name] = getattr(self, name)[rows].astype(np.int64)
+            elif name in KEYS:
+                resi = self.resi1 if name[-1] == '1' else self.resi2
+                data[name] = labels[name[:-1]].reindex(resi[rows]).values
+            elif name in DISTANCES:
+                data[name] = self.extra[f'{geometry}_{name[9:]}'][rows]
+            elif name in self.extra.keys():
+                data[name] = self.extra[name][rows]
+            else:
+                data[name] = values[:, needed.index(name)]
+        return pd.DataFrame(data, columns=columns)
+
+
+class CategoryView(Mapping):
+    """
+    Read-only dictionary of the six change types of one interaction class.
+    Dataframes are only built when they are accessed
+    """
+    def __init__(
+        self,
+        table: PairTable,
+        index: Dict[str, np.ndarray],
+        geometry: str = None
+    ):
+        """
+        Create the view
+        :param table:
+            The shared union table
+        :param index:
+            The union table positions of each change type
+        :param geometry:
+            The kind of contact measured for this class, if any
+        """
+        self.table = table
+        self.index = index
+        self.geometry = geometry
+
+    def __getitem__(self, change: str) -> pd.DataFrame:
+        """
+        Build the dataframe of one change type
+        :param change:
+            The change type, one of a-f
+        :return:
+        """
+        return self.table.frame(
+            self.index[change], change, geometry=self.geometry
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterate over the change types
+        :return:
+        """
+        return iter(CHANGES)
+
+    def __len__(self) -> int:
+        """
+        The number of change types
+        :return:
+        """
+        return len(CHANGES)
+
+    def count(self, change: str) -> int:
+        """
+        The number of pairs of one change type
+        :param change:
+            The change type, one of a-f
+        :return:
+        """
+        return len(self.index[change])
+
+    def select(self, change: str, columns: List[str]) -> pd.DataFrame:
+        """
+        Build only some columns of one change type
+        :param change:
+            The change type, one of a-f
+        :param columns:
+            The columns to build
+        :return:
+        """
+        return self.table.frame(
+            self.index[change], change, columns, self.geometry
+        )
+
+    @property
+    def distance_columns(self) -> List[str]:
+        """
+        The distance columns available for this class
+        :return:
+        """
+        return self.table.distance_columns(self.geometry)
+
+    def values(self, change: str, term: str = 'total') -> np.ndarray:
+        """
+        The values of a single score term for one change type
+        :param change:
+            The change type, one of a-f
+        :param term:
+            The score term
+        :return:
+        """
+        rows = self.index[change]
+        column = self.table.term(term)
+        return self.table.delta(rows, change, [column])[:, 0]
+
+
+class InteractionResults(Mapping):
+    """
+    The result of the interaction analysis. Holds one PairTable and the
+    union table positions of every (class, change type) combination, and
+    exposes the same dictionary layout energy_calc has always returned
+    """
+    def __init__(
+        self,
+        table: PairTable,
+        index: Dict[str, Dict[str, np.ndarray]],
+        summary: pd.DataFrame = None,
+        thresholds: Tuple[float, float] = THRESHOLDS
+    ):
+        """
+        Create the results object
+        :param table:
+            The union table of wild-type and variant pairs
+        :param index:
+            For every class, the union table positions of each change type
+        :param summary:
+            The summary table. Built on first access when not provided
+        :param thresholds:
+            The upper and lower total energy thresholds counted in the
+            summary
+        """
+        self.table = table
+        self.index = index
+        self.thresholds = thresholds
+        self.__summary = summary
+        self.__sorted: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __getitem__(self, label: str) -> pd.DataFrame or CategoryView:
+        """
+        Access the summary table or the changes of one interaction class
+        :param label:
+            "summary" or the name of an interaction class
+        :return:
+        """
+        if label == 'summary':
+            if self.__summary is None:
+                self.__summary = self.summary()
+            return self.__summary
+        return CategoryView(
+            self.table, self.index[label], GEOMETRY.get(label)
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterate over the available keys
+        :return:
+        """
+        return iter(['summary'] + list(self.index.keys()))
+
+    def __len__(self) -> int:
+        """
+        The number of available keys
+        :return:
+        """
+        return len(self.index) + 1
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Export the results as a flat dictionary of NumPy arrays
+        :return:
+        """
+        arrays = {f'table/{x}': y for x, y in self.table.to_arrays().items()}
+        arrays['classes'] = np.array(list(self.index.keys()))
+        arrays['thresholds'] = np.array(self.thresholds, dtype=np.float64)
+        for label, changes in self.index.items():
+            for change, rows in changes.items():
+                arrays[f'index/{label}/{change}'] = rows
+        return arrays
+
+    @classmethod
+    def from_arrays(
+        cls,
+        arrays: Mapping[str, np.ndarray]
+    ) -> 'InteractionResults':
+        """
+        Rebuild results exported with to_arrays
+        :param arrays:
+            The exported arrays
+        :return:
+        """
+        table = PairTable.from_arrays({
+            x[6:]: arrays[x] for x in arrays.keys() if x.startswith('table/')
+        })
+        index = {
+            label: {x: arrays[f'index/{label}/{x}'] for x in CHANGES}
+            for label in arrays['classes'].tolist()
+        }
+        thresholds = THRESHOLDS
+        if 'thresholds' in arrays.keys():
+            thresholds = tuple(arrays['thresholds'].tolist())
+        return cls(table, index, thresholds=thresholds)
+
+    def sorted_values(
+        self,
+        label: str,
+        change: str,
+        term: str = 'total'
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The sorted values of one score term for a class and change type,
+        computed once and reused by every later threshold query
+        :param label:
+            The interaction class
+        :param change:
+            The change type, one of a-f
+        :param term:
+            The score term
+        :return:
+            The sorted values and their running sum, which starts at zero
+        """
+        key = (label, change, term)
+        if key not in self.__sorted.keys():
+            rows = self.index[label][change]
+            column = self.table.term(term)
+            values = np.sort(self.table.delta(rows, change, [column])[:, 0])
+            self.__sorted[key] = (
+                values, np.concatenate([[0.0], np.cumsum(values)])
+            )
+        return self.__sorted[key]
+
+    def threshold_sweep(
+        self,
+        thresholds: np.ndarray,
+        label: str = 'all_changes',
+        term: str = 'total'
+    ) -> pd.DataFrame:
+        """
+        Count and sum the changes at or beyond many thresholds at once, using
+        a binary search on the sorted values of every change type
+        :param thresholds:
+            The non-negative thresholds t. A change counts as above when its
+            value is at least t and as below when it is at most -t
+        :param label:
+            The interaction class
+        :param term:
+            The score term
+        :return:
+            A dataframe with one row per threshold and change type
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        frames = []
+        for change in CHANGES:
+            values, running = self.sorted_values(label, change, term)
+            above = np.searchsorted(values, thresholds, side='left')
+            below = np.searchsorted(values, -thresholds, side='right')
+            frames.append(pd.DataFrame({
+                'threshold': thresholds,
+                'change': change,
+                'above': len(values) - above,
+                'below': below,
+                'sum_above': (running[-1] - running[above]).round(4),
+                'sum_below': running[below].round(4)
+            }))
+        return pd.concat(frames, ignore_index=True)
+
+    def histograms(
+        self,
+        edges: np.ndarray,
+        term: str = 'total'
+    ) -> pd.DataFrame:
+        """
+        Histogram the values of one score term for every class and change
+        type. The pairs are assigned to bins once for each of the three
+        reported values, and the bins are then counted per class and change
+        type
+        :param edges:
+            The increasing bin edges. Values outside of them are not counted
+        :param term:
+            The score term
+        :return:
+            A dataframe with one row per class, change type and bin
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        size = len(edges) - 1
+        bins = {}
+        for change in ['a', 'c', 'e']:
+            values = self.table.reported(change, term)
+            found = np.searchsorted(edges, values, 'right') - 1
+            found[values == edges[-1]] = size - 1
+            bins[change] = found
+        frames = []
+        for label, changes in self.index.items():
+            for change, rows in changes.items():
+                found = bins[CHANGES[CHANGES.index(change) // 2 * 2]][rows]
+                found = found[(found >= 0) & (found < size)]
+                frames.append(pd.DataFrame({
+                    'class': label,
+                    'change': change,
+                    'left': edges[:-1],
+                    'right': edges[1:],
+                    'count': np.bincount(found, minlength=size)
+                }))
+        return pd.concat(frames, ignore_index=True)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Count the changes in each class
+        :return:
+        """
+        upper, lower = self.thresholds
+        totals = {
+            x: self.sorted_values('all_changes', x)[0] for x in CHANGES
+        }
+        data = [
+            {x.upper(): len(y) for x, y in totals.items()},
+            {x.upper(): round(y.sum(), 4) for x, y in totals.items()},
+            {
+                x.upper(): len(y) - int(np.searchsorted(y, upper, 'left'))
+                for x, y in totals.items()
+            },
+            {
+                x.upper(): int(np.searchsorted(y, lower, 'right'))
+                for x, y in totals.items()
+            },
+        ]
+        data.extend(
+            {x.upper(): self[key].count(x) for x in CHANGES}
+            for key in list(self.index.keys())[1:]
+        )
+        data = pd.DataFrame(data)
+        data.index = [
+            'Changes',
+            'Sum',
+            f'Energy > {upper:g}',
+            f'Energy < {lower:g}',
+            'Salt Bridge',
+            'Sulfide Bonds',
+            'SC-SC HBonds',
+            'BB-SC HBonds',
+            'BB-BB-SR HBonds',
+            'BB-BB-LR HBonds'
+        ]
+        return data
@@ -0,0 +1,205 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
+from threading import Event, Lock
+from typing import Any, Callable, Optional
+from lib.timing import carry
+from lib.metrics import REGISTRY
+
+EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='job')
+JOBS = REGISTRY.gauge(
+    'energy_tools_jobs', 'Background jobs by state', ['state']
+)
+JOB_WAIT = REGISTRY.histogram(
+    'energy_tools_job_wait_seconds',
+    'Time background jobs waited for a worker'
+)
+JOB_SECONDS = REGISTRY.histogram(
+    'energy_tools_job_seconds', 'Time background jobs spent running'
+)
+JOB_RESULTS = REGISTRY.counter(
+    'energy_tools_jobs_total', 'Finished background jobs by outcome',
+    ['status']
+)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job when the user requested cancellation
+    """
+
+
+class Progress:
+    """
+    A thread-safe progress counter shared between a background job and the
+    page that polls it
+    """
+    def __init__(self, total: int = 1):
+        """
+        Create the progress counter
+        :param total:
+            The number of work units expected to be processed
+        """
+        self.total = max(total, 1)
+        self.done = 0
+        self.__cancel = Event()
+        self.__lock = Lock()
+
+    def set_total(self, total: int) -> None:
+        """
+        Reset the counter for a new amount of work
+        :param total:
+            The number of work units expected to be processed
+        :return: None
+        """
+        with self.__lock:
+            self.total = max(total, 1)
+            self.done = 0
+
+    def resize(self, total: int) -> None:
+        """
+        Change the amount of expected work once it is better known, keeping
+        the work already done
+        :param total:
+            The number of work units expected to be processed
+        :return: None
+        """
+        with self.__lock:
+            self.total = max(total, 1)
+            self.done = min(self.done, self.total)
+
+    def advance(self, count: int = 1) -> None:
+        """
+        Record processed work units and stop the job if it was cancelled
+        :param count:
+            The number of work units that were just processed
+        :return: None
+        """
+        with self.__lock:
+            self.done = min(self.done + count, self.total)
+        self.check()
+
+    def check(self) -> None:
+        """
+        Raise JobCancelled if cancellation was requested
+        :return: None
+        """
+        if self.__cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self) -> None:
+        """
+        Request cancellation at the next checkpoint
+        :return: None
+        """
+        self.__cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether cancellation was requested
+        :return:
+        """
+        return self.__cancel.is_set()
+
+    @property
+    def fraction(self) -> float:
+        """
+        The fraction of work completed, between 0 and 1
+        :return:
+        """
+        return self.done / self.total
+
+
+class Job:
+    """
+    A long-running task executed by the shared background worker pool
+    """
+    def __init__(self, target: Callable, **kwargs):
+        """
+        Submit the task to the worker pool
+        :param target:
+            The function to execute. It must accept a "progress" keyword
+            argument and report its work to that Progress object. It runs
+            with the timeline of the caller
+        :param kwargs:
+            Keyword arguments forwarded to the target
+        """
+        self.progress = Progress()
+        self.__submitted = time.perf_counter()
+        JOBS.inc(state='queued')
+        self.__future: Future = EXECUTOR.submit(
+            carry(self.__run), target, progress=self.progress, **kwargs
+        )
+
+    def __run(self, target: Callable, **kwargs) -> Any:
+        """
+        Run the target on a worker and record how long it waited and ran
+        :param target:
+            The function to execute
+        :param kwargs:
+            Keyword arguments forwarded to the target
+        :return:
+            The return value of the target
+        """
+        started = time.perf_counter()
+        JOB_WAIT.observe(started - self.__submitted)
+        JOBS.dec(state='queued')
+        JOBS.inc(state='running')
+        status = 'failed'
+        try:
+            result = target(**kwargs)
+            status = 'complete'
+            return result
+        except JobCancelled:
+            status = 'cancelled'
+            raise
+        finally:
+            JOBS.dec(state='running')
+            JOB_SECONDS.observe(time.perf_counter() - started)
+            JOB_RESULTS.inc(status=status)
+
+    def cancel(self) -> None:
+        """
+        Cancel the job, whether it is waiting in the queue or running
+        :return: None
+        """
+        self.progress.cancel()
+        if not self.__future.cancelled() and self.__future.cancel():
+            JOBS.dec(state='queued')
+            JOB_RESULTS.inc(status='cancelled')
+
+    @property
+    def status(self) -> str:
+        """
+        The current state of the job: queued, running, cancelled,
+        failed or complete
+        :return:
+        """
+        if self.__future.cancelled():
+            return 'cancelled'
+        if not self.__future.done():
+            return 'running' if self.__future.running() else 'queued'
+        error = self.__future.exception()
+        if isinstance(error, JobCancelled):
+            return 'cancelled'
+        return 'failed' if error is not None else 'complete'
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        """
+        The exception raised by a failed job
+        :return:
+        """
+        if not self.__future.done():
+            return None
+        try:
+            return self.__future.exception()
+        except CancelledError:
+            return None
+
+    def result(self) -> Any:
+        """
+        The return value of a completed job
+        :return:
+        """
+        return self.__future.result()
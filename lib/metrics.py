@@ -0,0 +1,432 @@
+import os
+import math
+import logging
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Sequence, Tuple
+
+HOST = '127.0.0.1'
+PORT = int(os.environ.get('METRICS_PORT', '9464'))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 120.0, 300.0, 600.0
+)
+SERVER: Optional[ThreadingHTTPServer] = None
+SERVER_ERROR: Optional[str] = None
+SERVER_LOCK = Lock()
+LOGGER = logging.getLogger(__name__)
+
+
+def format_value(value: float) -> str:
+    """
+    Write a sample value the way the Prometheus text format expects
+    :param value:
+    :return:
+    """
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """
+    Write the label set of a sample
+    :param names:
+        The label names
+    :param values:
+        The label values, in the order of the names
+    :return:
+        The label set in braces, or an empty string without labels
+    """
+    if not names:
+        return ''
+    escaped = [
+        str(x).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for x in values
+    ]
+    pairs = ','.join(f'{x}="{y}"' for x, y in zip(names, escaped))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]):
+        """
+        Create an empty metric
+        :param name:
+            The metric name
+        :param description:
+            The help text shown to scrapers
+        :param labels:
+            The label names every sample is keyed by
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], object] = OrderedDict()
+        self.lock = Lock()
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """
+        The label values of a sample, in the order of the label names
+        :param labels:
+            The label values keyed by label name
+        :return:
+        """
+        if set(labels.keys()) != set(self.labels):
+            raise ValueError(
+                f'{self.name} expects labels {list(self.labels)}, '
+                f'got {list(labels.keys())}'
+            )
+        return tuple(str(labels[x]) for x in self.labels)
+
+    def samples(self) -> List[str]:
+        """
+        The sample lines of the metric
+        :return:
+        """
+        with self.lock:
+            return [
+                f'{self.name}{format_labels(self.labels, x)} '
+                f'{format_value(y)}'
+                for x, y in self.values.items()
+            ]
+
+    def render(self) -> str:
+        """
+        The metric in the Prometheus text format
+        :return:
+        """
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(Metric):
+    """
+    A value that only increases, such as the number of finished jobs
+    """
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the counter
+        :param amount:
+            The non-negative amount to add
+        :param labels:
+            The label values of the sample
+        :return: None
+        """
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        """
+        The current value of a sample
+        :param labels:
+            The label values of the sample
+        :return:
+        """
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, such as the number of running jobs
+    """
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increase the gauge
+        :param amount:
+            The amount to add
+        :param labels:
+            The label values of the sample
+        :return: None
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        """
+        Decrease the gauge
+        :param amount:
+            The amount to subtract
+        :param labels:
+            The label values of the sample
+        :return: None
+        """
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Replace the value of the gauge
+        :param value:
+        :param labels:
+            The label values of the sample
+        :return: None
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, such as stage latencies, counted
+    in cumulative buckets
+    """
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str],
+        buckets: Sequence[float] = BUCKETS
+    ):
+        """
+        Create an empty histogram
+        :param name:
+            The metric name
+        :param description:
+            The help text shown to scrapers
+        :param labels:
+            The label names every sample is keyed by
+        :param buckets:
+            The upper bounds of the buckets, in increasing order
+        """
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observed value
+        :param value:
+        :param labels:
+            The label values of the sample
+        :return: None
+        """
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values.keys():
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, total, count = self.values[key]
+            for number, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[number] += 1
+            self.values[key] = [counts, total + value, count + 1]
+
+    def samples(self) -> List[str]:
+        """
+        The bucket, sum and count lines of every label set
+        :return:
+        """
+        names = self.labels + ('le',)
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, number in zip(self.buckets, counts):
+                    lines.append(
+                        f'{self.name}_bucket'
+                        f'{format_labels(names, key + (format_value(bound),))}'
+                        f' {number}'
+                    )
+                labels = format_labels(self.labels, key)
+                lines.append(f'{self.name}_sum{labels} {format_value(total)}')
+                lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the application, rendered together for scraping
+    """
+    def __init__(self):
+        """
+        Create an empty registry
+        """
+        self.metrics: Dict[str, Metric] = OrderedDict()
+        self.__lock = Lock()
+
+    def __metric(self, kind: type, name: str, *args, **kwargs) -> Metric:
+        """
+        Get a registered metric, registering it on first use
+        :param kind:
+            The metric class
+        :param name:
+            The metric name
+        :return:
+        """
+        with self.__lock:
+            if name not in self.metrics.keys():
+                self.metrics[name] = kind(name, *args, **kwargs)
+            metric = self.metrics[name]
+        if type(metric) is not kind:
+            raise ValueError(
+                f'{name} is already registered as a {metric.kind}'
+            )
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = ()
+    ) -> Counter:
+        """
+        Get or register a counter
+        :param name:
+        :param description:
+        :param labels:
+        :return:
+        """
+        return self.__metric(Counter, name, description, labels)
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = ()
+    ) -> Gauge:
+        """
+        Get or register a gauge
+        :param name:
+        :param description:
+        :param labels:
+        :return:
+        """
+        return self.__metric(Gauge, name, description, labels)
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = BUCKETS
+    ) -> Histogram:
+        """
+        Get or register a histogram
+        :param name:
+        :param description:
+        :param labels:
+        :param buckets:
+        :return:
+        """
+        return self.__metric(Histogram, name, description, labels, buckets)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text format
+        :return:
+        """
+        with self.__lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(x.render() for x in metrics) + '\n'
+
+
+REGISTRY = Registry()
+CACHE_REQUESTS = REGISTRY.counter(
+    'energy_tools_cache_requests_total',
+    'Cache lookups by cache and result',
+    ['cache', 'result']
+)
+CACHE_ENTRIES = REGISTRY.gauge(
+    'energy_tools_cache_entries',
+    'Entries currently held by each cache',
+    ['cache']
+)
+
+
+def cache_lookup(cache: str, hit: bool, entries: int) -> None:
+    """
+    Record a cache lookup
+    :param cache:
+        The name of the cache
+    :param hit:
+        Whether the lookup found the entry
+    :param entries:
+        The number of entries in the cache after the lookup
+    :return: None
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+    CACHE_ENTRIES.set(entries, cache=cache)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serve the registry on /metrics
+    """
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        """
+        Answer a scrape
+        :return: None
+        """
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        """
+        Keep scrapes out of the application log
+        :return: None
+        """
+
+
+def serve(
+    host: str = HOST,
+    port: int = PORT
+) -> Optional[ThreadingHTTPServer]:
+    """
+    Start the metrics endpoint in a background thread, once per process.
+    When the port is taken the failure is logged and recorded in
+    SERVER_ERROR, and later calls do not try again
+    :param host:
+        The address to listen on, local only by default
+    :param port:
+        The port to listen on. The METRICS_PORT environment variable sets
+        the default, and 0 disables the endpoint
+    :return:
+        The running server, or None when it is disabled or the port is
+        taken
+    """
+    global SERVER, SERVER_ERROR
+    with SERVER_LOCK:
+        if SERVER is not None or SERVER_ERROR is not None or port == 0:
+            return SERVER
+        try:
+            SERVER = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as error:
+            SERVER_ERROR = f'Metrics endpoint unavailable on {host}:{port}: ' \
+                f'{error}'
+            LOGGER.warning(SERVER_ERROR)
+            return None
+        SERVER.daemon_threads = True
+        Thread(
+            target=SERVER.serve_forever, name='metrics', daemon=True
+        ).start()
+        return SERVER
@@ -0,0 +1,294 @@
+import os
+import re
+import glob
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Dict, List, Optional, Pattern, Tuple
+from Bio.PDB.Polypeptide import is_aa
+from scipy.spatial import cKDTree
+
+MSMS = 'lib/msms_linux/msms.x86_64Linux2.2.6.1'
+ATOM_TYPES = 'lib/msms_linux/atmtypenumbers'
+PROBE_RADIUS = 1.5
+DENSITY = 1.0
+MISSING_RADIUS = 0.01
+SCRATCH = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+
+
+class Surface:
+    """
+    A solvent excluded surface triangulated by MSMS
+    """
+    def __init__(
+        self,
+        vertices: np.ndarray,
+        normals: np.ndarray,
+        spheres: np.ndarray,
+        faces: np.ndarray
+    ):
+        """
+        Store the surface arrays
+        :param vertices:
+            The vertex coordinates, shape (n, 3)
+        :param normals:
+            The outward unit normal of every vertex, shape (n, 3)
+        :param spheres:
+            The index of the atom every vertex lies closest to
+        :param faces:
+            The vertex indices of every triangle, shape (m, 3)
+        """
+        self.vertices = vertices
+        self.normals = normals
+        self.spheres = spheres
+        self.faces = faces
+
+    def __len__(self) -> int:
+        """
+        The number of vertices
+        :return:
+        """
+        return len(self.vertices)
+
+
+@lru_cache(maxsize=None)
+def atom_types(
+    path: str = ATOM_TYPES
+) -> Tuple[List[Tuple[Pattern, Pattern, int]], Dict[int, float]]:
+    """
+    Read the residue and atom name patterns and the united atom radii that
+    the pdb_to_xyzr script of MSMS assigns radii with
+    :param path:
+        The atmtypenumbers file shipped with MSMS
+    :return:
+        The patterns in order of precedence with their atom type, and the
+        radius of every atom type
+    """
+    patterns = []
+    radii = {}
+    with open(path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if fields[0] == 'radius':
+                united = len(fields) > 4 and not fields[4].startswith('#')
+                radii[int(fields[1])] = float(fields[4 if united else 3])
+                continue
+            residue = '.*' if fields[0] == '*' else fields[0]
+            patterns.append((
+                re.compile(f'^{residue}$'),
+                re.compile(f'^{fields[1]}$'.replace('_', ' ')),
+                int(fields[2])
+            ))
+    return patterns, radii
+
+
+def united_name(name: str) -> str:
+    """
+    Collapse hydrogen names the way pdb_to_xyzr does before the lookup
+    :param name:
+        The four character atom name field of a PDB record
+    :return:
+        The atom name without blanks
+    """
+    if re.match(r'[ 0-9][HhDd]', name[:2]) or re.match(r'[Hh][^Gg]', name[:2]):
+        return 'H'
+    return name.replace(' ', '')
+
+
+def atom_radii(residues: np.ndarray, names: np.ndarray) -> np.ndarray:
+    """
+    Assign the united atom radius of every atom. Every distinct pair of
+    residue and atom name is looked up once
+    :param residues:
+        The residue name of every atom
+    :param names:
+        The four character atom name field of every atom
+    :return:
+        The radii in angstroms
+    """
+    patterns, radii = atom_types()
+    pairs = pd.DataFrame({'residue': residues, 'name': names})
+    unique = pairs.drop_duplicates()
+    values = []
+    for residue, name in unique.itertuples(index=False):
+        residue, name = residue.replace(' ', ''), united_name(name)
+        radius = MISSING_RADIUS
+        for pattern_residue, pattern_name, number in patterns:
+            if pattern_name.search(name) and pattern_residue.search(residue):
+                radius = radii.get(number, MISSING_RADIUS)
+                break
+        values.append(radius)
+    lookup = pd.Series(
+        values, index=pd.MultiIndex.from_frame(unique)
+    )
+    return lookup.reindex(pd.MultiIndex.from_frame(pairs)).values
+
+
+def read_atoms(pdb_text: str) -> pd.DataFrame:
+    """
+    Read the atom records of a PDB file at their fixed columns
+    :param pdb_text:
+        The contents of the PDB file
+    :return:
+        A dataframe with one row per atom, in file order
+    """
+    lines = pd.Series(pdb_text.splitlines())
+    lines = lines[lines.str.match('ATOM|HETATM')].str.ljust(54)
+    atoms = pd.DataFrame({
+        'name': lines.str[12:16].values,
+        'resname': lines.str[17:20].values,
+        'chain': lines.str[21].values,
+        'resi': lines.str[22:26].astype(int).values
+    })
+    for column, (start, end) in zip('xyz', [(30, 38), (38, 46), (46, 54)]):
+        atoms[column] = lines.str[start:end].astype(float).values
+    return atoms
+
+
+def read_table(file_name: str, columns: int) -> np.ndarray:
+    """
+    Read a whitespace separated numeric MSMS output file written without
+    header lines
+    :param file_name:
+    :param columns:
+        The number of values on every line
+    :return:
+        An array of shape (lines, columns)
+    """
+    with open(file_name, 'rb') as file:
+        values = np.array(file.read().split(), dtype=np.float64)
+    return values.reshape(-1, columns)
+
+
+def external(vertices: np.ndarray, normals: np.ndarray) -> bool:
+    """
+    Tell an outer surface from the surface of an enclosed cavity, whose
+    normals point inwards into the void
+    :param vertices:
+        The vertices of one surface component
+    :param normals:
+        The normals of those vertices
+    :return:
+    """
+    outward = np.sum(normals * (vertices - vertices.mean(axis=0)), axis=1)
+    return bool(outward.mean() > 0)
+
+
+def surface(
+    coordinates: np.ndarray,
+    radii: np.ndarray,
+    probe_radius: float = PROBE_RADIUS,
+    density: float = DENSITY,
+    msms: str = MSMS,
+    scratch: Optional[str] = SCRATCH,
+    all_components: bool = False
+) -> Surface:
+    """
+    Triangulate the solvent excluded surface of a set of spheres with MSMS.
+    The input and output files live in a scratch folder in memory where the
+    system provides one
+    :param coordinates:
+        The atom centers, shape (n, 3)
+    :param radii:
+        The atom radii
+    :param probe_radius:
+        The radius of the solvent probe in angstroms
+    :param density:
+        The number of vertices per square angstrom
+    :param msms:
+        Filepath of the MSMS executable
+    :param scratch:
+        The folder the temporary files are created in, None for the system
+        default
+    :param all_components:
+        Triangulate every separate piece of the outer surface instead of
+        only the first. Cavities are left out either way
+    :return:
+    """
+    records = np.column_stack([coordinates, radii])
+    command = [msms, '-no_header', '-probe_radius', str(probe_radius),
+               '-density', str(density)]
+    if all_components:
+        command.append('-all_components')
+    with tempfile.TemporaryDirectory(dir=scratch) as folder:
+        xyzr = os.path.join(folder, 'atoms.xyzr')
+        output = os.path.join(folder, 'surface')
+        np.savetxt(xyzr, records, fmt='%.3f %.3f %.3f %.2f')
+        process = subprocess.run(
+            command + ['-if', xyzr, '-of', output],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        if not os.path.isfile(f'{output}.vert'):
+            raise RuntimeError(
+                f'MSMS failed to build a surface:\n{process.stdout[-2000:]}'
+            )
+        components = [
+            (read_table(x, 9), read_table(f'{x[:-5]}.face', 5))
+            for x in sorted(glob.glob(f'{output}*.vert'))
+        ]
+    components = [
+        x for x in components if external(x[0][:, 0:3], x[0][:, 3:6])
+    ]
+    offsets = np.cumsum([0] + [len(x[0]) for x in components[:-1]])
+    vertices = np.concatenate([x[0] for x in components])
+    faces = np.concatenate([
+        x[1][:, 0:3].astype(np.int64) - 1 + y
+        for x, y in zip(components, offsets)
+    ])
+    return Surface(
+        vertices=vertices[:, 0:3],
+        normals=vertices[:, 3:6],
+        spheres=vertices[:, 7].astype(np.int64) - 1,
+        faces=faces
+    )
+
+
+def atom_depth(coordinates: np.ndarray, vertices: np.ndarray) -> np.ndarray:
+    """
+    The distance from every atom to the closest surface vertex
+    :param coordinates:
+        The atom centers, shape (n, 3)
+    :param vertices:
+        The surface vertices, shape (m, 3)
+    :return:
+    """
+    distances, _ = cKDTree(vertices).query(coordinates)
+    return distances
+
+
+def residue_depth(atoms: pd.DataFrame, vertices: np.ndarray) -> pd.Series:
+    """
+    The average atom depth of every amino acid residue
+    :param atoms:
+        The atom table created by read_atoms
+    :param vertices:
+        The surface vertices
+    :return:
+        The depths indexed by residue number. When several chains share a
+        number the last chain is kept
+    """
+    return residue_average(
+        atoms, atom_depth(atoms[['x', 'y', 'z']].values, vertices)
+    )
+
+
+def residue_average(atoms: pd.DataFrame, depths: np.ndarray) -> pd.Series:
+    """
+    Average atom depths over every amino acid residue
+    :param atoms:
+        The atom table created by read_atoms
+    :param depths:
+        The depth of every atom of the table
+    :return:
+        The depths indexed by residue number. When several chains share a
+        number the last chain is kept
+    """
+    amino = atoms['resname'].map(is_aa).values
+    depth = atoms.loc[amino, ['chain', 'resi']].assign(depth=depths[amino])
+    depth = depth.groupby(['chain', 'resi'], sort=False)['depth'].mean()
+    depth = depth.reset_index().drop_duplicates('resi', keep='last')
+    return depth.set_index('resi')['depth']
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Tuple
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.sparse.linalg import eigsh
+from lib.interactions import PRECISION, PairTable
+from lib.ranking import pair_deltas
+
+
+class ChangeNetwork:
+    """
+    A residue graph whose edges are the pairs with a large change in
+    interaction energy, stored as sparse matrices indexed by residue number
+    """
+    def __init__(
+        self,
+        table: PairTable,
+        terms: Iterable[str] or Dict[str, float] = ('total',),
+        threshold: float = 0.5
+    ):
+        """
+        Build the graph
+        :param table:
+            The union of the wild-type and variant pairs
+        :param terms:
+            The score terms to add up, or the coefficient of each term
+        :param threshold:
+            Pairs whose absolute change is below this value are left out
+        """
+        deltas = pair_deltas(table, terms)
+        keep = (np.abs(deltas) >= threshold) & (deltas != 0)
+        self.resi1 = table.resi1[keep].astype(np.int64)
+        self.resi2 = table.resi2[keep].astype(np.int64)
+        self.delta = deltas[keep]
+        self.size = int(max(
+            table.resi1.max(initial=0), table.resi2.max(initial=0)
+        )) + 1
+        self.graph = self.__matrix(np.abs(self.delta))
+        self.lengths = self.__matrix(1 / np.abs(self.delta))
+
+    def __matrix(self, weights: np.ndarray) -> csr_matrix:
+        """
+        Create a symmetric sparse matrix from edge weights
+        :param weights:
+            One weight per edge
+        :return:
+        """
+        rows = np.concatenate([self.resi1, self.resi2])
+        columns = np.concatenate([self.resi2, self.resi1])
+        return csr_matrix(
+            (np.concatenate([weights, weights]), (rows, columns)),
+            shape=(self.size, self.size)
+        )
+
+    @property
+    def nodes(self) -> np.ndarray:
+        """
+        The residues with at least one edge
+        :return:
+        """
+        return np.union1d(self.resi1, self.resi2)
+
+    def clusters(self) -> pd.DataFrame:
+        """
+        Group the residues into connected clusters of changed interactions
+        :return:
+            A dataframe with one row per cluster, largest net change first
+        """
+        count, labels = connected_components(self.graph, directed=False)
+        nodes = self.nodes
+        edge_labels = labels[self.resi1]
+        data = pd.DataFrame({
+            'cluster': labels[nodes],
+            'resi': nodes
+        }).groupby('cluster')['resi'].agg(
+            size='size',
+            residues=lambda x: ', '.join(map(str, x))
+        )
+        data['edges'] = np.bincount(edge_labels, minlength=count)[data.index]
+        data['net'] = np.bincount(
+            edge_labels, self.delta, minlength=count
+        )[data.index].round(PRECISION)
+        data = data[['size', 'edges', 'net', 'residues']]
+        order = np.argsort(-np.abs(data['net'].values), kind='stable')
+        return data.iloc[order].reset_index(drop=True)
+
+    def shortest_paths(
+        self,
+        sources: Iterable[int]
+    ) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Find the shortest energetic path from the nearest source to every
+        reachable residue. An edge is shorter the larger its change, so the
+        paths follow the strongest changes
+        :param sources:
+            The residues the paths start from, such as the mutations
+        :return:
+            A dataframe with one row per reachable residue, and the
+            predecessor of every residue for use with trace_path
+        """
+        sources = [x for x in sources if 0 <= x < self.size]
+        if not sources:
+            empty = pd.DataFrame(columns=['resi', 'source', 'distance'])
+            return empty, np.full(self.size, -9999, dtype=np.int32)
+        distance, predecessors, origin = dijkstra(
+            self.lengths,
+            directed=False,
+            indices=sources,
+            return_predecessors=True,
+            min_only=True
+        )
+        reached = np.flatnonzero(np.isfinite(distance))
+        data = pd.DataFrame({
+            'resi': reached,
+            'source': origin[reached],
+            'distance': distance[reached].round(PRECISION)
+        })
+        data = data.sort_values(['distance', 'resi'], ignore_index=True)
+        return data, predecessors
+
+    def centrality(self) -> pd.DataFrame:
+        """
+        Measure how central every residue is in the change network: the
+        number of changed interactions, their summed absolute change and
+        the eigenvector centrality of the weighted graph
+        :return:
+            A dataframe with one row per residue, most central first
+        """
+        nodes = self.nodes
+        degree = np.diff(self.graph.indptr)
+        strength = np.asarray(self.graph.sum(axis=1)).ravel()
+        eigenvector = np.zeros(self.size)
+        if len(nodes) > 2:
+            sub = self.graph[nodes][:, nodes].astype(np.float64)
+            values, vectors = eigsh(sub, k=1, which='LA')
+            eigenvector[nodes] = np.abs(vectors[:, 0])
+        elif len(nodes):
+            eigenvector[nodes] = 1 / np.sqrt(len(nodes))
+        data = pd.DataFrame({
+            'resi': nodes,
+            'degree': degree[nodes],
+            'strength': strength[nodes].round(PRECISION),
+            'eigenvector': eigenvector[nodes].round(4)
+        })
+        return data.sort_values(
+            ['eigenvector', 'strength'], ascending=False, ignore_index=True
+        )
+
+
+def trace_path(predecessors: np.ndarray, target: int) -> List[int]:
+    """
+    Follow the predecessors returned by ChangeNetwork.shortest_paths back
+    from a residue to its source
+    :param predecessors:
+        The predecessor of every residue
+    :param target:
+        The residue at the end of the path
+    :return:
+        The residues along the path, starting at the source
+    """
+    path = [target]
+    while predecessors[path[-1]] >= 0:
+        path.append(int(predecessors[path[-1]]))
+    return path[::-1]
@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+from scipy.spatial import cKDTree
+from lib.msms import read_atoms, united_name
+from lib.interactions import KEYS, PRECISION
+from lib.geometry import (
+    DONORS, ACCEPTORS, BACKBONE_DONORS, BACKBONE_ACCEPTORS, atom_mask
+)
+
+TERMS = [
+    'fa_atr', 'fa_rep', 'fa_sol', 'fa_intra_rep', 'fa_intra_sol_xover4',
+    'lk_ball_wtd', 'fa_elec', 'pro_close', 'hbond_sr_bb', 'hbond_lr_bb',
+    'hbond_bb_sc', 'hbond_sc', 'dslf_fa13', 'omega', 'fa_dun', 'p_aa_pp',
+    'yhh_planarity', 'ref', 'rama_prepro'
+]
+WEIGHTS = {
+    'fa_atr': 1.0,
+    'fa_rep': 0.55,
+    'fa_elec': 1.0,
+    'hbond': 1.0,
+    'dslf_fa13': 1.25
+}
+CUTOFF = 6.0
+SWITCH = 4.5
+LINEAR_REPULSION = 0.6
+LENNARD_JONES = {
+    'C': (2.0, 0.12),
+    'N': (1.75, 0.16),
+    'O': (1.55, 0.16),
+    'S': (1.9, 0.16)
+}
+BACKBONE = ['N', 'CA', 'C', 'O', 'OXT']
+PEPTIDE_NEIGHBOURS = BACKBONE + ['CB']
+BACKBONE_CHARGES = {'N': -0.3, 'CA': 0.3, 'C': 0.5, 'O': -0.5}
+SIDE_CHAIN_CHARGES = {
+    'ASP:OD1': -0.5, 'ASP:OD2': -0.5,
+    'GLU:OE1': -0.5, 'GLU:OE2': -0.5,
+    'LYS:NZ': 1.0,
+    'ARG:NE': 1 / 3, 'ARG:NH1': 1 / 3, 'ARG:NH2': 1 / 3
+}
+COULOMB = 332.0637
+DIELECTRIC = 4.0
+ELEC_CUTOFF = 5.5
+ELEC_MINIMUM = 1.45
+HBOND_ENERGY = -1.0
+HBOND_DISTANCE = (3.1, 3.5)
+SHORT_RANGE = 4
+DISULFIDE_ENERGY = -2.0
+DISULFIDE_DISTANCE = (1.8, 2.4)
+SHIFT = np.int64(1 << 32)
+
+
+def atom_table(pdb_text: str) -> pd.DataFrame:
+    """
+    Read the heavy atoms of a cleaned structure with the parameters of the
+    prescreen. Residues are numbered in file order from one, the way
+    Rosetta numbers the residues of a pose
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :return:
+        The atom table of read_atoms with the pose number, element, Lennard-
+        Jones radius and well depth, charge, and the hydrogen bond,
+        backbone and peptide bond neighbour flags of every atom
+    """
+    atoms = read_atoms(pdb_text)
+    atoms = atoms[atoms['name'].map(united_name) != 'H']
+    atoms = atoms.reset_index(drop=True)
+    atoms['name'] = atoms['name'].str.strip()
+    atoms['resname'] = atoms['resname'].str.strip()
+    residue = atoms['chain'] + ':' + atoms['resi'].astype(str)
+    atoms['pose'] = (residue != residue.shift()).cumsum().astype(np.int64)
+    atoms['element'] = atoms['name'].str.lstrip('0123456789').str[0]
+    parameters = pd.DataFrame(
+        LENNARD_JONES.values(), index=LENNARD_JONES.keys(),
+        columns=['radius', 'depth']
+    ).reindex(atoms['element'].values)
+    atoms['radius'] = parameters['radius'].fillna(2.0).values
+    atoms['depth'] = parameters['depth'].fillna(0.12).values
+    qualified = atoms['resname'] + ':' + atoms['name']
+    atoms['charge'] = qualified.map(SIDE_CHAIN_CHARGES).fillna(
+        atoms['name'].map(BACKBONE_CHARGES)
+    ).fillna(0.0).values
+    atoms['backbone'] = atoms['name'].isin(BACKBONE).values
+    atoms['peptide'] = atoms['name'].isin(PEPTIDE_NEIGHBOURS).values | (
+        (atoms['resname'] == 'PRO') & (atoms['name'] == 'CD')
+    ).values
+    atoms['donor'] = atom_mask(atoms, DONORS) | (
+        atoms['name'].isin(BACKBONE_DONORS) & (atoms['resname'] != 'PRO')
+    ).values
+    atoms['acceptor'] = atom_mask(atoms, ACCEPTORS) | \
+        atoms['name'].isin(BACKBONE_ACCEPTORS).values
+    return atoms
+
+
+def lennard_jones(
+    distance: np.ndarray,
+    sigma: np.ndarray,
+    epsilon: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Split a 12-6 Lennard-Jones potential into an attractive and a repulsive
+    part at its minimum, the way fa_atr and fa_rep do. The repulsion turns
+    linear at short distances so that clashes stay finite, and the
+    attraction fades out between SWITCH and CUTOFF
+    :param distance:
+        The distance of every atom pair
+    :param sigma:
+        The distance of the minimum of every pair
+    :param epsilon:
+        The depth of the minimum of every pair
+    :return:
+        The attractive and repulsive energy of every pair
+    """
+    def potential(d: np.ndarray) -> np.ndarray:
+        ratio = (sigma / d) ** 6
+        return epsilon * (ratio ** 2 - 2 * ratio)
+
+    linear = LINEAR_REPULSION * sigma
+    ratio = (sigma / linear) ** 6
+    slope = -12 * epsilon * (ratio ** 2 - ratio) / linear
+    energy = np.where(
+        distance < linear,
+        potential(linear) + slope * (distance - linear),
+        potential(np.maximum(distance, linear))
+    )
+    fade = np.clip((CUTOFF - distance) / (CUTOFF - SWITCH), 0, 1)
+    return {
+        'fa_atr': np.where(distance < sigma, -epsilon, energy * fade),
+        'fa_rep': np.where(distance < sigma, energy + epsilon, 0.0)
+    }
+
+
+def coulomb(
+    distance: np.ndarray,
+    charge1: np.ndarray,
+    charge2: np.ndarray
+) -> np.ndarray:
+    """
+    Coulomb energy with a distance dependent dielectric, shifted to reach
+    zero at ELEC_CUTOFF
+    :param distance:
+        The distance of every atom pair
+    :param charge1:
+        The charge of the first atom of every pair
+    :param charge2:
+        The charge of the second atom of every pair
+    :return:
+    """
+    distance = np.clip(distance, ELEC_MINIMUM, ELEC_CUTOFF)
+    scale = COULOMB / DIELECTRIC
+    return scale * charge1 * charge2 * (
+        1 / distance ** 2 - 1 / ELEC_CUTOFF ** 2
+    )
+
+
+def window(distance: np.ndarray, full: float, end: float) -> np.ndarray:
+    """
+    A weight of one up to a distance, falling linearly to zero at another
+    :param distance:
+    :param full:
+        The distance up to which the weight is one
+    :param end:
+        The distance at which the weight reaches zero
+    :return:
+    """
+    return np.clip((end - distance) / (end - full), 0, 1)
+
+
+def atom_pairs(atoms: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Find the atom pairs of different residues within CUTOFF. Pairs of
+    consecutive residues of a chain that are at most three bonds apart
+    across the peptide bond are left out, much like the count-pair rules of
+    Rosetta
+    :param atoms:
+        The table created by atom_table
+    :return:
+        The atom indices and the distance of every pair
+    """
+    coords = atoms[['x', 'y', 'z']].values
+    pairs = cKDTree(coords).query_pairs(CUTOFF, output_type='ndarray')
+    first, second = pairs[:, 0], pairs[:, 1]
+    pose = atoms['pose'].values
+    chain = atoms['chain'].values
+    peptide = atoms['peptide'].values
+    bonded = (np.abs(pose[first] - pose[second]) == 1) & \
+        (chain[first] == chain[second]) & \
+        peptide[first] & peptide[second]
+    keep = (pose[first] != pose[second]) & ~bonded
+    first, second = first[keep], second[keep]
+    distance = np.linalg.norm(coords[first] - coords[second], axis=1)
+    return {'first': first, 'second': second, 'distance': distance}
+
+
+def pair_terms(
+    atoms: pd.DataFrame,
+    pairs: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """
+    Score every atom pair. Between the beta carbons and sulfur atoms of
+    two disulfide bonded cysteines only the disulfide term is counted
+    :param atoms:
+        The table created by atom_table
+    :param pairs:
+        The pairs found by atom_pairs
+    :return:
+        The weighted energy of every pair for each score term the prescreen
+        models
+    """
+    first, second = pairs['first'], pairs['second']
+    distance = pairs['distance']
+    values = {x: atoms[x].values for x in [
+        'radius', 'depth', 'charge', 'backbone', 'donor', 'acceptor',
+        'pose', 'chain', 'resname', 'name'
+    ]}
+    cysteine = (values['resname'] == 'CYS') & np.isin(
+        values['name'], ['CB', 'SG']
+    )
+    sulfur = cysteine & (values['name'] == 'SG')
+    bond = sulfur[first] & sulfur[second] & (
+        (distance >= DISULFIDE_DISTANCE[0]) &
+        (distance <= DISULFIDE_DISTANCE[1])
+    )
+    residues = values['pose'][first] * SHIFT + values['pose'][second]
+    bridged = cysteine[first] & cysteine[second] & np.isin(
+        residues, residues[bond]
+    )
+    terms = lennard_jones(
+        distance,
+        values['radius'][first] + values['radius'][second],
+        np.sqrt(values['depth'][first] * values['depth'][second])
+    )
+    terms['fa_elec'] = coulomb(
+        distance, values['charge'][first], values['charge'][second]
+    )
+    terms = {x: y * ~bridged for x, y in terms.items()}
+    terms['dslf_fa13'] = DISULFIDE_ENERGY * bond
+    polar = (values['donor'][first] & values['acceptor'][second]) | \
+        (values['acceptor'][first] & values['donor'][second])
+    hbond = HBOND_ENERGY * polar * window(distance, *HBOND_DISTANCE)
+    backbone = values['backbone'][first].astype(int) + \
+        values['backbone'][second]
+    local = (values['chain'][first] == values['chain'][second]) & (
+        np.abs(values['pose'][first] - values['pose'][second]) <= SHORT_RANGE
+    )
+    terms['hbond_sr_bb'] = hbond * ((backbone == 2) & local)
+    terms['hbond_lr_bb'] = hbond * ((backbone == 2) & ~local)
+    terms['hbond_bb_sc'] = hbond * (backbone == 1)
+    terms['hbond_sc'] = hbond * (backbone == 0)
+    return {
+        x: y * WEIGHTS['hbond' if x.startswith('hbond') else x]
+        for x, y in terms.items()
+    }
+
+
+def prescreen(pdb_text: str) -> pd.DataFrame:
+    """
+    Estimate the residue energy breakdown of a structure in seconds, for
+    triage before Rosetta or when Rosetta is unavailable. Lennard-Jones,
+    Coulomb, distance based hydrogen bond and disulfide energies of every
+    atom pair within CUTOFF are summed per residue pair. Terms the
+    prescreen does not model are reported as zero
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :return:
+        The residue energy breakdown dataframe, in the layout read from
+        Rosetta
+    """
+    atoms = atom_table(pdb_text)
+    pairs = atom_pairs(atoms)
+    terms = pair_terms(atoms, pairs)
+    pose = atoms['pose'].values.astype(np.int64)
+    resi1 = np.minimum(pose[pairs['first']], pose[pairs['second']])
+    resi2 = np.maximum(pose[pairs['first']], pose[pairs['second']])
+    keys, inverse = np.unique(resi1 * SHIFT + resi2, return_inverse=True)
+    scores = np.zeros((len(keys), len(TERMS)))
+    for number, term in enumerate(TERMS):
+        if term in terms.keys():
+            scores[:, number] = np.bincount(
+                inverse, weights=terms[term], minlength=len(keys)
+            )
+    scores = scores.round(PRECISION)
+    keep = np.any(scores != 0, axis=1)
+    keys, scores = keys[keep], scores[keep]
+    residues = atoms.drop_duplicates('pose').set_index('pose')
+    labels = (residues['resi'].astype(str) + residues['chain']).values
+    names = residues['resname'].values
+    data = pd.DataFrame({'resi1': keys // SHIFT, 'resi2': keys % SHIFT})
+    for i in ['1', '2']:
+        data[f'pdbid{i}'] = labels[data[f'resi{i}'].values - 1]
+        data[f'restype{i}'] = names[data[f'resi{i}'].values - 1]
+    data = data[KEYS]
+    for number, term in enumerate(TERMS):
+        data[term] = scores[:, number]
+    data['total'] = scores.sum(axis=1).round(PRECISION)
+    return data
@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import cProfile
+import marshal
+import pandas as pd
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Event, Lock, Thread, get_ident
+from types import FrameType
+from typing import Dict, Iterator, Optional
+
+PAGE = 'page'
+STAGES = [
+    PAGE, 'clean', 'mutations', 'depth', 'msms', 'msms_patch',
+    'energy_breakdown', 'rosetta', 'parse', 'interaction_analysis',
+    'fill_holes', 'plot_master', 'burial', 'prescreen',
+    'rosetta_crop'
+]
+MODES = ['sampling', 'deterministic']
+INTERVAL = 0.005
+DETERMINISTIC = Lock()
+REQUEST: ContextVar[Optional['ProfileRequest']] = ContextVar(
+    'profile_request', default=None
+)
+
+
+def collapse(frame: FrameType) -> str:
+    """
+    Describe a call stack in the collapsed format read by flame graph tools
+    :param frame:
+        The innermost frame of the stack
+    :return:
+        The frames from outermost to innermost, separated by semicolons
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f'{code.co_name} '
+            f'({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        )
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(Thread):
+    """
+    Periodically record the call stack of another thread
+    """
+    def __init__(self, thread: int, interval: float = INTERVAL):
+        """
+        Create a sampler, which starts sampling once started
+        :param thread:
+            The identifier of the thread to sample
+        :param interval:
+            Seconds between samples
+        """
+        super().__init__(name='profiler', daemon=True)
+        self.thread = thread
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.__finished = Event()
+
+    def run(self) -> None:
+        """
+        Sample the thread until stopped
+        :return: None
+        """
+        while not self.__finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self) -> Counter:
+        """
+        Stop sampling and wait for the last sample
+        :return:
+            The number of samples of every collapsed stack
+        """
+        self.__finished.set()
+        self.join()
+        return self.stacks
+
+
+class Capture:
+    """
+    The profile of one run of a page render or pipeline stage
+    """
+    def __init__(
+        self,
+        name: str,
+        mode: str,
+        stacks: Counter,
+        interval: float,
+        wall: float,
+        profiler: Optional[cProfile.Profile] = None
+    ):
+        """
+        Store the results of a profiled run
+        :param name:
+            The name of the profiled stage
+        :param mode:
+            "sampling", or "deterministic" when cProfile ran as well
+        :param stacks:
+            The number of samples of every collapsed stack
+        :param interval:
+            Seconds between samples
+        :param wall:
+            The wall time of the run in seconds
+        :param profiler:
+            The cProfile profiler of a deterministic run
+        """
+        self.name = name
+        self.mode = mode
+        self.stacks = stacks
+        self.interval = interval
+        self.wall = wall
+        self.stats: Optional[Dict] = None
+        if profiler is not None:
+            profiler.create_stats()
+            self.stats = profiler.stats
+
+    def file_name(self, extension: str) -> str:
+        """
+        A download file name for this capture
+        :param extension:
+            The file extension
+        :return:
+        """
+        name = self.name.replace(':', '_').replace(' ', '_')
+        return f'{name}.{extension}'
+
+    def collapsed(self) -> str:
+        """
+        The sampled stacks in collapsed format, ready for flamegraph.pl,
+        speedscope or inferno
+        :return:
+        """
+        return '\n'.join(
+            f'{x} {y}' for x, y in sorted(self.stacks.items())
+        )
+
+    def profile(self) -> Optional[bytes]:
+        """
+        The cProfile statistics in the format read by pstats and snakeviz
+        :return:
+            The statistics, or None for a sampling run
+        """
+        if self.stats is None:
+            return None
+        return marshal.dumps(self.stats)
+
+    def summary(self, limit: int = 25) -> pd.DataFrame:
+        """
+        The functions the run spent the most time in
+        :param limit:
+            The number of functions to return
+        :return:
+            A dataframe of self and cumulative seconds per function
+        """
+        if self.stats is not None:
+            rows = [
+                {
+                    'function': f'{x[2]} ({os.path.basename(x[0])}:{x[1]})',
+                    'calls': y[1],
+                    'self': y[2],
+                    'cumulative': y[3]
+                }
+                for x, y in self.stats.items()
+            ]
+        else:
+            own, total = Counter(), Counter()
+            for stack, count in self.stacks.items():
+                frames = stack.split(';')
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+            rows = [
+                {
+                    'function': x,
+                    'samples': y,
+                    'self': own[x] * self.interval,
+                    'cumulative': y * self.interval
+                }
+                for x, y in total.items()
+            ]
+        if not rows:
+            return pd.DataFrame(columns=['function', 'self', 'cumulative'])
+        data = pd.DataFrame(rows).sort_values('cumulative', ascending=False)
+        return data.head(limit).reset_index(drop=True).round(4)
+
+
+class ProfileRequest:
+    """
+    A request to profile the next run of a page render or pipeline stage,
+    stored in the session state and shared with the threads it starts
+    """
+    def __init__(
+        self,
+        target: str,
+        mode: str = 'sampling',
+        repeat: bool = False,
+        interval: float = INTERVAL
+    ):
+        """
+        Arm the profiler
+        :param target:
+            The span name to profile, or "page" for any page render
+        :param mode:
+            "sampling" records stacks only, "deterministic" runs cProfile
+            as well
+        :param repeat:
+            Keep profiling every run of the target instead of only the next
+        :param interval:
+            Seconds between stack samples
+        """
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode: {mode}')
+        self.target = target
+        self.mode = mode
+        self.repeat = repeat
+        self.interval = interval
+        self.armed = True
+        self.capture: Optional[Capture] = None
+        self.__lock = Lock()
+
+    def claim(self, name: str) -> bool:
+        """
+        Check whether a stage should be profiled, disarming a one-off
+        request so that concurrent runs of the stage are not profiled twice
+        :param name:
+            The span name of the stage
+        :return:
+        """
+        matches = self.target == name or (
+            self.target == PAGE and name.startswith(f'{PAGE}:')
+        )
+        with self.__lock:
+            if not (self.armed and matches):
+                return False
+            self.armed = self.repeat
+            return True
+
+
+def activate(request: Optional[ProfileRequest]) -> None:
+    """
+    Make a request visible to the stages run by the current thread and the
+    threads it starts
+    :param request:
+        The request of the session, or None when nothing is armed
+    :return: None
+    """
+    REQUEST.set(request)
+
+
+@contextmanager
+def profiled(name: str) -> Iterator[Optional[ProfileRequest]]:
+    """
+    Profile a block of code if the active request targets it
+    :param name:
+        The span name of the block
+    :return:
+        The request that claimed the block, or None
+    """
+    request = REQUEST.get()
+    if request is None or not request.claim(name):
+        yield None
+        return
+    profiler = None
+    if request.mode == 'deterministic' and DETERMINISTIC.acquire(False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None
+            DETERMINISTIC.release()
+    sampler = Sampler(get_ident(), request.interval)
+    token = REQUEST.set(None)
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield request
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            DETERMINISTIC.release()
+        wall = time.perf_counter() - start
+        REQUEST.reset(token)
+        request.capture = Capture(
+            name=name,
+            mode='sampling' if profiler is None else 'deterministic',
+            stacks=sampler.stop(),
+            interval=request.interval,
+            wall=wall,
+            profiler=profiler
+        )
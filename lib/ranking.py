@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Tuple
+from lib.interactions import PRECISION, PairTable
+
+
+def combination(terms: Iterable[str] or Dict[str, float]) -> Dict[str, float]:
+    """
+    Normalize a selection of score terms to a weighted combination
+    :param terms:
+        The score terms to add up, or the coefficient of each term
+    :return:
+    """
+    if isinstance(terms, dict):
+        return terms
+    return {x: 1.0 for x in terms}
+
+
+def pair_deltas(
+    table: PairTable,
+    terms: Iterable[str] or Dict[str, float]
+) -> np.ndarray:
+    """
+    The change from wild-type to variant of a score term or combination of
+    terms, for every pair of the union table. Pairs absent from one
+    structure count as zero in that structure
+    :param table:
+        The union of the wild-type and variant pairs
+    :param terms:
+        The score terms to add up, or the coefficient of each term
+    :return:
+        A float64 array with one entry per pair
+    """
+    terms = combination(terms)
+    columns = [table.term(x) for x in terms.keys()]
+    vector = np.array(list(terms.values()), dtype=np.float64)
+    wild = table.wild[:, columns].astype(np.float64) @ vector
+    variant = table.variant[:, columns].astype(np.float64) @ vector
+    return (variant - wild).round(PRECISION)
+
+
+def top_indices(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    The positions of the k largest values in descending order, found with a
+    partial selection so that only the selected values are sorted
+    :param values:
+        The values to rank
+    :param k:
+        The number of positions to return
+    :return:
+    """
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    selected = np.argpartition(-values, k - 1)[:k]
+    return selected[np.argsort(-values[selected], kind='stable')]
+
+
+def top_pairs(
+    table: PairTable,
+    k: int,
+    terms: Iterable[str] or Dict[str, float] = ('total',),
+    rows: np.ndarray = None
+) -> pd.DataFrame:
+    """
+    Find the pairs with the largest absolute change of a score term or
+    combination of terms
+    :param table:
+        The union of the wild-type and variant pairs
+    :param k:
+        The number of pairs to return
+    :param terms:
+        The score terms to add up, or the coefficient of each term
+    :param rows:
+        If provided, only these positions of the union table are ranked,
+        such as the pairs of one interaction class
+    :return:
+        A dataframe with one row per pair, largest change first
+    """
+    deltas = pair_deltas(table, terms)
+    if rows is None:
+        rows = np.arange(len(table))
+    rows = rows[top_indices(np.abs(deltas[rows]), k)]
+    labels = table.labels_variant['restype']
+    return pd.DataFrame({
+        'resi1': table.resi1[rows].astype(np.int64),
+        'resi2': table.resi2[rows].astype(np.int64),
+        'restype1': labels.reindex(table.resi1[rows]).values,
+        'restype2': labels.reindex(table.resi2[rows]).values,
+        'in_wild': table.in_wild[rows],
+        'in_variant': table.in_variant[rows],
+        'delta': deltas[rows]
+    })
+
+
+def residue_net(
+    table: PairTable,
+    terms: Iterable[str] or Dict[str, float] = ('total',)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Add up the change of every pair onto both of its residues
+    :param table:
+        The union of the wild-type and variant pairs
+    :param terms:
+        The score terms to add up, or the coefficient of each term
+    :return:
+        The residue positions and their net change
+    """
+    deltas = pair_deltas(table, terms)
+    size = int(max(table.resi1.max(initial=0), table.resi2.max(initial=0)))
+    net = np.bincount(table.resi1, deltas, size + 1) + \
+        np.bincount(table.resi2, deltas, size + 1)
+    resi = np.union1d(table.resi1, table.resi2).astype(np.int64)
+    return resi, net[resi].round(PRECISION)
+
+
+def top_residues(
+    table: PairTable,
+    k: int,
+    terms: Iterable[str] or Dict[str, float] = ('total',)
+) -> pd.DataFrame:
+    """
+    Find the residues with the largest absolute net change of a score term
+    or combination of terms
+    :param table:
+        The union of the wild-type and variant pairs
+    :param k:
+        The number of residues to return
+    :param terms:
+        The score terms to add up, or the coefficient of each term
+    :return:
+        A dataframe with one row per residue, largest change first
+    """
+    resi, net = residue_net(table, terms)
+    selected = top_indices(np.abs(net), k)
+    resi = resi[selected]
+    return pd.DataFrame({
+        'resi': resi,
+        'restype_wild': table.labels_wild['restype'].reindex(resi).values,
+        'restype_variant': table.labels_variant['restype']
+        .reindex(resi).values,
+        'net': net[selected]
+    })
@@ -0,0 +1,75 @@
+import copy
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from lib.interactions import KEYS, PRECISION, PairTable
+
+
+def score_terms(columns: List[str]) -> List[str]:
+    """
+    The score terms that add up to the total score
+    :param columns:
+        The columns of a residue energy breakdown
+    :return:
+    """
+    return [x for x in columns if x not in KEYS and x != 'total']
+
+
+def weight_vector(terms: List[str], weights: Dict[str, float]) -> np.ndarray:
+    """
+    Arrange user weights in the order of the score terms
+    :param terms:
+        The score terms
+    :param weights:
+        The weight of each score term. Terms that are not listed keep a
+        weight of one
+    :return:
+        A float64 array with one weight per term
+    """
+    return np.array([weights.get(x, 1.0) for x in terms], dtype=np.float64)
+
+
+def reweight(data: pd.DataFrame, weights: Dict[str, float]) -> pd.DataFrame:
+    """
+    Recompute the total score of every pair with new score term weights.
+    The breakdown reports weighted terms, so the weights scale the terms
+    Rosetta reported. Without weights the total Rosetta reported is kept
+    :param data:
+        The residue energy breakdown dataframe
+    :param weights:
+        The weight of each score term
+    :return:
+        A copy of the breakdown with a new total column
+    """
+    if not weights:
+        return data.copy()
+    terms = score_terms(data.columns.tolist())
+    values = data[terms].values.astype(np.float64)
+    data = data.copy()
+    data['total'] = (values @ weight_vector(terms, weights)).round(PRECISION)
+    return data
+
+
+def reweight_table(table: PairTable, weights: Dict[str, float]) -> PairTable:
+    """
+    Recompute the total score of both structures of a union table with new
+    score term weights. The float32 terms are rounded back to the precision
+    Rosetta reports, so the totals match those of reweight. The new table
+    shares every other array with the original table
+    :param table:
+        The union of the wild-type and variant pairs
+    :param weights:
+        The weight of each score term
+    :return:
+    """
+    terms = score_terms(table.terms)
+    columns = [table.term(x) for x in terms]
+    vector = weight_vector(terms, weights)
+    result = copy.copy(table)
+    for side in ['wild', 'variant']:
+        values: np.ndarray = getattr(table, side).copy()
+        scores = values[:, columns].astype(np.float64).round(PRECISION)
+        total = scores @ vector
+        values[:, table.term('total')] = total.round(PRECISION)
+        setattr(result, side, values)
+    return result
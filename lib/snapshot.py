@@ -0,0 +1,217 @@
+import json
+import numpy as np
+import pandas as pd
+from io import BytesIO, StringIO
+from typing import Any, Dict, Tuple
+from lib.interactions import InteractionResults
+
+VERSION = 1
+
+
+def pack_frame(
+    prefix: str,
+    data: pd.DataFrame,
+    arrays: Dict[str, np.ndarray]
+) -> dict:
+    """
+    Store a dataframe column by column
+    :param prefix:
+        The namespace of the dataframe inside the bundle
+    :param data:
+        The dataframe to store
+    :param arrays:
+        The bundle arrays, which receive one array per column
+    :return:
+        The schema needed to rebuild the dataframe
+    """
+    index = data.index.name
+    if index is not None:
+        data = data.reset_index()
+    columns = []
+    for number, name in enumerate(data.columns):
+        values = data.iloc[:, number]
+        dtype = str(values.dtype)
+        if values.dtype.kind in 'biuf':
+            arrays[f'{prefix}/{number}'] = values.values
+        else:
+            arrays[f'{prefix}/{number}'] = np.asarray(
+                values.astype(str), dtype=str
+            )
+        columns.append([str(name), dtype])
+    return {'kind': 'frame', 'columns': columns, 'index': index}
+
+
+def unpack_frame(
+    prefix: str,
+    schema: dict,
+    arrays: Any
+) -> pd.DataFrame:
+    """
+    Rebuild a dataframe stored with pack_frame
+    :param prefix:
+        The namespace of the dataframe inside the bundle
+    :param schema:
+        The schema returned by pack_frame
+    :param arrays:
+        The loaded bundle
+    :return:
+    """
+    data = {}
+    for number, (name, dtype) in enumerate(schema['columns']):
+        values = arrays[f'{prefix}/{number}']
+        if dtype == 'category':
+            values = pd.Categorical(values)
+        elif values.dtype.kind == 'U':
+            values = values.astype(object)
+        data[name] = values
+    data = pd.DataFrame(data, columns=[x[0] for x in schema['columns']])
+    if schema['index'] is not None:
+        data.set_index(schema['index'], inplace=True)
+    return data
+
+
+def pack_value(
+    prefix: str,
+    value: Any,
+    arrays: Dict[str, np.ndarray]
+) -> dict or None:
+    """
+    Store one session state entry
+    :param prefix:
+        The namespace of the entry inside the bundle
+    :param value:
+        The session state entry
+    :param arrays:
+        The bundle arrays, which receive the data of the entry
+    :return:
+        The description needed to rebuild the entry, or None if the entry
+        can not be stored
+    """
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return {'kind': 'value', 'value': value}
+    if isinstance(value, pd.DataFrame):
+        return pack_frame(prefix, value, arrays)
+    if isinstance(value, tuple):
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            return None
+        return {'kind': 'tuple', 'value': value}
+    if isinstance(value, InteractionResults):
+        for key, array in value.to_arrays().items():
+            arrays[f'{prefix}/{key}'] = array
+        return {'kind': 'results'}
+    if isinstance(value, StringIO):
+        arrays[prefix] = np.frombuffer(value.getvalue().encode(), np.uint8)
+        return {'kind': 'text'}
+    if hasattr(value, 'getvalue'):
+        arrays[prefix] = np.frombuffer(value.getvalue(), np.uint8)
+        return {'kind': 'file', 'name': getattr(value, 'name', prefix)}
+    if isinstance(value, dict) and all(
+        isinstance(x, (int, np.integer)) for x in value.keys()
+    ):
+        arrays[f'{prefix}/keys'] = np.array(list(value.keys()), np.int64)
+        arrays[f'{prefix}/values'] = np.array(list(value.values()), float)
+        return {'kind': 'map'}
+    if isinstance(value, dict) and all(
+        isinstance(x, str) and isinstance(y, (int, float))
+        for x, y in value.items()
+    ):
+        return {'kind': 'value', 'value': value}
+    return None
+
+
+def unpack_value(prefix: str, entry: dict, arrays: Any) -> Any:
+    """
+    Rebuild one session state entry stored with pack_value
+    :param prefix:
+        The namespace of the entry inside the bundle
+    :param entry:
+        The description returned by pack_value
+    :param arrays:
+        The loaded bundle
+    :return:
+    """
+    kind = entry['kind']
+    if kind == 'value':
+        return entry['value']
+    if kind == 'tuple':
+        return as_tuple(entry['value'])
+    if kind == 'frame':
+        return unpack_frame(prefix, entry, arrays)
+    if kind == 'results':
+        start = len(prefix) + 1
+        return InteractionResults.from_arrays({
+            x[start:]: arrays[x] for x in arrays.files
+            if x.startswith(f'{prefix}/')
+        })
+    if kind == 'text':
+        return StringIO(arrays[prefix].tobytes().decode())
+    if kind == 'file':
+        file = BytesIO(arrays[prefix].tobytes())
+        file.name = entry['name']
+        return file
+    keys = arrays[f'{prefix}/keys'].tolist()
+    values = arrays[f'{prefix}/values'].tolist()
+    return dict(zip(keys, values))
+
+
+def as_tuple(value: Any) -> Any:
+    """
+    Turn the lists of a value read back from JSON into tuples again
+    :param value:
+    :return:
+    """
+    if isinstance(value, list):
+        return tuple(as_tuple(x) for x in value)
+    return value
+
+
+def export_session(files: dict, analysis: dict) -> bytes:
+    """
+    Bundle the uploaded files, every pre-calculated result and the
+    interaction analysis into one compressed file
+    :param files:
+        The session state of the File Upload page
+    :param analysis:
+        The session state of the Interaction Analysis page
+    :return:
+        The contents of the bundle
+    """
+    arrays = {}
+    manifest = {'version': VERSION, 'File Upload': {},
+                'Interaction Analysis': {}}
+    for page, state in [
+        ('File Upload', files), ('Interaction Analysis', analysis)
+    ]:
+        for key, value in state.items():
+            entry = pack_value(f'{page}/{key}', value, arrays)
+            if entry is not None:
+                manifest[page][key] = entry
+    arrays['manifest'] = np.array(json.dumps(manifest))
+    stream = BytesIO()
+    np.savez_compressed(stream, **arrays)
+    return stream.getvalue()
+
+
+def import_session(data: bytes) -> Tuple[dict, dict]:
+    """
+    Restore a bundle created by export_session
+    :param data:
+        The contents of the bundle
+    :return:
+        The session state of the File Upload and Interaction Analysis pages
+    """
+    arrays = np.load(BytesIO(data), allow_pickle=False)
+    manifest = json.loads(arrays['manifest'].item())
+    if manifest['version'] != VERSION:
+        raise ValueError(
+            f'Unsupported snapshot version {manifest["version"]}'
+        )
+    states = []
+    for page in ['File Upload', 'Interaction Analysis']:
+        states.append({
+            key: unpack_value(f'{page}/{key}', entry, arrays)
+            for key, entry in manifest[page].items()
+        })
+    return states[0], states[1]
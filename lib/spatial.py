@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from io import StringIO
+from typing import Iterable
+from Bio.PDB.PDBParser import PDBParser
+from scipy.spatial import cKDTree
+
+
+def load_atoms(pdb_file: StringIO) -> pd.DataFrame:
+    """
+    Read the atoms of a cleaned PDB file into a table
+    :param pdb_file:
+        The cleaned PDB file as stored in streamlit session state
+    :return:
+        A dataframe with one row per atom
+    """
+    parser = PDBParser()
+    parser.QUIET = True
+    structure = parser.get_structure(0, pdb_file)
+    pdb_file.seek(0)
+    rows = []
+    for atom in structure[0].get_atoms():
+        residue = atom.get_parent()
+        rows.append((
+            residue.get_id()[1],
+            residue.get_resname(),
+            residue.get_parent().get_id(),
+            atom.get_name(),
+            atom.element,
+            *atom.get_coord()
+        ))
+    atoms = pd.DataFrame(
+        rows,
+        columns=['resi', 'resname', 'chain', 'name', 'element', 'x', 'y', 'z']
+    )
+    return atoms.astype({'x': np.float32, 'y': np.float32, 'z': np.float32})
+
+
+class NeighbourIndex:
+    """
+    A KD-tree over the atoms of a structure, answering which residues are
+    close to a set of positions
+    """
+    def __init__(self, atoms: pd.DataFrame):
+        """
+        Build the KD-tree
+        :param atoms:
+            The atom table created by load_atoms
+        """
+        self.atoms = atoms
+        self.coords = atoms[['x', 'y', 'z']].values.astype(np.float64)
+        self.resi = atoms['resi'].values
+        self.tree = cKDTree(self.coords)
+
+    def shell(self, positions: Iterable[int], radius: float) -> np.ndarray:
+        """
+        Find the residues with any atom within a distance of any atom of
+        the given positions
+        :param positions:
+            The residue positions at the center of the shell
+        :param radius:
+            The radius of the shell in angstroms
+        :return:
+            The sorted residue positions inside the shell, including the
+            positions themselves
+        """
+        positions = np.asarray(list(positions), dtype=np.int64)
+        query = self.coords[np.isin(self.resi, positions)]
+        if not len(query):
+            return np.unique(positions)
+        hits = self.tree.query_ball_point(query, r=radius)
+        hits = np.concatenate([np.asarray(x, dtype=np.int64) for x in hits])
+        return np.union1d(np.unique(self.resi[hits]), positions)
+
+
+def mutation_shell(
+    pdb_wild: StringIO,
+    pdb_variant: StringIO,
+    positions: Iterable[int],
+    radius: float
+) -> np.ndarray:
+    """
+    Find the residues within a distance of the mutated positions in either
+    the wild-type or the variant structure
+    :param pdb_wild:
+        The cleaned wild-type PDB file
+    :param pdb_variant:
+        The cleaned variant PDB file
+    :param positions:
+        The mutated positions
+    :param radius:
+        The radius of the shell in angstroms
+    :return:
+        The sorted residue positions inside the shell
+    """
+    positions = list(positions)
+    shells = [
+        NeighbourIndex(load_atoms(x)).shell(positions, radius)
+        for x in [pdb_wild, pdb_variant]
+    ]
+    return np.union1d(*shells)
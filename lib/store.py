@@ -0,0 +1,364 @@
+import hashlib
+import sqlite3
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+DATABASE = 'lib/storage/analysis.db'
+ENERGY_TERMS = [
+    'fa_atr', 'fa_rep', 'fa_sol', 'fa_intra_rep', 'fa_intra_sol_xover4',
+    'lk_ball_wtd', 'fa_elec', 'pro_close', 'hbond_sr_bb', 'hbond_lr_bb',
+    'hbond_bb_sc', 'hbond_sc', 'dslf_fa13', 'omega', 'fa_dun', 'p_aa_pp',
+    'yhh_planarity', 'ref', 'rama_prepro', 'total'
+]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS variants (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created TEXT NOT NULL,
+        wild_hash TEXT,
+        variant_hash TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS mutations (
+        variant INTEGER NOT NULL REFERENCES variants(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        mutated TEXT,
+        wild TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS interactions (
+        variant INTEGER NOT NULL REFERENCES variants(id) ON DELETE CASCADE,
+        category TEXT NOT NULL,
+        change TEXT NOT NULL,
+        resi1 INTEGER NOT NULL,
+        resi2 INTEGER NOT NULL,
+        restype1 TEXT,
+        restype2 TEXT,
+        total REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS depth (
+        variant INTEGER NOT NULL REFERENCES variants(id) ON DELETE CASCADE,
+        structure TEXT NOT NULL,
+        resi INTEGER NOT NULL,
+        depth REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS energies (
+        variant INTEGER NOT NULL REFERENCES variants(id) ON DELETE CASCADE,
+        structure TEXT NOT NULL,
+        resi1 INTEGER NOT NULL,
+        pdbid1 TEXT,
+        restype1 TEXT,
+        resi2 INTEGER NOT NULL,
+        pdbid2 TEXT,
+        restype2 TEXT,
+    """ + ',\n'.join(f'        {x} REAL' for x in ENERGY_TERMS)
+    + '\n    )',
+    'CREATE INDEX IF NOT EXISTS idx_interactions_pair '
+    'ON interactions (variant, resi1, resi2)',
+    'CREATE INDEX IF NOT EXISTS idx_interactions_category_1 '
+    'ON interactions (category, change, resi1)',
+    'CREATE INDEX IF NOT EXISTS idx_interactions_category_2 '
+    'ON interactions (category, change, resi2)',
+    'CREATE INDEX IF NOT EXISTS idx_mutations '
+    'ON mutations (variant, position)',
+    'CREATE INDEX IF NOT EXISTS idx_depth ON depth (variant, structure, resi)',
+    'CREATE INDEX IF NOT EXISTS idx_energies '
+    'ON energies (variant, resi1, resi2)',
+]
+
+
+def text_hash(text: str) -> str:
+    """
+    Fingerprint the contents of a file
+    :param text:
+        The file contents
+    :return:
+        The SHA-1 hex digest
+    """
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class AnalysisStore:
+    """
+    An embedded SQLite database that keeps the results of every saved
+    analysis, so they can be queried across variants
+    """
+    def __init__(self, path: str = DATABASE):
+        """
+        Open the database, creating the tables if necessary
+        :param path:
+            The location of the database file
+        """
+        self.path = path
+        with self.__connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    @contextmanager
+    def __connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a connection for a single transaction
+        :return:
+        """
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA foreign_keys=ON')
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def ingest(
+        self,
+        name: str,
+        results,
+        energy_wild: pd.DataFrame,
+        energy_variant: pd.DataFrame,
+        mutations: pd.DataFrame,
+        depth_wild: Optional[Dict[int, float]] = None,
+        depth_variant: Optional[Dict[int, float]] = None,
+        pdb_wild: str = '',
+        pdb_variant: str = ''
+    ) -> int:
+        """
+        Save one complete analysis
+        :param name:
+            The name of the variant
+        :param results:
+            The InteractionResults returned by energy_calc
+        :param energy_wild:
+            The residue energy breakdown for the wild-type
+        :param energy_variant:
+            The residue energy breakdown for the variant
+        :param mutations:
+            The mutations between the wild-type and variant
+        :param depth_wild:
+            The residue depth of the wild-type, if calculated
+        :param depth_variant:
+            The residue depth of the variant, if calculated
+        :param pdb_wild:
+            The cleaned wild-type PDB file, used to fingerprint the analysis
+        :param pdb_variant:
+            The cleaned variant PDB file, used to fingerprint the analysis
+        :return:
+            The id of the new variant record
+        """
+        with self.__connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO variants (name, created, wild_hash, '
+                'variant_hash) VALUES (?, ?, ?, ?)',
+                (
+                    name,
+                    datetime.now().isoformat(timespec='seconds'),
+                    text_hash(pdb_wild) if pdb_wild else None,
+                    text_hash(pdb_variant) if pdb_variant else None
+                )
+            )
+            variant = cursor.lastrowid
+
+            data = mutations.reset_index()
+            data.columns = ['position', 'mutated', 'wild']
+            data.insert(0, 'variant', variant)
+            data.to_sql('mutations', connection, if_exists='append',
+                        index=False)
+
+            for category in list(results.keys())[1:]:
+                view = results[category]
+                for change in view.keys():
+                    if not view.count(change):
+                        continue
+                    data = view.select(
+                        change,
+                        ['resi1', 'resi2', 'restype1', 'restype2', 'total']
+                    )
+                    data = data.astype({'restype1': str, 'restype2': str})
+                    data.insert(0, 'change', change)
+                    data.insert(0, 'category', category)
+                    data.insert(0, 'variant', variant)
+                    data.to_sql('interactions', connection,
+                                if_exists='append', index=False)
+
+            for structure, energy in [
+                ('wild', energy_wild), ('variant', energy_variant)
+            ]:
+                data = energy.copy()
+                self.__add_terms(connection, data.columns.tolist())
+                data.insert(0, 'structure', structure)
+                data.insert(0, 'variant', variant)
+                data.to_sql('energies', connection, if_exists='append',
+                            index=False)
+
+            for structure, depth in [
+                ('wild', depth_wild), ('variant', depth_variant)
+            ]:
+                if depth is None:
+                    continue
+                connection.executemany(
+                    'INSERT INTO depth VALUES (?, ?, ?, ?)',
+                    [(variant, structure, int(x), float(y))
+                     for x, y in depth.items()]
+                )
+        return variant
+
+    def variants(self) -> pd.DataFrame:
+        """
+        List the saved analyses
+        :return:
+        """
+        with self.__connect() as connection:
+            return pd.read_sql_query(
+                'SELECT v.id, v.name, v.created, COUNT(m.position) '
+                'AS mutations FROM variants v LEFT JOIN mutations m '
+                'ON m.variant = v.id GROUP BY v.id ORDER BY v.id',
+                connection
+            )
+
+    def delete(self, variant: int) -> None:
+        """
+        Remove a saved analysis and all of its data
+        :param variant:
+            The id of the variant record
+        :return: None
+        """
+        with self.__connect() as connection:
+            connection.execute('DELETE FROM variants WHERE id = ?',
+                               (variant,))
+
+    def query_interactions(
+        self,
+        category: Optional[str] = None,
+        changes: Optional[List[str]] = None,
+        resi: Optional[int] = None,
+        variants: Optional[List[int]] = None,
+        since: Optional[str] = None
+    ) -> pd.DataFrame:
+        """
+        Find interaction changes across all saved variants
+        :param category:
+            Only return this interaction class, such as "salt_changes"
+        :param changes:
+            Only return these change types, such as ["c", "d"] for lost
+            interactions
+        :param resi:
+            Only return pairs involving this position
+        :param variants:
+            Only search these variant records
+        :param since:
+            Only search analyses saved on or after this ISO date
+        :return:
+            A dataframe with one row per matching pair
+        """
+        clauses = []
+        parameters = []
+        if category is not None:
+            clauses.append('i.category = ?')
+            parameters.append(category)
+        if changes:
+            clauses.append(f'i.change IN ({", ".join("?" * len(changes))})')
+            parameters.extend(changes)
+        if resi is not None:
+            clauses.append('(i.resi1 = ? OR i.resi2 = ?)')
+            parameters.extend([resi, resi])
+        if variants:
+            clauses.append(f'i.variant IN ({", ".join("?" * len(variants))})')
+            parameters.extend(variants)
+        if since is not None:
+            clauses.append('v.created >= ?')
+            parameters.append(since)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        with self.__connect() as connection:
+            return pd.read_sql_query(
+                'SELECT v.id AS variant, v.name, v.created, i.category, '
+                'i.change, i.resi1, i.resi2, i.restype1, i.restype2, '
+                'i.total FROM interactions i JOIN variants v '
+                f'ON v.id = i.variant {where} ORDER BY v.id, i.resi1, i.resi2',
+                connection,
+                params=parameters
+            )
+
+    def query_mutations(self, position: Optional[int] = None) -> pd.DataFrame:
+        """
+        List the mutations of every saved variant
+        :param position:
+            Only return mutations at this position
+        :return:
+        """
+        where = 'WHERE m.position = ?' if position is not None else ''
+        with self.__connect() as connection:
+            return pd.read_sql_query(
+                'SELECT v.id AS variant, v.name, m.position, m.wild, '
+                f'm.mutated FROM mutations m JOIN variants v '
+                f'ON v.id = m.variant {where} ORDER BY v.id, m.position',
+                connection,
+                params=[] if position is None else [position]
+            )
+
+    def load_energy(self, variant: int, structure: str) -> pd.DataFrame:
+        """
+        Load a saved residue energy breakdown
+        :param variant:
+            The id of the variant record
+        :param structure:
+            Either "wild" or "variant"
+        :return:
+        """
+        with self.__connect() as connection:
+            data = pd.read_sql_query(
+                'SELECT * FROM energies WHERE variant = ? AND structure = ?',
+                connection,
+                params=[variant, structure]
+            )
+        return data.drop(columns=['variant', 'structure'])
+
+    def load_depth(self, variant: int, structure: str) -> Dict[int, float]:
+        """
+        Load a saved residue depth map
+        :param variant:
+            The id of the variant record
+        :param structure:
+            Either "wild" or "variant"
+        :return:
+        """
+        with self.__connect() as connection:
+            rows = connection.execute(
+                'SELECT resi, depth FROM depth WHERE variant = ? AND '
+                'structure = ? ORDER BY resi',
+                (variant, structure)
+            ).fetchall()
+        return {x: y for x, y in rows}
+
+    @staticmethod
+    def __add_terms(
+        connection: sqlite3.Connection,
+        columns: List[str]
+    ) -> None:
+        """
+        Add a column to the energies table for every score term it does not
+        have yet, so that breakdowns with other score functions are stored
+        completely
+        :param connection:
+            An open database connection
+        :param columns:
+            The columns of the residue energy breakdown
+        :return: None
+        """
+        known = {
+            x[1] for x in connection.execute('PRAGMA table_info(energies)')
+        }
+        for name in columns:
+            if name in known:
+                continue
+            if not name.isidentifier():
+                raise ValueError(f'Invalid score term name: {name!r}')
+            connection.execute(f'ALTER TABLE energies ADD COLUMN {name} REAL')
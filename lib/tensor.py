@@ -0,0 +1,317 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Tuple
+from scipy.sparse import csr_matrix
+from lib.fingerprint import frame_hash
+from lib.metrics import cache_lookup
+
+DENSE_BYTES = 64 * 2 ** 20
+SHIFT = np.int64(1 << 32)
+TENSOR_CACHE_SIZE = 8
+TENSORS: Dict[tuple, 'PairEnergyTensor'] = OrderedDict()
+TENSORS_LOCK = Lock()
+
+
+class PairEnergyTensor:
+    """
+    The score terms of every residue pair of a structure, as a residue x
+    residue x term tensor. Small proteins are stored as a dense float32
+    array, large ones as sorted coordinate lists that only hold the pairs
+    that interact. Repeated pairs are added up
+    """
+    def __init__(
+        self,
+        resi1: np.ndarray,
+        resi2: np.ndarray,
+        values: np.ndarray,
+        terms: List[str],
+        size: int = None,
+        dense: bool = None
+    ):
+        """
+        Create the tensor from coordinate lists
+        :param resi1:
+            The first residue of every pair
+        :param resi2:
+            The second residue of every pair
+        :param values:
+            A matrix with one row per pair and one column per term
+        :param terms:
+            The names of the score terms
+        :param size:
+            One more than the largest residue number. Inferred if omitted
+        :param dense:
+            Force dense or sparse storage. By default the tensor is dense
+            when the dense array fits into DENSE_BYTES
+        """
+        resi1 = np.asarray(resi1, dtype=np.int64)
+        resi2 = np.asarray(resi2, dtype=np.int64)
+        if size is None:
+            size = int(max(resi1.max(initial=0), resi2.max(initial=0))) + 1
+        if dense is None:
+            dense = size * size * len(terms) * 4 <= DENSE_BYTES
+        self.terms = list(terms)
+        self.size = size
+        self.dense = dense
+        keys, inverse = np.unique(resi1 * SHIFT + resi2, return_inverse=True)
+        values = np.asarray(values, dtype=np.float32)
+        if len(keys) < len(values):
+            summed = np.zeros((len(keys), len(terms)), dtype=np.float32)
+            np.add.at(summed, inverse.ravel(), values)
+            values = summed
+        else:
+            values = values[np.argsort(inverse.ravel())]
+        if dense:
+            self.array = np.zeros((size, size, len(terms)), dtype=np.float32)
+            self.present = np.zeros((size, size), dtype=bool)
+            self.array[keys // SHIFT, keys % SHIFT] = values
+            self.present[keys // SHIFT, keys % SHIFT] = True
+        else:
+            self.keys = keys
+            self.values = values
+
+    @classmethod
+    def from_frame(
+        cls,
+        data: pd.DataFrame,
+        terms: List[str],
+        size: int = None,
+        dense: bool = None
+    ) -> 'PairEnergyTensor':
+        """
+        Create the tensor from a residue energy breakdown
+        :param data:
+            The residue energy breakdown dataframe
+        :param terms:
+            The score terms to keep
+        :param size:
+            One more than the largest residue number. Inferred if omitted
+        :param dense:
+            Force dense or sparse storage
+        :return:
+        """
+        return cls(
+            data['resi1'].values,
+            data['resi2'].values,
+            data[terms].values,
+            terms,
+            size,
+            dense
+        )
+
+    @classmethod
+    def cached(
+        cls,
+        data: pd.DataFrame,
+        terms: List[str],
+        size: int = None,
+        dense: bool = None
+    ) -> 'PairEnergyTensor':
+        """
+        Create the tensor from a residue energy breakdown, reusing the tensor
+        built from the same pairs and terms before. Page reruns therefore do
+        not rebuild dense arrays of up to DENSE_BYTES. The returned tensor is
+        shared and must not be modified
+        :param data:
+            The residue energy breakdown dataframe
+        :param terms:
+            The score terms to keep
+        :param size:
+            One more than the largest residue number. Inferred if omitted
+        :param dense:
+            Force dense or sparse storage
+        :return:
+        """
+        key = (
+            frame_hash(data[['resi1', 'resi2'] + list(terms)]),
+            tuple(terms), size, dense
+        )
+        with TENSORS_LOCK:
+            if key in TENSORS.keys():
+                TENSORS.move_to_end(key)
+                cache_lookup('tensor', True, len(TENSORS))
+                return TENSORS[key]
+        tensor = cls.from_frame(data, terms, size, dense)
+        with TENSORS_LOCK:
+            TENSORS[key] = tensor
+            while len(TENSORS) > TENSOR_CACHE_SIZE:
+                TENSORS.popitem(last=False)
+            cache_lookup('tensor', False, len(TENSORS))
+        return tensor
+
+    def coordinates(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The pairs of the tensor in (resi1, resi2) order
+        :return:
+            The first residues, the second residues and the value matrix
+        """
+        if self.dense:
+            resi1, resi2 = np.nonzero(self.present)
+            return resi1, resi2, self.array[resi1, resi2]
+        return self.keys // SHIFT, self.keys % SHIFT, self.values
+
+    def __len__(self) -> int:
+        """
+        The number of pairs
+        :return:
+        """
+        if self.dense:
+            return int(self.present.sum())
+        return len(self.keys)
+
+    def term(self, name: str) -> int:
+        """
+        The position of a score term along the last axis
+        :param name:
+            The name of the score term
+        :return:
+        """
+        return self.terms.index(name)
+
+    def select(self, terms: List[str]) -> 'PairEnergyTensor':
+        """
+        Keep only some score terms
+        :param terms:
+            The score terms to keep
+        :return:
+        """
+        columns = [self.term(x) for x in terms]
+        resi1, resi2, values = self.coordinates()
+        return PairEnergyTensor(
+            resi1, resi2, values[:, columns], terms, self.size, self.dense
+        )
+
+    def window(self, first: int, last: int) -> 'PairEnergyTensor':
+        """
+        Keep only the pairs whose residues both lie within a range
+        :param first:
+            The first residue of the range
+        :param last:
+            The last residue of the range, inclusive
+        :return:
+        """
+        resi1, resi2, values = self.coordinates()
+        keep = (resi1 >= first) & (resi1 <= last) & \
+            (resi2 >= first) & (resi2 <= last)
+        return PairEnergyTensor(
+            resi1[keep], resi2[keep], values[keep], self.terms, self.size,
+            self.dense
+        )
+
+    def aligned(
+        self,
+        other: 'PairEnergyTensor'
+    ) -> Tuple['PairEnergyTensor', 'PairEnergyTensor']:
+        """
+        Give two tensors the same pairs, adding zero-energy pairs where one
+        of them does not interact
+        :param other:
+            A tensor with the same score terms
+        :return:
+            Both tensors, in the order self, other
+        """
+        assert self.terms == other.terms
+        size = max(self.size, other.size)
+        dense = self.dense and other.dense
+        first = self.coordinates()
+        second = other.coordinates()
+        keys = [x[0] * SHIFT + x[1] for x in [first, second]]
+        union = np.union1d(*keys)
+        results = []
+        for key, (resi1, resi2, values) in zip(keys, [first, second]):
+            full = np.zeros((len(union), len(self.terms)), dtype=np.float32)
+            full[np.searchsorted(union, key)] = values
+            results.append(PairEnergyTensor(
+                union // SHIFT, union % SHIFT, full, self.terms, size, dense
+            ))
+        return results[0], results[1]
+
+    def __combine(self, other: 'PairEnergyTensor', sign: int):
+        """
+        Add or subtract another tensor over the union of their pairs
+        :param other:
+            A tensor with the same score terms
+        :param sign:
+            1 to add, -1 to subtract
+        :return:
+        """
+        if self.dense and other.dense and self.size == other.size:
+            result = PairEnergyTensor(
+                [], [], np.zeros((0, len(self.terms))), self.terms,
+                self.size, True
+            )
+            result.array = self.array + sign * other.array
+            result.present = self.present | other.present
+            return result
+        first, second = self.aligned(other)
+        resi1, resi2, values = first.coordinates()
+        return PairEnergyTensor(
+            resi1, resi2, values + sign * second.coordinates()[2],
+            self.terms, first.size, first.dense
+        )
+
+    def __add__(self, other: 'PairEnergyTensor') -> 'PairEnergyTensor':
+        """
+        Add two tensors pair by pair
+        :param other:
+        :return:
+        """
+        return self.__combine(other, 1)
+
+    def __sub__(self, other: 'PairEnergyTensor') -> 'PairEnergyTensor':
+        """
+        Subtract two tensors pair by pair, such as variant minus wild-type
+        :param other:
+        :return:
+        """
+        return self.__combine(other, -1)
+
+    def residue_sum(self, term: str = 'total') -> np.ndarray:
+        """
+        The net energy of every residue: the sum of a score term over all
+        pairs the residue takes part in, counting a pair with itself once
+        :param term:
+            The score term
+        :return:
+            A float64 array indexed by residue number
+        """
+        column = self.term(term)
+        if self.dense:
+            values = self.array[:, :, column].astype(np.float64)
+            return values.sum(axis=0) + values.sum(axis=1) - \
+                np.diagonal(values)
+        resi1, resi2, values = self.coordinates()
+        weights = values[:, column].astype(np.float64)
+        other = np.where(resi1 != resi2, weights, 0.0)
+        return np.bincount(resi1, weights, self.size) + \
+            np.bincount(resi2, other, self.size)
+
+    def matrix(self, term: str = 'total') -> np.ndarray or csr_matrix:
+        """
+        The residue x residue matrix of one score term
+        :param term:
+            The score term
+        :return:
+            A dense array or a CSR matrix, following the storage
+        """
+        column = self.term(term)
+        if self.dense:
+            return self.array[:, :, column]
+        resi1, resi2, values = self.coordinates()
+        return csr_matrix(
+            (values[:, column], (resi1, resi2)), shape=(self.size, self.size)
+        )
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Convert the tensor back to the long residue energy breakdown layout
+        :return:
+            A dataframe sorted by resi1 and resi2
+        """
+        resi1, resi2, values = self.coordinates()
+        data = pd.DataFrame(values.astype(np.float64), columns=self.terms)
+        data.insert(0, 'resi1', resi1.astype(np.int64))
+        data.insert(1, 'resi2', resi2.astype(np.int64))
+        return data
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import uuid
+import pandas as pd
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timezone
+from functools import partial
+from threading import Lock, current_thread
+from typing import Any, Callable, Dict, Iterator, List, Optional
+try:
+    import resource
+except ImportError:
+    resource = None
+from lib.profiling import profiled
+from lib.metrics import REGISTRY
+
+LOG_PATH = 'lib/storage/timing.jsonl'
+LOG_LOCK = Lock()
+TIMELINE: ContextVar[Optional['Timeline']] = ContextVar(
+    'timeline', default=None
+)
+PARENT: ContextVar[Optional[str]] = ContextVar('parent', default=None)
+STAGE_SECONDS = REGISTRY.histogram(
+    'energy_tools_stage_seconds',
+    'Wall time of pipeline stages and page renders',
+    ['stage']
+)
+STAGE_RUNS = REGISTRY.counter(
+    'energy_tools_stage_runs_total',
+    'Finished runs of pipeline stages and page renders by outcome',
+    ['stage', 'status']
+)
+STAGES_ACTIVE = REGISTRY.gauge(
+    'energy_tools_stages_in_progress',
+    'Pipeline stages and page renders currently running',
+    ['stage']
+)
+
+
+def peak_rss() -> Optional[float]:
+    """
+    The largest resident set size of this process so far
+    :return:
+        The peak in megabytes, or None where it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def child_cpu() -> float:
+    """
+    The CPU time used by finished child processes, such as MSMS or Rosetta.
+    Children of every thread of the process are counted
+    :return:
+        The user and system time in seconds
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Timeline:
+    """
+    The timing spans recorded during one streamlit session, shared with the
+    background threads and jobs the session starts
+    """
+    def __init__(self, log_path: Optional[str] = LOG_PATH):
+        """
+        Create an empty timeline
+        :param log_path:
+            The JSON lines file every span is appended to. None disables the
+            log
+        """
+        self.session = uuid.uuid4().hex[:12]
+        self.log_path = log_path
+        self.spans: List[Dict[str, Any]] = []
+        self.__lock = Lock()
+
+    def activate(self) -> None:
+        """
+        Record the spans of the current thread in this timeline
+        :return: None
+        """
+        TIMELINE.set(self)
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """
+        Add a finished span and append it to the log
+        :param entry:
+            The span measurements
+        :return: None
+        """
+        entry = {'session': self.session, **entry}
+        with self.__lock:
+            self.spans.append(entry)
+        if self.log_path is None:
+            return
+        with LOG_LOCK:
+            os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+            with open(self.log_path, 'a') as file:
+                file.write(json.dumps(entry, default=str) + '\n')
+
+    def clear(self) -> None:
+        """
+        Forget the recorded spans. The log is kept
+        :return: None
+        """
+        with self.__lock:
+            self.spans = []
+
+    def frame(self) -> pd.DataFrame:
+        """
+        The recorded spans, one row each
+        :return:
+        """
+        with self.__lock:
+            return pd.DataFrame(self.spans)
+
+    def breakdown(self) -> pd.DataFrame:
+        """
+        Summarize the spans by name: how often each stage ran, how long its
+        last run took and how much time it took in total
+        :return:
+            A dataframe indexed by span name, slowest total first
+        """
+        data = self.frame()
+        if data.empty:
+            return pd.DataFrame(
+                columns=['runs', 'last', 'total', 'cpu', 'peak_rss_mb']
+            )
+        grouped = data.groupby('name')
+        summary = pd.DataFrame({
+            'runs': grouped.size(),
+            'last': grouped['wall'].last(),
+            'total': grouped['wall'].sum(),
+            'cpu': grouped['cpu'].sum() + grouped['child_cpu'].sum(),
+            'peak_rss_mb': grouped['peak_rss_mb'].max()
+        })
+        return summary.sort_values('total', ascending=False).round(3)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict[str, Any]]:
+    """
+    Measure the wall time, CPU time and peak memory of a block of code and
+    record it in the active timeline. Spans opened inside the block, in
+    the same thread or in jobs it starts, record this span as their parent.
+    The block is profiled when an armed profile request targets it
+    :param name:
+        The name of the stage
+    :param attributes:
+        Extra values stored with the span, such as the structure name
+    :return:
+        The span entry, to which the block can add attributes
+    """
+    entry = {
+        'name': name,
+        'parent': PARENT.get(),
+        'thread': current_thread().name,
+        'start': datetime.now(timezone.utc).isoformat(),
+        'attributes': attributes
+    }
+    token = PARENT.set(name)
+    STAGES_ACTIVE.inc(stage=name)
+    rss_before = peak_rss()
+    children_before = child_cpu()
+    cpu_before = time.thread_time()
+    wall_before = time.perf_counter()
+    status = 'ok'
+    try:
+        with profiled(name) as request:
+            entry['profiled'] = request is not None
+            yield entry
+    except Exception:
+        status = 'error'
+        raise
+    except BaseException:
+        status = 'interrupted'
+        raise
+    finally:
+        PARENT.reset(token)
+        STAGES_ACTIVE.dec(stage=name)
+        rss_after = peak_rss()
+        entry.update(
+            status=status,
+            wall=time.perf_counter() - wall_before,
+            cpu=time.thread_time() - cpu_before,
+            child_cpu=child_cpu() - children_before,
+            peak_rss_mb=rss_after,
+            rss_growth_mb=None if rss_after is None else
+            rss_after - rss_before
+        )
+        STAGE_SECONDS.observe(entry['wall'], stage=name)
+        STAGE_RUNS.inc(stage=name, status=status)
+        timeline = TIMELINE.get()
+        if timeline is not None:
+            timeline.record(entry)
+
+
+def carry(function: Callable) -> Callable:
+    """
+    Wrap a function so that it runs with the timeline and parent span of
+    the caller, for use as the target of a thread or worker
+    :param function:
+        The function that will run in another thread
+    :return:
+    """
+    return partial(copy_context().run, function)
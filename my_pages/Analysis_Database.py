@@ -0,0 +1,126 @@
+import streamlit as st
+import pandas as pd
+from datetime import date
+from lib.store import AnalysisStore
+from lib.interactions import CHANGES
+from my_pages.Interaction_Analysis import categories
+
+STATE: dict
+
+
+@st.experimental_singleton
+def open_store() -> AnalysisStore:
+    """
+    Open the analysis database shared by all sessions
+    :return:
+    """
+    return AnalysisStore()
+
+
+def check_files() -> bool:
+    """
+    Check that a completed analysis exists in session state
+    :return:
+    """
+    constraints = [
+        'energy_wild' in st.session_state['File Upload'].keys(),
+        'energy_variant' in st.session_state['File Upload'].keys(),
+        'mutations' in st.session_state['File Upload'].keys(),
+        st.session_state['Interaction Analysis'].get('complete', False)
+    ]
+    return all(constraints)
+
+
+def save_analysis(name: str) -> None:
+    """
+    Save the analysis of the current session to the database
+    :param name:
+        The name to store the variant under
+    :return:
+    """
+    files = st.session_state['File Upload']
+    pdb_files = {}
+    for i in ['wild', 'variant']:
+        pdb_file = files.get(f'pdb_{i}_clean')
+        pdb_files[i] = pdb_file.read() if pdb_file is not None else ''
+        if pdb_file is not None:
+            pdb_file.seek(0)
+    STATE['saved'] = open_store().ingest(
+        name=name,
+        results=st.session_state['Interaction Analysis']['results'],
+        energy_wild=files['energy_wild'],
+        energy_variant=files['energy_variant'],
+        mutations=files['mutations'],
+        depth_wild=files.get('depth_wild'),
+        depth_variant=files.get('depth_variant'),
+        pdb_wild=pdb_files['wild'],
+        pdb_variant=pdb_files['variant']
+    )
+
+
+def save_section() -> None:
+    """
+    Widgets to save the current analysis
+    :return:
+    """
+    st.header('Save the Current Analysis')
+    if not check_files():
+        st.warning('Run the Interaction Analysis before saving it')
+        return
+    name = st.text_input(label='Variant Name', key='store_name')
+    if st.button(label='Save Analysis', disabled=not name):
+        save_analysis(name)
+        st.success(f'Saved the analysis as record {STATE["saved"]}')
+
+
+def query_section() -> None:
+    """
+    Widgets to search saved analyses across variants
+    :return:
+    """
+    store = open_store()
+    st.header('Saved Variants')
+    st.dataframe(store.variants())
+
+    st.header('Search Interaction Changes')
+    columns = st.columns(4)
+    category = columns[0].selectbox(
+        label='Interaction Class',
+        options=list(categories.keys()),
+        format_func=lambda x: categories[x]
+    )
+    changes = columns[1].multiselect(
+        label='Change Type',
+        options=CHANGES,
+        default=['c', 'd'],
+        format_func=str.upper
+    )
+    resi = columns[2].number_input(
+        label='Position (0 for all)',
+        min_value=0,
+        value=0,
+        step=1
+    )
+    since = columns[3].date_input(label='Saved Since', value=date(2000, 1, 1))
+    data: pd.DataFrame = store.query_interactions(
+        category=category,
+        changes=changes,
+        resi=int(resi) if resi else None,
+        since=since.isoformat()
+    )
+    st.write(f'{data["variant"].nunique()} variants, {len(data)} pairs')
+    st.dataframe(data)
+
+
+def main():
+    """
+    Create the Analysis Database Main Page
+    :return:
+    """
+    global STATE
+    STATE = st.session_state['Analysis Database']
+    left, center, right = st.columns([1, 3, 1])
+    with center:
+        st.title('Analysis Database')
+        save_section()
+        query_section()
@@ -13,6 +13,8 @@ from bokeh.models.callbacks import CustomJS
 from bokeh.layouts import gridplot, column
 from bokeh.models.widgets import Slider, Button
 from lib.visualization import WebViewer
+from lib.tensor import PairEnergyTensor
+from lib.timing import span
 
 STATE: dict
 
@@ -56,51 +58,69 @@ def cool_stuff(
     value: str
 ) -> pd.DataFrame:
     """
-    Experiment with pd.melt
+    Expand a long dataframe to every combination of its column_1 and
+    column_2 values, adding up repeated pairs and filling missing ones with 0
     :param data:
     :param column_1:
     :param column_2:
     :param value:
     :return:
     """
-    pivot = pd.pivot_table(data, value, column_1, column_2, np.sum)
-    pivot.fillna(value=0, inplace=True)
-    pivot.reset_index(level=0, inplace=True)
-    return pivot.melt(id_vars=column_1, var_name=column_2, value_name=value)
+    tensor = PairEnergyTensor(
+        data[column_1].values, data[column_2].values,
+        data[[value]].values, [value]
+    )
+    rows = np.unique(data[column_1].values)
+    columns = np.unique(data[column_2].values)
+    matrix = tensor.matrix(value)[rows][:, columns]
+    if not isinstance(matrix, np.ndarray):
+        matrix = matrix.toarray()
+    return pd.DataFrame({
+        column_1: np.tile(rows, len(columns)),
+        column_2: np.repeat(columns, len(rows)),
+        value: matrix.T.ravel().astype(np.float64)
+    })
+
+
+def energy_tensors(
+    wild: pd.DataFrame,
+    variant: pd.DataFrame
+) -> Dict[str, PairEnergyTensor]:
+    """
+    The wild-type and variant interaction energies as tensors of the same
+    size, so that their arithmetic stays on the dense fast path
+    :param wild:
+        The residue energy breakdown of the wild-type
+    :param variant:
+        The residue energy breakdown of the variant
+    :return:
+    """
+    size = 1 + int(max(
+        wild[['resi1', 'resi2']].values.max(initial=0),
+        variant[['resi1', 'resi2']].values.max(initial=0)
+    ))
+    return {
+        'wild': PairEnergyTensor.cached(wild, ROWS, size),
+        'variant': PairEnergyTensor.cached(variant, ROWS, size)
+    }
 
 
-def fill_holes() -> Dict[str, pd.DataFrame]:
+def fill_holes(
+    wild: pd.DataFrame,
+    variant: pd.DataFrame
+) -> Dict[str, pd.DataFrame]:
     """
     Ensure that the wild-type and variant interaction energy dataframes
     are of the same length. Important for JS Code when syncing selections
+    :param wild:
+        The residue energy breakdown of the wild-type
+    :param variant:
+        The residue energy breakdown of the variant
     :return:
     """
-    wild = st.session_state['File Upload']['energy_wild']
-    variant = st.session_state['File Upload']['energy_variant']
-    cw = pd.DataFrame(wild[ROWS + ['resi1', 'resi2']], copy=True)
-    cv = pd.DataFrame(variant[ROWS + ['resi1', 'resi2']], copy=True)
-    pairs_w = cw[['resi1', 'resi2']].values.tolist()
-    pairs_v = cv[['resi1', 'resi2']].values.tolist()
-
-    new_values = []
-    for resi1, resi2 in [x for x in pairs_v if x not in pairs_w]:
-        row = {'resi1': resi1, 'resi2': resi2}
-        row.update({x: 0 for x in ROWS})
-        new_values.append(row)
-    cw = pd.concat([cw, pd.DataFrame(new_values)])
-
-    new_values = []
-    for resi1, resi2 in [x for x in pairs_w if x not in pairs_v]:
-        row = {'resi1': resi1, 'resi2': resi2}
-        row.update({x: 0 for x in ROWS})
-        new_values.append(row)
-    cv = pd.concat([cv, pd.DataFrame(new_values)])
-
-    cw.sort_values(by=['resi1', 'resi2'], inplace=True)
-    cv.sort_values(by=['resi1', 'resi2'], inplace=True)
-    cw.reset_index(inplace=True, drop=True)
-    cv.reset_index(inplace=True, drop=True)
-    return {'wild': cw, 'variant': cv}
+    tensors = energy_tensors(wild, variant)
+    wild, variant = tensors['wild'].aligned(tensors['variant'])
+    return {'wild': wild.frame(), 'variant': variant.frame()}
 
 
 def create_heatmap(
@@ -178,7 +198,11 @@ def plot_side() -> None:
     :return:
     """
     # Create Heatmaps
-    df = fill_holes()
+    with span('fill_holes'):
+        df = fill_holes(
+            st.session_state['File Upload']['energy_wild'],
+            st.session_state['File Upload']['energy_variant']
+        )
     wild = create_heatmap('wild', df['wild'])
     variant = create_heatmap('variant', df['variant'])
     wild['plot'].width = 575
@@ -259,10 +283,11 @@ def plot_difference() -> None:
     :return:
     """
     # Create Data and Heatmaps
-    df = fill_holes()
-    data = df['variant'] - df['wild']
-    data['resi1'] = df['wild']['resi1']
-    data['resi2'] = df['variant']['resi2']
+    tensors = energy_tensors(
+        st.session_state['File Upload']['energy_wild'],
+        st.session_state['File Upload']['energy_variant']
+    )
+    data = (tensors['variant'] - tensors['wild']).frame()
     diff = create_heatmap('Difference', data, extrema=2)
 
     # Bokeh Table
@@ -370,18 +395,16 @@ def resi_energy_map(
     :param max_value:
     :return:
     """
-    resi_max = max(
-        wild['resi1'].values.tolist() + wild['resi2'].values.tolist()
-    )
-    energy: dict[int, float] = {}
-    for i in range(1, resi_max + 1):
-        energy_wild = wild[
-            (wild['resi1'] == i) | (wild['resi2'] == i)
-        ]['total'].sum()
-        energy_variant = variant[
-            (variant['resi1'] == i) | (variant['resi2'] == i)
-        ]['total'].sum()
-        energy[i] = energy_variant - energy_wild
+    resi_max = int(max(
+        wild['resi1'].values.max(), wild['resi2'].values.max()
+    ))
+    size = 1 + int(max(
+        resi_max, variant[['resi1', 'resi2']].values.max(initial=0)
+    ))
+    net = PairEnergyTensor.cached(variant, ['total'], size) - \
+        PairEnergyTensor.cached(wild, ['total'], size)
+    totals = net.residue_sum('total')
+    energy = {i: totals[i] for i in range(1, resi_max + 1)}
     results = {}
     for key, value in energy.items():
         if value < min_value:
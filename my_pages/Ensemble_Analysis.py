@@ -0,0 +1,209 @@
+import time
+import streamlit as st
+import pandas as pd
+from typing import List
+from utility import load_text
+from lib.ensemble import WORKERS, load_directory, run_ensemble, compare
+from lib.cleaning import split_models
+from lib.jobs import Job
+from lib.reweight import reweight
+from my_pages.File_Upload import check_rosetta, rosetta_executable
+
+STATE: dict
+
+POLL_INTERVAL = 1.0
+
+
+def collect_models(side: str) -> List[str]:
+    """
+    Gather the models of one ensemble from the uploaded files and the
+    snapshot folder
+    :param side:
+        "wild" or "variant"
+    :return:
+    """
+    models = []
+    for file in st.session_state.get(f'ensemble_{side}_files') or []:
+        models.extend(split_models(file.getvalue().decode('utf-8')))
+    folder = st.session_state.get(f'ensemble_{side}_folder', '')
+    if folder:
+        models.extend(load_directory(folder))
+    return models
+
+
+def start_ensemble() -> None:
+    """
+    Submit the ensemble scoring to the background worker pool. The models
+    are scored with the prescreen when it is selected or when no Rosetta
+    executable is available. A snapshot folder that can not be read is
+    reported instead
+    :return:
+    """
+    fast = st.session_state.get('ensemble_prescreen', False) or \
+        not check_rosetta()
+    try:
+        models = {x: collect_models(x) for x in ['wild', 'variant']}
+    except ValueError as error:
+        STATE['error'] = str(error)
+        return
+    STATE['job'] = Job(
+        run_ensemble,
+        models_wild=models['wild'],
+        models_variant=models['variant'],
+        executable=None if fast else rosetta_executable(),
+        workers=int(st.session_state['ensemble_workers'])
+    )
+
+
+def cancel_ensemble() -> None:
+    """
+    Request cancellation of the running ensemble scoring
+    :return:
+    """
+    STATE['job'].cancel()
+
+
+def poll_ensemble() -> None:
+    """
+    Show the progress of the ensemble scoring and collect its results once
+    it has finished
+    :return:
+    """
+    job: Job = STATE['job']
+    status = job.status
+    if status in ['queued', 'running']:
+        st.progress(int(job.progress.fraction * 100))
+        st.write(
+            f'Scoring {status}: {job.progress.done} of '
+            f'{job.progress.total} models scored'
+        )
+        st.button(label='Cancel Scoring', on_click=cancel_ensemble)
+        time.sleep(POLL_INTERVAL)
+        st.experimental_rerun()
+    del STATE['job']
+    if status == 'complete':
+        STATE['wild'], STATE['variant'] = job.result()
+    elif status == 'cancelled':
+        st.warning('The ensemble scoring was cancelled')
+    else:
+        st.error(f'The ensemble scoring failed: {job.error}')
+
+
+def use_means() -> None:
+    """
+    Replace the energy breakdowns of the File Upload page with the mean
+    breakdowns of the ensembles
+    :return:
+    """
+    files = st.session_state['File Upload']
+    for i in ['wild', 'variant']:
+        energy = STATE[i].frame()
+        files[f'energy_{i}_rosetta'] = energy
+        files[f'energy_{i}'] = reweight(energy, files.get('weights', {}))
+    files['breakdown'] = True
+
+
+def input_widgets() -> None:
+    """
+    Create the widgets to upload the ensembles
+    :return:
+    """
+    columns = st.columns(2)
+    for column, side in zip(columns, ['wild', 'variant']):
+        name = 'Wild-Type' if side == 'wild' else 'Variant'
+        column.file_uploader(
+            label=f'{name} Models',
+            type=['pdb'],
+            accept_multiple_files=True,
+            key=f'ensemble_{side}_files'
+        )
+        column.text_input(
+            label=f'{name} Snapshot Folder',
+            help='A folder below the snapshot folder of the server',
+            key=f'ensemble_{side}_folder'
+        )
+    st.number_input(
+        label='Models Scored at the Same Time',
+        min_value=1,
+        max_value=32,
+        value=WORKERS,
+        step=1,
+        key='ensemble_workers'
+    )
+
+
+def display_results() -> None:
+    """
+    Display the pairs whose energy changed significantly between the
+    ensembles
+    :return:
+    """
+    st.header('Results')
+    st.write(
+        f'{STATE["wild"].count} wild-type and {STATE["variant"].count} '
+        f'variant models were scored'
+    )
+    columns = st.columns(2)
+    term = columns[0].selectbox(
+        label='Score Term',
+        options=STATE['wild'].terms[::-1],
+        key='ensemble_term'
+    )
+    alpha = columns[1].number_input(
+        label='Significance Level',
+        min_value=0.0001,
+        max_value=1.0,
+        value=0.05,
+        step=0.01,
+        format='%.4f',
+        key='ensemble_alpha'
+    )
+    data: pd.DataFrame = compare(STATE['wild'], STATE['variant'], term)
+    data = data[data['p_value'] <= alpha]
+    data.columns = [
+        'Resi1', 'Resi2', 'Mean Wild', 'Std Wild', 'Mean Variant',
+        'Std Variant', 'Change', 't', 'p'
+    ]
+    st.write(f'{len(data)} pairs changed significantly')
+    st.dataframe(data)
+    st.button(
+        label='Use Ensemble Means as Energy Breakdowns',
+        on_click=use_means
+    )
+
+
+def main():
+    """
+    Create the Ensemble Analysis Main Page
+    :return:
+    """
+    global STATE
+    STATE = st.session_state['Ensemble Analysis']
+    left, center, right = st.columns([1, 2, 1])
+    with center:
+        st.title('Ensemble Analysis')
+        st.header('Introduction')
+        st.write(load_text('ensemble', 'introduction'))
+        input_widgets()
+        if not check_rosetta():
+            st.warning(
+                'No Rosetta Executable Available! The models will be '
+                'scored with the built-in prescreen'
+            )
+        else:
+            st.checkbox(
+                label='Fast prescreen instead of Rosetta',
+                value=False,
+                key='ensemble_prescreen'
+            )
+        st.button(
+            label='Score Ensembles',
+            on_click=start_ensemble,
+            disabled='job' in STATE.keys()
+        )
+        if 'error' in STATE.keys():
+            st.error(STATE.pop('error'))
+        if 'job' in STATE.keys():
+            poll_ensemble()
+        if 'wild' in STATE.keys():
+            display_results()
@@ -1,6 +1,5 @@
 import json
 import os
-import re
 import inspect
 import streamlit as st
 import pandas as pd
@@ -8,11 +7,17 @@ import lib.energy_breakdown as eb
 from io import StringIO, BytesIO
 from typing import List, Callable
 from Bio.PDB.PDBParser import PDBParser
-from Bio.PDB.ResidueDepth import ResidueDepth
 from functools import partial
 from threading import Thread
 from streamlit.scriptrunner.script_run_context import add_script_run_ctx
 from utility import load_text
+from lib.snapshot import export_session, import_session
+from lib.reweight import reweight, score_terms
+from lib.cleaning import renumber
+from lib.depth import residue_depth, variant_depth
+from lib.prescreen import prescreen
+from lib.cropping import cropped_breakdowns
+from lib.timing import span, carry
 
 STATE: dict
 
@@ -63,33 +68,8 @@ def renumber_pdb(file_name: str) -> None:
     :return:
     """
     pdb_file = STATE[file_name]
-    temp_file = StringIO()
-    raw = pdb_file.read()
-    text = raw.decode('utf-8').split('\n')
-    rows = [x for x in text if x[0:4] == 'ATOM']
-    offset = 1 - find_start(rows[0])
-    temp_file.write('\n'.join(rows))
-    temp_file.seek(0)
-    data = pd.read_fwf(temp_file, header=None, infer_nrows=2000)
-
-    data.columns = [
-        'ATOM', 'atom_number', 'PDB_atom', 'resi_3', 'resi_1',
-        'resi_number', 'A', 'B', 'C', 'D', 'E', 'atom'
-    ]
-    data['resi_number'] = data['resi_number'] + offset
-    data['PDB_atom'] = data['PDB_atom'].apply(adjust_pdb)
-    rows = []
-    spacing = [4, 7, 5, 4, 2, 4, 12, 8, 8, 6, 6, 12]
-    for row in data.iterrows():
-        row_txt = ""
-        counter = 0
-        for column in row[1].values.tolist():
-            row_txt += f'{column:>{spacing[counter]}}'
-            counter += 1
-        rows.append(row_txt)
-
     result = StringIO()
-    result.write('\n'.join(rows))
+    result.write(renumber(pdb_file.read().decode('utf-8')))
     result.seek(0)
     pdb_file.seek(0)
     STATE[f'{file_name}_clean'] = result
@@ -133,40 +113,6 @@ def mutations() -> pd.DataFrame:
     return results
 
 
-def adjust_pdb(x: str) -> str:
-    """
-    Internal format adjuster for cleaning PDB files
-    :param x:
-    :return:
-    """
-    initial = len(x)
-    if initial == 1:
-        x += '  '
-    if initial == 2:
-        x += ' '
-    if x[0].isnumeric() and initial == 3:
-        x += ' '
-    return x
-
-
-def find_start(data: str) -> int:
-    """
-    Internal format adjuster for cleaning PDB files
-    :param data:
-    :return:
-    """
-    start = data.find(re.findall(r'\w\w\w \w', data)[0]) + 5
-    number = ''
-    final = False
-    while len(number) == 0 or not final:
-        if data[start].isnumeric():
-            number += data[start]
-        elif len(number) > 0:
-            final = True
-        start += 1
-    return int(number)
-
-
 def clean_pdb() -> None:
     """
     Clean the PDB files
@@ -174,7 +120,8 @@ def clean_pdb() -> None:
     """
     for i in ['pdb_wild', 'pdb_variant']:
         if STATE[i] is not None:
-            renumber_pdb(i)
+            with span('clean', structure=i):
+                renumber_pdb(i)
     STATE['cleaned'] = True
     if 'mut_calc' in STATE.keys():
         STATE['mut_calc'] = False
@@ -192,7 +139,8 @@ def find_mutations() -> None:
     clean = ['pdb_wild_clean', 'pdb_variant_clean']
     if any([x not in STATE.keys() for x in clean]):
         return
-    data = mutations()
+    with span('mutations'):
+        data = mutations()
     STATE['mutations'] = data
     STATE['mut_calc'] = True
 
@@ -207,97 +155,156 @@ def re_upload(key: str) -> None:
     STATE[key] = None
 
 
-def calculate_depth(file_name: str) -> None:
+def calculate_depth(file_name: str, incremental: bool = False) -> None:
     """
-    Execute the depth calculations using biopython
+    Execute the depth calculations using MSMS
     :param file_name:
             A portion of the file name, such as "wild" or "variant", if the
             full name is "pdb_wild_clean" or "pdb_variant_clean"
+    :param incremental:
+        Calculate the variant by patching the wild-type surface around the
+        mutations
     :return:
     """
-    parser = PDBParser()
-    parser.QUIET = True
-    pdb_file = STATE[f'pdb_{file_name}_clean']
-    structure = parser.get_structure(0, pdb_file)
-    pdb_file.seek(0)
-    rd = ResidueDepth(
-        model=structure[0],
-        msms_exec='lib/msms_linux/msms.x86_64Linux2.2.6.1'
-    )
-    results = {x[1][1]: y[0] for x, y in rd.property_dict.items()}
+    with span('depth', structure=file_name, incremental=incremental):
+        if incremental:
+            results = variant_depth(
+                pdb_wild=STATE['pdb_wild_clean'],
+                pdb_variant=STATE['pdb_variant_clean'],
+                positions=STATE['mutations'].index
+            )
+        else:
+            results = residue_depth(STATE[f'pdb_{file_name}_clean'])
     STATE[f'depth_{file_name}'] = results
     STATE['depth'] = True
 
 
-def calculate_energy(file_type: str) -> None:
+def calculate_depths(incremental: bool) -> None:
+    """
+    Calculate the wild-type depth and then the variant depth, so that the
+    variant can reuse the wild-type surface
+    :param incremental:
+        Calculate the variant by patching the wild-type surface
+    :return:
     """
-    Execute the Rosetta Energy Breakdown protocol
+    calculate_depth('wild')
+    calculate_depth('variant', incremental)
+
+
+def rosetta_executable() -> str:
+    """
+    The path of the Rosetta executable chosen on the Home page
+    :return:
+    """
+    if st.session_state['Home']['rosetta_local']:
+        this_dir = os.path.dirname(__file__)
+        root = '/'.join(this_dir.split('/')[:-1])
+        return f'{root}/{st.session_state["Home"]["rosetta_path"]}'
+    return st.session_state["Home"]["rosetta_path"]
+
+
+def calculate_energy(file_type: str, fast: bool = False) -> None:
+    """
+    Execute the Rosetta Energy Breakdown protocol, or estimate the breakdown
+    with the built-in prescreen
     :param file_type:
             A portion of the file name, such as "wild" or "variant", if the
             full name is "pdb_wild_clean" or "pdb_variant_clean"
+    :param fast:
+        Use the prescreen instead of Rosetta
     :return:
     """
     assert f'pdb_{file_type}_clean' in STATE.keys()
     pdb_file: StringIO = STATE[f'pdb_{file_type}_clean']
-    with open(f'lib/storage/{file_type}.pdb', 'w') as file:
-        file.write(pdb_file.read())
+    with span(
+        'energy_breakdown', structure=file_type, prescreen=fast
+    ) as entry:
+        if fast:
+            with span('prescreen', structure=file_type):
+                energy = prescreen(pdb_file.read())
+        else:
+            executable = rosetta_executable()
+            entry['attributes']['executable'] = executable
+            energy = eb.score_structure(
+                pdb_file.read(), file_type, executable
+            )
     pdb_file.seek(0)
-    if st.session_state['Home']['rosetta_local']:
-        this_dir = os.path.dirname(__file__)
-        root = '/'.join(this_dir.split('/')[:-1])
-        executable = f'{root}/{st.session_state["Home"]["rosetta_path"]}'
-    else:
-        executable = st.session_state["Home"]["rosetta_path"]
-    print(executable)
-    eb.run(
-        file_name=f'lib/storage/{file_type}.pdb',
-        save_path=f'lib/storage/energy_{file_type}.out',
-        log_path=f'lib/storage/log_{file_type}.txt',
-        executable=executable
-    )
-    eb.convert_outfile(
-        file_name=f'lib/storage/energy_{file_type}.out',
-        save_path=f'lib/storage/energy_{file_type}.csv'
-    )
-    energy = pd.read_csv(f'lib/storage/energy_{file_type}.csv')
-    energy.drop(energy[energy['resi2'] == '--'].index, inplace=True)
-    energy['resi2'] = energy['resi2'].astype(int)
-    STATE[f'energy_{file_type}'] = energy
+    STATE[f'energy_{file_type}_rosetta'] = energy
+    STATE[f'energy_{file_type}'] = reweight(energy, STATE.get('weights', {}))
+    STATE['breakdown'] = True
+
+
+def calculate_cropped_energy() -> None:
+    """
+    Score the wild-type and variant with Rosetta by rescoring only the region
+    around the mutations. The complete wild-type breakdown is reused for the
+    pairs away from the mutations
+    :return:
+    """
+    with span('energy_breakdown', structure='wild and variant', cropped=True):
+        energies = cropped_breakdowns(
+            pdb_wild=STATE['pdb_wild_clean'],
+            pdb_variant=STATE['pdb_variant_clean'],
+            positions=STATE['mutations'].index,
+            executable=rosetta_executable()
+        )
+    for file_type, energy in energies.items():
+        STATE[f'energy_{file_type}_rosetta'] = energy
+        STATE[f'energy_{file_type}'] = reweight(
+            energy, STATE.get('weights', {})
+        )
     STATE['breakdown'] = True
-    os.remove(f'lib/storage/energy_{file_type}.csv')
-    os.remove(f'lib/storage/energy_{file_type}.out')
 
 
 def find_depth(container) -> None:
     """
     Call the calculate_depth function in a separate thread, and monitor
-    this thread using add_script_run_ctx
+    this thread using add_script_run_ctx. With the incremental option and
+    known mutations, one thread calculates the wild-type and then patches
+    its surface for the variant
     :return:
     """
-    for i in ['wild', 'variant']:
-        if f'pdb_{i}_clean' in STATE.keys():
-            task = Thread(target=partial(calculate_depth, file_name=i))
-            add_script_run_ctx(task)
-            task.start()
-            container.warning(
-                f'Calculations for {i} initiated in separate thread'
-            )
+    clean = [x for x in ['wild', 'variant'] if f'pdb_{x}_clean' in STATE]
+    incremental = st.session_state.get('depth_incremental', False) and \
+        len(clean) == 2 and STATE.get('mut_calc', False)
+    if incremental:
+        tasks = {'wild and variant': partial(calculate_depths, True)}
+    else:
+        tasks = {x: partial(calculate_depth, file_name=x) for x in clean}
+    for name, target in tasks.items():
+        task = Thread(target=carry(target))
+        add_script_run_ctx(task)
+        task.start()
+        container.warning(
+            f'Calculations for {name} initiated in separate thread'
+        )
 
 
 def find_energy(container) -> None:
     """
     Call the calculate_energy function in a separate thread, and monitor
-    this thread using add_script_run_ctx
+    this thread using add_script_run_ctx. The prescreen is used when it is
+    selected or when no Rosetta executable is available. With the cropped
+    option and known mutations, one thread rescores the region around the
+    mutations for both structures
     :return:
     """
-    for i in ['wild', 'variant']:
-        if f'pdb_{i}_clean' in STATE.keys():
-            task = Thread(target=partial(calculate_energy, i))
-            add_script_run_ctx(task)
-            task.start()
-            container.warning(
-                f'Calculations for {i} initiated in separate thread'
-            )
+    fast = st.session_state.get('energy_prescreen', False) or \
+        not check_rosetta()
+    clean = [x for x in ['wild', 'variant'] if f'pdb_{x}_clean' in STATE]
+    cropped = st.session_state.get('energy_cropped', False) and not fast \
+        and len(clean) == 2 and STATE.get('mut_calc', False)
+    if cropped:
+        tasks = {'wild and variant': calculate_cropped_energy}
+    else:
+        tasks = {x: partial(calculate_energy, x, fast) for x in clean}
+    for name, target in tasks.items():
+        task = Thread(target=carry(target))
+        add_script_run_ctx(task)
+        task.start()
+        container.warning(
+            f'Calculations for {name} initiated in separate thread'
+        )
 
 
 def check_rosetta() -> bool:
@@ -331,8 +338,36 @@ def show_action(
     st.subheader(header)
     st.write(load_text('file_upload', text_file_name))
     if text_file_name == 'energy_files' and not check_rosetta():
-        st.error('No Rosetta Executable Available!')
-        return
+        st.warning(
+            'No Rosetta Executable Available! The energies will be '
+            'estimated with the built-in prescreen'
+        )
+    elif text_file_name == 'energy_files':
+        st.checkbox(
+            label='Fast prescreen instead of Rosetta',
+            value=False,
+            key='energy_prescreen',
+            help='Approximate Lennard-Jones, Coulomb and hydrogen bond '
+                 'energies in seconds, to triage variants before Rosetta'
+        )
+        st.checkbox(
+            label='Only rescore the region around the mutations',
+            value=False,
+            key='energy_cropped',
+            help='Rosetta scores the complete wild-type once and then only '
+                 'the residues near the mutations. Requires the mutations '
+                 'to be found first'
+        )
+    if text_file_name == 'residue_depth':
+        st.checkbox(
+            label='Reuse the wild-type surface for the variant',
+            value=False,
+            key='depth_incremental',
+            help='Only the surface around the mutations is recalculated '
+                 'for the variant, so its depths are approximate. Requires '
+                 'the mutations to be found first. Without a cached '
+                 'wild-type surface the variant is calculated in full'
+        )
     status = st.container()
     status.write('')
     if len(inspect.signature(callback).parameters.keys()):
@@ -408,6 +443,103 @@ def file_uploader_widgets() -> None:
             KEY += 1
 
 
+def apply_weights(weights: dict) -> None:
+    """
+    Recompute the total score of both energy breakdowns with new score term
+    weights. The breakdowns reported by Rosetta are kept, so weights can be
+    changed any number of times
+    :param weights:
+        The weight of each score term
+    :return:
+    """
+    STATE['weights'] = weights
+    for i in ['wild', 'variant']:
+        if f'energy_{i}_rosetta' not in STATE.keys():
+            STATE[f'energy_{i}_rosetta'] = STATE[f'energy_{i}']
+        STATE[f'energy_{i}'] = reweight(STATE[f'energy_{i}_rosetta'], weights)
+
+
+def weight_widgets() -> None:
+    """
+    Create the widgets to change the weights of the score terms
+    :return:
+    """
+    if not all(f'energy_{i}' in STATE.keys() for i in ['wild', 'variant']):
+        return
+    st.subheader('Score Term Weights')
+    st.write(load_text('file_upload', 'weights'))
+    current = STATE.get('weights', {})
+    terms = score_terms(STATE['energy_wild'].columns.tolist())
+    columns = st.columns(4)
+    weights = {}
+    for number, term in enumerate(terms):
+        weights[term] = columns[number % 4].number_input(
+            label=term,
+            value=float(current.get(term, 1.0)),
+            step=0.1,
+            key=f'weight_{term}'
+        )
+    st.button(
+        label='Apply Weights',
+        on_click=partial(apply_weights, weights)
+    )
+
+
+def prepare_snapshot() -> None:
+    """
+    Bundle the current session into a snapshot that can be downloaded
+    :return:
+    """
+    STATE['snapshot'] = export_session(
+        files={x: y for x, y in STATE.items() if x != 'snapshot'},
+        analysis=st.session_state['Interaction Analysis']
+    )
+
+
+def restore_snapshot(container) -> None:
+    """
+    Replace the session with the contents of an uploaded snapshot
+    :param container:
+        The container to write the status message to
+    :return:
+    """
+    upload = st.session_state['snapshot_upload']
+    if upload is None:
+        container.error('Please upload a snapshot first')
+        return
+    files, analysis = import_session(upload.getvalue())
+    st.session_state['File Upload'] = files
+    st.session_state['Interaction Analysis'] = analysis
+    container.success(f'Restored the session from {upload.name}')
+
+
+def snapshot_widgets() -> None:
+    """
+    Create the widgets to export and import a session snapshot
+    :return:
+    """
+    st.subheader('Session Snapshot')
+    st.write(load_text('file_upload', 'snapshot'))
+    st.button(label='Prepare Snapshot', on_click=prepare_snapshot)
+    if 'snapshot' in STATE.keys():
+        st.download_button(
+            label='Download Snapshot',
+            data=STATE['snapshot'],
+            file_name='analysis_snapshot.npz',
+            mime='application/octet-stream'
+        )
+    status = st.container()
+    st.file_uploader(
+        label='Restore a Snapshot',
+        type=['npz'],
+        key='snapshot_upload'
+    )
+    st.button(
+        label='Restore Snapshot',
+        on_click=partial(restore_snapshot, status)
+    )
+
+
 def main() -> None:
     """
     Creates the File Upload Page
@@ -421,3 +553,5 @@ def main() -> None:
         file_uploader_widgets()
         for key, value in actions.items():
             show_action(key, **value)
+        weight_widgets()
+        snapshot_widgets()
@@ -1,10 +1,21 @@
 import json
-from functools import partial
+import time
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+from io import StringIO
+from typing import Dict, List, Optional
+from bokeh.plotting import figure
 from utility import load_text
-from lib.energy_breakdown import energy_calc
+from lib.energy_breakdown import (
+    energy_calc, buried_hbonds, DEFAULT_DISTANCES, HBOND_CLASSES
+)
+from lib.fingerprint import frame_hash
+from lib.interactions import CategoryView, InteractionResults
+from lib.jobs import Job, Progress
+from lib.ranking import top_pairs, top_residues
+from lib.spatial import load_atoms, mutation_shell
 from st_aggrid import (
     AgGrid, DataReturnMode, GridUpdateMode, GridOptionsBuilder
 )
@@ -12,6 +23,20 @@ from st_aggrid import (
 STATE: dict
 
 KEY = 1
+POLL_INTERVAL = 0.5
+PAGE_SIZE = 30
+CHANGE_TYPES = ['A', 'B', 'C', 'D', 'E', 'F']
+GRID_COLUMNS = ['Change Type', 'Resi1', 'Resi2', 'Total']
+SWEEP_THRESHOLDS = np.round(np.arange(0, 10.05, 0.1), 1)
+HISTOGRAM_EDGES = np.arange(-10, 10.5, 0.5)
+CHANGE_COLORS = {
+    'a': '#1f77b4', 'b': '#ff7f0e', 'c': '#2ca02c',
+    'd': '#d62728', 'e': '#9467bd', 'f': '#8c564b'
+}
+DISTANCE_COLUMNS = {
+    'distance_wild': 'Wild Distance',
+    'distance_variant': 'Variant Distance'
+}
 categories = {
     'salt_changes': 'Salt Bridges',
     'sulfide_changes': 'Sulfide Bonds',
@@ -66,38 +91,359 @@ def check_files() -> bool:
     return all(constraints)
 
 
-# TODO: Put this in a separate thread to prevent GUI Freeze
-def start_calculations(progress_bar) -> None:
+def analysis_parameters() -> tuple:
+    """
+    The inputs of the analysis, with the energy breakdowns represented by
+    their fingerprints. When any of them change the results are stale, and
+    the analysis is repeated, reusing the joined pair table if the
+    breakdowns are unchanged
+    :return:
+    """
+    files = st.session_state['File Upload']
+    return (
+        frame_hash(files.get('energy_wild_rosetta', files['energy_wild'])),
+        frame_hash(
+            files.get('energy_variant_rosetta', files['energy_variant'])
+        ),
+        tuple(files['mutations'].index.tolist()),
+        STATE['use_shell'],
+        STATE['shell_radius'],
+        STATE['use_geometry'],
+        STATE['salt_distance'],
+        STATE['hbond_distance'],
+        STATE['hbond_cutoff'],
+        STATE['upper'],
+        STATE['lower'],
+        tuple(sorted(files.get('weights', {}).items()))
+    )
+
+
+def analysis_arguments() -> dict:
+    """
+    Collect the arguments of run_analysis from session state
+    :return:
+    """
+    files = st.session_state['File Upload']
+    cutoffs = {x: STATE['hbond_cutoff'] for x in HBOND_CLASSES}
+    cutoffs['salt_changes'] = STATE['hbond_cutoff']
+    max_distances = {
+        x: STATE['hbond_distance'] for x in ['sc_sc', 'bb_sc', 'bb_bb']
+    }
+    max_distances['salt'] = STATE['salt_distance']
+    return dict(
+        pdb_wild=files['pdb_wild_clean'],
+        pdb_variant=files['pdb_variant_clean'],
+        shell_radius=STATE['shell_radius'] if STATE['use_shell'] else None,
+        geometry=STATE['use_geometry'],
+        variant=files.get('energy_variant_rosetta', files['energy_variant']),
+        wild_type=files.get('energy_wild_rosetta', files['energy_wild']),
+        mutations=files['mutations'],
+        cutoffs=cutoffs,
+        thresholds=(STATE['upper'], STATE['lower']),
+        weights=files.get('weights'),
+        max_distances=max_distances
+    )
+
+
+def run_analysis(
+    progress: Progress,
+    pdb_wild: StringIO,
+    pdb_variant: StringIO,
+    shell_radius: Optional[float],
+    geometry: bool,
+    **arguments
+) -> InteractionResults:
+    """
+    Find the shell around the mutations and read the atoms of both
+    structures when they are needed, then run energy_calc. Runs on the
+    background worker and advances the progress after every step
+    :param progress:
+        The progress counter of the job
+    :param pdb_wild:
+        The cleaned wild-type PDB file
+    :param pdb_variant:
+        The cleaned variant PDB file
+    :param shell_radius:
+        The radius of the shell around the mutations, or None to analyze
+        every pair
+    :param geometry:
+        Whether to check salt bridge and hydrogen bond distances
+    :param arguments:
+        The remaining keyword arguments of energy_calc
+    :return:
+    """
+    joined = len(arguments['wild_type']) + len(arguments['variant'])
+    steps = 2 * (shell_radius is not None) + 2 * geometry
+    progress.set_total((steps + 4) * joined)
+    shell = None
+    if shell_radius is not None:
+        shell = mutation_shell(
+            pdb_wild=pdb_wild,
+            pdb_variant=pdb_variant,
+            positions=arguments['mutations'].index.tolist(),
+            radius=shell_radius
+        )
+        progress.advance(2 * joined)
+    atoms = {'wild': None, 'variant': None}
+    if geometry:
+        for name, pdb_file in [('wild', pdb_wild), ('variant', pdb_variant)]:
+            atoms[name] = load_atoms(pdb_file)
+            progress.advance(joined)
+    return energy_calc(
+        progress=progress,
+        shell=shell,
+        atoms_wild=atoms['wild'],
+        atoms_variant=atoms['variant'],
+        **arguments
+    )
+
+
+def start_calculations() -> None:
+    """
+    Submit the interaction analysis to the background worker pool. The
+    parameters are recorded once the job has finished
+    :return:
+    """
+    STATE['pending'] = analysis_parameters()
+    STATE['job'] = Job(run_analysis, **analysis_arguments())
+
+
+def update_results() -> None:
+    """
+    Repeat a completed analysis in the background after the mutations,
+    cutoffs, thresholds or score term weights have changed. The joined pair
+    table is reused from the cache, so usually only the classification is
+    recomputed. Parameters whose analysis failed or was cancelled are not
+    submitted again
+    :return:
+    """
+    parameters = analysis_parameters()
+    if 'job' in STATE.keys() or parameters in [
+        STATE.get('parameters'), STATE.get('declined')
+    ]:
+        return
+    start_calculations()
+    poll_calculations()
+
+
+def analysis_options() -> None:
     """
-    Execute the interaction analysis
-    :param progress_bar:
-        Progress bar to push updates to
+    Widgets to restrict the analysis to the shell of residues surrounding
+    the mutations, to enable the geometric checks and to set the class
+    cutoffs and summary thresholds
     :return:
     """
-    STATE['results'] = energy_calc(
-        variant=st.session_state['File Upload']['energy_variant'],
-        wild_type=st.session_state['File Upload']['energy_wild'],
-        mutations=st.session_state['File Upload']['mutations'],
-        bar=progress_bar
+    if 'use_shell' not in STATE.keys():
+        STATE['use_shell'] = False
+        STATE['shell_radius'] = 8.0
+    if 'use_geometry' not in STATE.keys():
+        STATE['use_geometry'] = False
+    if 'salt_distance' not in STATE.keys():
+        STATE['salt_distance'] = DEFAULT_DISTANCES['salt']
+        STATE['hbond_distance'] = DEFAULT_DISTANCES['sc_sc']
+    if 'hbond_cutoff' not in STATE.keys():
+        STATE['hbond_cutoff'] = 0.0
+        STATE['upper'] = 1.0
+        STATE['lower'] = -1.0
+    STATE['use_geometry'] = st.checkbox(
+        label='Check salt bridge and hydrogen bond distances',
+        value=STATE['use_geometry']
+    )
+    columns = st.columns(2)
+    STATE['salt_distance'] = columns[0].number_input(
+        label='Salt bridge distance (Angstrom)',
+        min_value=1.0,
+        max_value=6.0,
+        value=STATE['salt_distance'],
+        step=0.1,
+        disabled=not STATE['use_geometry']
+    )
+    STATE['hbond_distance'] = columns[1].number_input(
+        label='Donor-acceptor distance (Angstrom)',
+        min_value=1.0,
+        max_value=6.0,
+        value=STATE['hbond_distance'],
+        step=0.1,
+        disabled=not STATE['use_geometry']
+    )
+    STATE['use_shell'] = st.checkbox(
+        label='Only analyze pairs near the mutations',
+        value=STATE['use_shell']
     )
-    STATE['complete'] = True
+    STATE['shell_radius'] = st.number_input(
+        label='Shell radius around mutated residues (Angstrom)',
+        min_value=1.0,
+        max_value=50.0,
+        value=STATE['shell_radius'],
+        step=0.5,
+        disabled=not STATE['use_shell']
+    )
+    columns = st.columns(3)
+    STATE['hbond_cutoff'] = columns[0].number_input(
+        label='Hydrogen bond cutoff (REU)',
+        max_value=0.0,
+        value=STATE['hbond_cutoff'],
+        step=0.1
+    )
+    STATE['upper'] = columns[1].number_input(
+        label='Summary upper threshold',
+        value=STATE['upper'],
+        step=0.5
+    )
+    STATE['lower'] = columns[2].number_input(
+        label='Summary lower threshold',
+        value=STATE['lower'],
+        step=0.5
+    )
+
+
+def cancel_calculations() -> None:
+    """
+    Request cancellation of the running interaction analysis
+    :return:
+    """
+    STATE['job'].cancel()
+
+
+def poll_calculations() -> None:
+    """
+    Show the progress of the background analysis and collect its results
+    once it has finished. While the job runs the page reruns itself every
+    POLL_INTERVAL seconds.
+    :return:
+    """
+    job: Job = STATE['job']
+    status = job.status
+    if status in ['queued', 'running']:
+        st.progress(int(job.progress.fraction * 100))
+        st.write(
+            f'Analysis {status}: {job.progress.fraction:.0%} complete'
+        )
+        st.button(label='Cancel Calculations', on_click=cancel_calculations)
+        time.sleep(POLL_INTERVAL)
+        st.experimental_rerun()
+    del STATE['job']
+    parameters = STATE.pop('pending', None)
+    if status == 'complete':
+        STATE['results'] = job.result()
+        STATE['parameters'] = parameters
+        STATE.pop('tables', None)
+        STATE['complete'] = True
+    elif status == 'cancelled':
+        STATE['declined'] = parameters
+        st.warning('The analysis was cancelled')
+    else:
+        STATE['declined'] = parameters
+        st.error(f'The analysis failed: {job.error}')
+
+
+def materialize_tables(results: InteractionResults) -> Dict[str, pd.DataFrame]:
+    """
+    Build the result table of every category once per analysis, so that
+    reruns only have to slice out the page being displayed
+    :param results:
+        The output of energy_calc
+    :return:
+        A dictionary containing one table per category
+    """
+    tables = {}
+    for label in categories.keys():
+        view: CategoryView = results[label]
+        frames = []
+        distances = view.distance_columns
+        for key in view.keys():
+            if view.count(key) > 0:
+                frame = view.select(
+                    key, ['resi1', 'resi2', 'total'] + distances
+                )
+                frame.columns = GRID_COLUMNS[1:] + [
+                    DISTANCE_COLUMNS[x] for x in distances
+                ]
+                frame.insert(0, 'Change Type', key.upper())
+                frames.append(frame)
+        if frames:
+            table = pd.concat(frames, ignore_index=True)
+            for column in [DISTANCE_COLUMNS[x] for x in distances]:
+                table[column] = table[column].round(2)
+        else:
+            table = pd.DataFrame(columns=GRID_COLUMNS)
+        table['Change Type'] = pd.Categorical(
+            table['Change Type'], categories=CHANGE_TYPES
+        )
+        table['Total'] = table['Total'].astype(float).round(3)
+        tables[label] = table
+    return tables
+
+
+def sort_order(label: str, column: str, ascending: bool) -> np.ndarray:
+    """
+    Row order of a category table sorted by one column. Orders are computed
+    once and reused on later reruns
+    :param label:
+        The category of the table
+    :param column:
+        The column to sort by
+    :param ascending:
+        The direction of the sort
+    :return:
+        The positional row indices in sorted order
+    """
+    key = (label, column, ascending)
+    if key not in STATE['orders'].keys():
+        values = STATE['tables'][label][column]
+        if column == 'Change Type':
+            values = values.cat.codes
+        order = np.argsort(values.values, kind='stable')
+        STATE['orders'][key] = order if ascending else order[::-1]
+    return STATE['orders'][key]
+
+
+def query_rows(
+    label: str,
+    change: List[str],
+    residue: int,
+    column: str,
+    ascending: bool
+) -> np.ndarray:
+    """
+    Filter and sort a category table on the server
+    :param label:
+        The category of the table
+    :param change:
+        The change types to keep
+    :param residue:
+        Only keep pairs involving this position. Zero keeps every pair
+    :param column:
+        The column to sort by
+    :param ascending:
+        The direction of the sort
+    :return:
+        The positional indices of the matching rows in display order
+    """
+    table = STATE['tables'][label]
+    mask = table['Change Type'].isin(change).values
+    if residue:
+        mask = mask & (
+            (table['Resi1'].values == residue) |
+            (table['Resi2'].values == residue)
+        )
+    order = sort_order(label, column, ascending)
+    return order[mask[order]]
 
 
 def build_options(data: pd.DataFrame) -> dict:
     """
-    Configure options for the AgGrid Widget
+    Configure options for the AgGrid Widget. Sorting, filtering and paging
+    happen on the server, so they are disabled in the grid
     :param data:
     :return:
     """
     gb = GridOptionsBuilder.from_dataframe(data)
-    gb.configure_default_column(resizable=False)
-    gb.configure_pagination(
-        paginationAutoPageSize=False,
-        paginationPageSize=30
-    )
-    gb.configure_column(
-        field='Resi2',
-        menuTabs=['generalMenuTab', 'filterMenuTab']
+    gb.configure_default_column(
+        resizable=False,
+        sortable=False,
+        filterable=False,
+        suppressMenu=True
     )
     options = gb.build()
     return options
@@ -105,23 +451,55 @@ def build_options(data: pd.DataFrame) -> dict:
 
 def display_changes(label: str) -> None:
     """
-    Display the results in an AgGrid Widget
+    Display one page of the results in an AgGrid Widget
     :param label:
     :return:
     """
-    data = []
-    for key, df in STATE['results'][label].items():
-        if len(df) > 0:
-            df: pd.DataFrame
-            new = df[['resi1', 'resi2', 'total']].values.tolist()
-            new = [x + [key.upper()] for x in new]
-            data.extend(new)
-    data = pd.DataFrame(data)
-    data.columns = ['Resi1', 'Resi2', 'Total', 'Change Type']
-    data['Total'] = data['Total'].round(3)
-    data.insert(0, 'Change Type', data.pop('Change Type'))
+    table: pd.DataFrame = STATE['tables'][label]
+    if not len(table):
+        st.write('No changes were found in this category')
+        return
+    columns = st.columns(4)
+    change = columns[0].multiselect(
+        label='Change Type',
+        options=CHANGE_TYPES,
+        default=CHANGE_TYPES,
+        key=f'{label}_change'
+    )
+    residue = columns[1].number_input(
+        label='Residue (0 for all)',
+        min_value=0,
+        value=0,
+        step=1,
+        key=f'{label}_residue'
+    )
+    column = columns[2].selectbox(
+        label='Sort By',
+        options=table.columns.tolist(),
+        key=f'{label}_sort'
+    )
+    direction = columns[3].radio(
+        label='Order',
+        options=['Ascending', 'Descending'],
+        key=f'{label}_direction'
+    )
+    rows = query_rows(
+        label, change, int(residue), column, direction == 'Ascending'
+    )
+    pages = max(int(np.ceil(len(rows) / PAGE_SIZE)), 1)
+    page = st.number_input(
+        label=f'Page (of {pages})',
+        min_value=1,
+        max_value=pages,
+        value=1,
+        step=1,
+        key=f'{label}_page'
+    )
+    start = (int(page) - 1) * PAGE_SIZE
+    data = table.iloc[rows[start:start + PAGE_SIZE]]
+    data = data.astype({'Change Type': str})
     options = build_options(data)
-    grid_response = AgGrid(
+    AgGrid(
         dataframe=data,
         data_return_mode=DataReturnMode.AS_INPUT,
         update_mode=GridUpdateMode.NO_UPDATE,
@@ -129,6 +507,168 @@ def display_changes(label: str) -> None:
         try_to_convert_back_to_original_types=False,
         theme='streamlit'
     )
+    st.caption(
+        f'Showing rows {min(start + 1, len(rows))} to '
+        f'{min(start + PAGE_SIZE, len(rows))} of {len(rows)}'
+    )
+
+
+def display_sweep() -> None:
+    """
+    Display the number and sum of changes beyond a threshold chosen with a
+    slider. Every threshold is computed once per analysis, so moving the
+    slider only selects rows of the stored sweep
+    :return:
+    """
+    sweep: pd.DataFrame = STATE['sweep']
+    threshold = st.slider(
+        label='Threshold (REU)',
+        min_value=float(SWEEP_THRESHOLDS[0]),
+        max_value=float(SWEEP_THRESHOLDS[-1]),
+        value=1.0,
+        step=0.1,
+        key='sweep_threshold'
+    )
+    data = sweep[np.isclose(sweep['threshold'], threshold)]
+    data = data.set_index('change')[
+        ['above', 'below', 'sum_above', 'sum_below']
+    ].T
+    data.columns = [x.upper() for x in data.columns]
+    data.index = [
+        f'Energy >= {threshold:g}',
+        f'Energy <= {-threshold:g}',
+        f'Sum >= {threshold:g}',
+        f'Sum <= {-threshold:g}'
+    ]
+    st.table(data)
+
+
+def display_histogram() -> None:
+    """
+    Display the distribution of total energy changes of one interaction
+    class, with one histogram per change type
+    :return:
+    """
+    label = st.selectbox(
+        label='Interaction Class',
+        options=list(categories.keys())[::-1],
+        format_func=lambda x: categories[x],
+        key='histogram_class'
+    )
+    data: pd.DataFrame = STATE['histograms']
+    data = data[data['class'] == label]
+    plot = figure(height=350, tools='pan,wheel_zoom,reset,save')
+    plot.title = f'{categories[label]}: Distribution of Total Energy'
+    plot.xaxis.axis_label = 'Total Energy (REU)'
+    plot.yaxis.axis_label = 'Number of Pairs'
+    for change, color in CHANGE_COLORS.items():
+        part = data[data['change'] == change]
+        if not part['count'].sum():
+            continue
+        plot.quad(
+            left=part['left'],
+            right=part['right'],
+            top=part['count'],
+            bottom=0,
+            color=color,
+            alpha=0.4,
+            legend_label=change.upper()
+        )
+    plot.title.align = 'center'
+    st.bokeh_chart(plot, use_container_width=True)
+
+
+def display_top() -> None:
+    """
+    Display the pairs or residues with the largest change of the selected
+    score terms
+    :return:
+    """
+    results: InteractionResults = STATE['results']
+    columns = st.columns(4)
+    mode = columns[0].radio(
+        label='Rank',
+        options=['Pairs', 'Residues'],
+        key='top_mode'
+    )
+    terms = columns[1].multiselect(
+        label='Score Terms',
+        options=results.table.terms,
+        default=['total'],
+        key='top_terms'
+    )
+    count = columns[2].number_input(
+        label='Number of Results',
+        min_value=1,
+        max_value=1000,
+        value=20,
+        step=1,
+        key='top_count'
+    )
+    label = columns[3].selectbox(
+        label='Interaction Class',
+        options=list(categories.keys())[::-1],
+        format_func=lambda x: categories[x],
+        disabled=mode == 'Residues',
+        key='top_class'
+    )
+    if not terms:
+        st.write('Select at least one score term')
+        return
+    if mode == 'Residues':
+        data = top_residues(results.table, int(count), terms)
+        data.columns = ['Resi', 'Wild Type', 'Variant', 'Net Change']
+    else:
+        rows = None
+        if label != 'all_changes':
+            rows = np.concatenate(list(results.index[label].values()))
+        data = top_pairs(results.table, int(count), terms, rows)
+        data.columns = [
+            'Resi1', 'Resi2', 'Restype1', 'Restype2', 'In Wild-Type',
+            'In Variant', 'Change'
+        ]
+    st.dataframe(data)
+
+
+def display_buried() -> None:
+    """
+    Display the hydrogen bonds between buried residues that were lost or
+    gained in the variant
+    :return:
+    """
+    files = st.session_state['File Upload']
+    if not all(f'depth_{x}' in files.keys() for x in ['wild', 'variant']):
+        st.write('Residue depth must be calculated to find buried bonds')
+        return
+    columns = st.columns(2)
+    mode = columns[0].radio(
+        label='Hydrogen Bonds',
+        options=['Lost (Unsatisfied)', 'Gained (Newly Satisfied)'],
+        key='buried_mode'
+    )
+    threshold = columns[1].slider(
+        label='Depth Threshold (Angstrom)',
+        min_value=0.0,
+        max_value=15.0,
+        value=4.0,
+        step=0.5,
+        key='buried_threshold'
+    )
+    unsatisfied = mode.startswith('Lost')
+    data = buried_hbonds(
+        results=STATE['results'],
+        resi_depth=files['depth_wild' if unsatisfied else 'depth_variant'],
+        threshold=threshold,
+        unsatisfied=unsatisfied
+    )
+    data['hbond_class'] = data['hbond_class'].map(categories).astype(str)
+    data['change'] = data['change'].astype(str).str.upper()
+    data.columns = [
+        'Class', 'Change Type', 'Resi1', 'Resi2', 'Restype1', 'Restype2',
+        'Total', 'Depth1', 'Depth2', 'Max Depth'
+    ]
+    st.write(f'{len(data)} buried hydrogen bonds')
+    st.dataframe(data.round(3))
 
 
 def main():
@@ -160,23 +700,38 @@ def main():
             return
         st.success('Checking Pre-requisites: Success!')
 
-        container = st.container()
-        analysis_bar = st.progress(100 if STATE['complete'] else 0)
-        container.button(
+        analysis_options()
+        st.button(
             label='Start Calculations',
-            on_click=partial(
-                start_calculations,
-                progress_bar=analysis_bar
-            ),
-            disabled=STATE['complete']
+            on_click=start_calculations,
+            disabled=STATE['complete'] or 'job' in STATE.keys()
         )
+        if 'job' in STATE.keys():
+            poll_calculations()
         if not STATE['complete']:
             return
         st.success('Successfully Executed Analysis and Stored the Results')
+        update_results()
+        if 'tables' not in STATE.keys():
+            STATE['tables'] = materialize_tables(STATE['results'])
+            STATE['orders'] = {}
+            STATE['sweep'] = STATE['results'].threshold_sweep(
+                SWEEP_THRESHOLDS
+            )
+            STATE['histograms'] = STATE['results'].histograms(
+                HISTOGRAM_EDGES
+            )
 
         st.header('Results')
         with st.expander('Summary', expanded=True):
             st.table(STATE['results']['summary'])
+        with st.expander('Threshold Sweep'):
+            display_sweep()
+            display_histogram()
         for key, value in categories.items():
             with st.expander(value):
                 display_changes(key)
+        with st.expander('Largest Changes'):
+            display_top()
+        with st.expander('Buried Hydrogen Bonds'):
+            display_buried()
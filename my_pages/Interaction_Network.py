@@ -0,0 +1,122 @@
+import streamlit as st
+import pandas as pd
+from utility import load_text
+from lib.interactions import InteractionResults
+from lib.network import ChangeNetwork, trace_path
+
+STATE: dict
+
+
+def check_files() -> bool:
+    """
+    Check that a completed analysis exists in session state
+    :return:
+    """
+    constraints = [
+        'mutations' in st.session_state['File Upload'].keys(),
+        st.session_state['Interaction Analysis'].get('complete', False)
+    ]
+    return all(constraints)
+
+
+def build_network(terms: list, threshold: float) -> ChangeNetwork:
+    """
+    Build the change network of the current analysis, reusing the network
+    of the previous rerun when the options did not change
+    :param terms:
+        The score terms to add up
+    :param threshold:
+        The smallest absolute change that forms an edge
+    :return:
+    """
+    results: InteractionResults = \
+        st.session_state['Interaction Analysis']['results']
+    key = (tuple(terms), threshold)
+    if STATE.get('results') is not results or STATE.get('key') != key:
+        STATE['network'] = ChangeNetwork(results.table, terms, threshold)
+        STATE['results'] = results
+        STATE['key'] = key
+    return STATE['network']
+
+
+def display_paths(network: ChangeNetwork) -> None:
+    """
+    Display the shortest energetic paths from the mutated residues
+    :param network:
+    :return:
+    """
+    mutations = st.session_state['File Upload']['mutations']
+    data, predecessors = network.shortest_paths(mutations.index.tolist())
+    data.columns = ['Resi', 'Nearest Mutation', 'Path Length']
+    st.write(f'{len(data)} residues are reachable from the mutations')
+    st.dataframe(data)
+    target = st.number_input(
+        label='Show the path to residue',
+        min_value=0,
+        value=0,
+        step=1,
+        key='network_target'
+    )
+    if not target:
+        return
+    if target not in data['Resi'].values:
+        st.warning(f'Residue {target} is not reachable from the mutations')
+        return
+    path = trace_path(predecessors, int(target))
+    st.write(' → '.join(map(str, path)))
+
+
+def main():
+    """
+    Create the Interaction Network Main Page
+    :return:
+    """
+    global STATE
+    STATE = st.session_state['Interaction Network']
+    left, center, right = st.columns([1, 2, 1])
+    with center:
+        st.title('Interaction Change Network')
+        st.header('Introduction')
+        st.write(load_text('interaction_network', 'introduction'))
+        if not check_files():
+            st.error('Error: Run the Interaction Analysis first')
+            return
+        results: InteractionResults = \
+            st.session_state['Interaction Analysis']['results']
+        columns = st.columns(2)
+        terms = columns[0].multiselect(
+            label='Score Terms',
+            options=results.table.terms,
+            default=['total'],
+            key='network_terms'
+        )
+        threshold = columns[1].number_input(
+            label='Edge Threshold (REU)',
+            min_value=0.0,
+            value=0.5,
+            step=0.1,
+            key='network_threshold'
+        )
+        if not terms:
+            st.write('Select at least one score term')
+            return
+        network = build_network(terms, threshold)
+        st.write(
+            f'{len(network.nodes)} residues connected by '
+            f'{len(network.delta)} changed interactions'
+        )
+
+        st.header('Clusters')
+        clusters: pd.DataFrame = network.clusters()
+        clusters.columns = [
+            'Residues', 'Interactions', 'Net Change', 'Members'
+        ]
+        st.dataframe(clusters)
+
+        st.header('Energetic Paths from the Mutations')
+        display_paths(network)
+
+        st.header('Central Residues')
+        centrality: pd.DataFrame = network.centrality()
+        centrality.columns = ['Resi', 'Degree', 'Strength', 'Eigenvector']
+        st.dataframe(centrality)
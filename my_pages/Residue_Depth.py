@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
-from typing import Dict
+from typing import Dict, List, Tuple
 from bokeh.plotting import figure, ColumnDataSource
 from bokeh.models import CustomJS, DataTable, TableColumn
 from bokeh.models.tools import (
@@ -8,6 +9,9 @@ from bokeh.models.tools import (
 )
 from bokeh.layouts import gridplot
 from bokeh.models.widgets import Slider, CheckboxGroup, TextInput
+from lib.tensor import PairEnergyTensor
+from lib.burial import METRICS, residue_burial
+from lib.timing import span
 
 STATE: dict
 
@@ -18,43 +22,150 @@ def check_files() -> bool:
     :return:
     """
     constraints = [
-        'depth_wild' in st.session_state['File Upload'].keys(),
+        'pdb_wild_clean' in st.session_state['File Upload'].keys(),
         'energy_wild' in st.session_state['File Upload'].keys(),
-        'depth_variant' in st.session_state['File Upload'].keys(),
+        'pdb_variant_clean' in st.session_state['File Upload'].keys(),
         'energy_variant' in st.session_state['File Upload'].keys()
     ]
     return all(constraints)
 
 
-def changes() -> Dict[int, int]:
+def select_metric() -> str:
+    """
+    User selection of the burial metric on the x-axis. The MSMS residue
+    depth is offered once it is calculated, the other metrics are estimated
+    from the coordinates on demand
+    :return:
+    """
+    options = list(METRICS.keys())
+    if not all(
+        f'depth_{x}' in st.session_state['File Upload'].keys()
+        for x in ['wild', 'variant']
+    ):
+        options.remove('depth')
+    return st.selectbox(
+        label='Burial Metric',
+        options=options,
+        format_func=lambda x: METRICS[x]
+    )
+
+
+@st.cache(show_spinner=False)
+def burial(pdb_text: str, metric: str) -> Dict[int, float]:
+    """
+    Estimate the burial of every residue without MSMS
+    :param pdb_text:
+        The contents of the cleaned PDB file
+    :param metric:
+        The key of the metric in METRICS
+    :return:
+    """
+    with span('burial', metric=metric):
+        return residue_burial(pdb_text, [metric])[metric].to_dict()
+
+
+def residue_metric(file_name: str, metric: str) -> Dict[int, float]:
+    """
+    Fetch the MSMS residue depth, or estimate another burial metric from
+    the cleaned structure
+    :param file_name:
+    :param metric:
+        The key of the metric in METRICS
+    :return:
+    """
+    if metric == 'depth':
+        return st.session_state['File Upload'][f'depth_{file_name}']
+    return burial(
+        st.session_state['File Upload'][f'pdb_{file_name}_clean'].getvalue(),
+        metric
+    )
+
+
+def changes(
+    wild: pd.DataFrame,
+    variant: pd.DataFrame,
+    mutations: pd.DataFrame
+) -> Dict[int, int]:
     """
     Determine if a residue is a mutation with better energy, mutation with
     worse energy, or not a mutation.
+    :param wild:
+        The residue energy breakdown of the wild-type
+    :param variant:
+        The residue energy breakdown of the variant
+    :param mutations:
+        The mutations between the wild-type and variant
     :return:
     """
-    wild: pd.DataFrame = st.session_state['File Upload']['energy_wild']
-    variant: pd.DataFrame = st.session_state['File Upload']['energy_variant']
-    mutations: pd.DataFrame = st.session_state['File Upload']['mutations']
-    resi = wild['resi1'].values.tolist() + wild['resi2'].values.tolist()
-    mut_idx = list(mutations.index)
+    resi_max = int(max(
+        wild['resi1'].values.max(), wild['resi2'].values.max()
+    ))
+    size = 1 + int(max(
+        resi_max, variant[['resi1', 'resi2']].values.max(initial=0)
+    ))
+    net = (
+        PairEnergyTensor.cached(variant, ['total'], size) -
+        PairEnergyTensor.cached(wild, ['total'], size)
+    ).residue_sum('total')
+    mutated = set(mutations.index)
     results = {}
-    for i in range(1, max(resi) + 1):
-        if i not in mut_idx:
+    for i in range(1, resi_max + 1):
+        if i not in mutated:
             results[i] = 0
-            continue
-        query_wild = wild[
-            (wild['resi1'] == i) |
-            (wild['resi2'] == i)
-        ]
-        query_variant = variant[
-            (variant['resi1'] == i) |
-            (variant['resi2'] == i)
-        ]
-        net = query_variant['total'].sum() - query_wild['total'].sum()
-        results[i] = 1 if net > 0 else 2
+        else:
+            results[i] = 1 if net[i] > 0 else 2
     return results
 
 
+def net_energy(
+    inter: pd.DataFrame,
+    residues: List[int]
+) -> Tuple[Dict[int, float], Dict[int, list]]:
+    """
+    Add up the total energy of the pairs every residue takes part in
+    :param inter:
+        The residue energy breakdown dataframe
+    :param residues:
+        The residues to report
+    :return:
+        The net energy and the [resi1, resi2, total] pairs of every residue
+    """
+    totals = PairEnergyTensor.cached(inter, ['total']).residue_sum()
+    net = {i: totals[i] for i in residues}
+    return net, residue_entries(inter, residues)
+
+
+def residue_entries(
+    inter: pd.DataFrame,
+    residues: List[int]
+) -> Dict[int, list]:
+    """
+    Collect the [resi1, resi2, total] rows of the pairs every residue takes
+    part in, in the order of the dataframe
+    :param inter:
+        The residue energy breakdown dataframe
+    :param residues:
+        The residues to collect pairs for
+    :return:
+    """
+    rows = inter[['resi1', 'resi2', 'total']].values.tolist()
+    order = np.arange(len(inter))
+    keys = np.concatenate([inter['resi1'].values, inter['resi2'].values])
+    order = np.concatenate([order, order])
+    same = np.concatenate([
+        np.zeros(len(inter), dtype=bool),
+        inter['resi1'].values == inter['resi2'].values
+    ])
+    keys, order = keys[~same], order[~same]
+    sort = np.lexsort((order, keys))
+    keys, order = keys[sort], order[sort]
+    bounds = np.searchsorted(keys, [residues, np.add(residues, 1)])
+    return {
+        i: [rows[x] for x in order[start:end]]
+        for i, start, end in zip(residues, *bounds)
+    }
+
+
 @st.cache
 def read_js(version: int) -> str:
     """
@@ -120,30 +231,30 @@ def create_source_variant(
     return source
 
 
-def create_plot(file_name: str) -> dict:
+def create_plot(file_name: str, metric: str = 'depth') -> dict:
     """
     Create Bokeh Scatter plot components and tables to be assembled
     in the plot_master function
     :param file_name:
+    :param metric:
+        The key of the burial metric in METRICS shown on the x-axis
     :return:
     """
     # Fetch Data from Streamlit Session State
     inter: pd.DataFrame =\
         st.session_state['File Upload'][f'energy_{file_name}']
-    depth: Dict[int: float] =\
-        st.session_state['File Upload'][f'depth_{file_name}']
-    mut_map = changes()
+    depth: Dict[int: float] = residue_metric(file_name, metric)
+    mut_map = changes(
+        st.session_state['File Upload']['energy_wild'],
+        st.session_state['File Upload']['energy_variant'],
+        st.session_state['File Upload']['mutations']
+    )
     resi = inter['resi1'].values.tolist() + inter['resi2'].values.tolist()
     assert max(resi) == max(depth.keys())
     assert min(resi) == min(depth.keys()) == 1
 
     # Calculate Net Energy Changes
-    entries = {}
-    net = {}
-    for i in depth.keys():
-        query = inter[(inter['resi1'] == i) | (inter['resi2'] == i)]
-        net[i] = query['total'].sum()
-        entries[i] = query[['resi1', 'resi2', 'total']].values.tolist()
+    net, entries = net_energy(inter, list(depth.keys()))
 
     # Setup Bokeh Plot
     reset = ResetTool()
@@ -153,15 +264,16 @@ def create_plot(file_name: str) -> dict:
     save = SaveTool()
     tool_tips = [
         ('Position', '@position'),
-        ('Depth', '@x'),
+        (METRICS[metric], '@x'),
         ('Net Energy', '@y')
     ]
     plot = figure(
         tools=[reset, wheel_zoom, pan_tool, tap_tool, save],
         tooltips=tool_tips
     )
-    plot.title = f'{file_name.capitalize()}: Net Energy vs Depth'
-    plot.xaxis.axis_label = 'Residue Depth from Surface'
+    plot.title = f'{file_name.capitalize()}: Net Energy vs ' \
+        f'{"Depth" if metric == "depth" else "Burial"}'
+    plot.xaxis.axis_label = METRICS[metric]
     plot.yaxis.axis_label = 'Net Interaction Energy'
 
     # Create Data Source
@@ -204,14 +316,16 @@ def create_plot(file_name: str) -> dict:
     }
 
 
-def plot_master() -> None:
+def plot_master(metric: str = 'depth') -> None:
     """
     Create and show the Bokeh Figure
+    :param metric:
+        The key of the burial metric in METRICS shown on the x-axis
     :return:
     """
     # Create Scatter Plots
-    wild = create_plot('wild')
-    variant = create_plot('variant')
+    wild = create_plot('wild', metric)
+    variant = create_plot('variant', metric)
     wild['plot'].x_range = variant['plot'].x_range
     wild['plot'].y_range = variant['plot'].y_range
 
@@ -338,6 +452,8 @@ def main():
     STATE = st.session_state['Residue Depth']
     st.title('Residue Depth in the Protein')
     if check_files():
-        plot_master()
+        metric = select_metric()
+        with span('plot_master', metric=metric):
+            plot_master(metric)
     else:
         st.error('Not all Pre-Requisites are Calculated')
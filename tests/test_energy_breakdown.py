@@ -0,0 +1,42 @@
+from io import StringIO
+from benchmarks import synthetic
+from lib.energy_breakdown import energy_calc
+from lib.interactions import CHANGES
+from lib.spatial import load_atoms
+
+
+def counts(results) -> dict:
+    """
+    Count the pairs of every interaction class and change type
+    :param results:
+        The interaction results
+    :return:
+    """
+    return {
+        (x, y): results[x].count(y)
+        for x in list(results.keys())[1:] for y in CHANGES
+    }
+
+
+def test_geometry_is_not_cached():
+    """
+    A run with measured distances must not change the counts of a later
+    run without atom tables
+    """
+    wild = synthetic.sequence(200)
+    variant, mutations = synthetic.mutate(wild, 0.02)
+    energy_wild = synthetic.breakdown(wild)
+    energy_variant = synthetic.variant_breakdown(
+        energy_wild, variant, mutations
+    )
+    atoms = [
+        load_atoms(StringIO(synthetic.structure(x))) for x in [wild, variant]
+    ]
+    before = counts(energy_calc(energy_variant, energy_wild, mutations))
+    measured = counts(energy_calc(
+        energy_variant, energy_wild, mutations,
+        atoms_wild=atoms[0], atoms_variant=atoms[1]
+    ))
+    after = counts(energy_calc(energy_variant, energy_wild, mutations))
+    assert measured != before
+    assert after == before